@@ -6,6 +6,8 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
+import json
+import logging
 import os
 import typing
 
@@ -14,10 +16,12 @@ import flask_saml_sso
 import werkzeug
 
 from . import exceptions
+from . import lora
 from . import service
 from . import settings
 from . import util
 from .auth import base
+from .service.address_handler import dar
 
 basedir = os.path.dirname(__file__)
 templatedir = os.path.join(basedir, 'templates')
@@ -50,6 +54,17 @@ def create_app(overrides: typing.Dict[str, typing.Any] = None):
         blueprint.before_request(flask_saml_sso.check_saml_authentication)
         app.register_blueprint(blueprint)
 
+    @app.after_request
+    def log_cache_statistics(response):
+        if app.logger.isEnabledFor(logging.DEBUG):
+            app.logger.debug('cache statistics: %s', json.dumps({
+                'classes': lora.classification_cache.stats,
+                'unit_hierarchies': lora.unit_hierarchy_cache.stats,
+                'dar_addresses': dar.address_cache.stats,
+            }, sort_keys=True))
+
+        return response
+
     @app.errorhandler(Exception)
     def handle_invalid_usage(error):
         """
@@ -7,4 +7,6 @@
 #
 
 from . import base  # noqa
+from . import benchmark  # noqa
+from . import dar  # noqa
 from . import lora  # noqa
@@ -0,0 +1,210 @@
+#
+# Copyright (c) 2017-2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+'''Micro-benchmarks for MORA.
+
+'''
+
+import collections
+import json
+import os
+import tempfile
+import timeit
+import tracemalloc
+
+import click
+import dateutil.parser
+
+from . import base
+from .. import util
+from ..importing import preimport
+from ..importing import spreadsheets
+
+
+@base.cli.group('benchmark')
+def group():
+    '''Subcommands for measuring the performance of MORA internals.'''
+
+
+def _get_timestamps(obj):
+    '''Extract all timestamps in the given LoRA data.'''
+    if isinstance(obj, dict):
+        if isinstance(obj.get('virkning'), dict):
+            for key in ('from', 'to'):
+                if isinstance(obj['virkning'].get(key), str):
+                    yield obj['virkning'][key]
+
+        for v in obj.values():
+            yield from _get_timestamps(v)
+
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from _get_timestamps(v)
+
+
+def _parse_with_dateutil(s):
+    '''Parse a timestamp as we did prior to having our own parser.'''
+    if s in ('infinity', '-infinity'):
+        return None
+
+    try:
+        dt = dateutil.parser.isoparse(s)
+    except ValueError:
+        dt = dateutil.parser.parse(s, dayfirst=True)
+
+    if not dt.tzinfo:
+        return dt.replace(tzinfo=util.DEFAULT_TIMEZONE)
+    else:
+        return dt.astimezone(util.DEFAULT_TIMEZONE)
+
+
+def _parse_uncached(s):
+    if s in ('infinity', '-infinity'):
+        return None
+
+    return util.from_iso_time.__wrapped__(s)
+
+
+def _parse_cached(s):
+    return util.parsedatetime(s)
+
+
+@group.command('timestamps')
+@click.option('--repeat', '-r', default=5, show_default=True,
+              help='Run each parser this many times, keeping the best.')
+@click.argument('dumps', nargs=-1, required=True, type=click.File())
+def benchmark_timestamps(repeat, dumps):
+    '''Measure the parsing of all timestamps in the given files.
+
+    Each file should contain JSON as returned by LoRA, e.g. the
+    results of listing or searching for a couple of thousand objects.
+    The parse cache is cleared before each run.
+
+    '''
+
+    timestamps = [ts for fp in dumps for ts in _get_timestamps(json.load(fp))]
+
+    click.echo('{} timestamps, {} distinct'.format(
+        len(timestamps), len(set(timestamps)),
+    ))
+
+    if not timestamps:
+        return
+
+    baseline = None
+
+    for name, parse in (
+        ('dateutil', _parse_with_dateutil),
+        ('fast parser', _parse_uncached),
+        ('fast parser, cached', _parse_cached),
+    ):
+        def run():
+            util.from_iso_time.cache_clear()
+
+            for ts in timestamps:
+                parse(ts)
+
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        baseline = baseline or best
+
+        click.echo('{:<24}{:>8.3f} ms{:>8.1f}x'.format(
+            name, best * 1000, baseline / best,
+        ))
+
+
+def _measure(func, repeat):
+    '''Return the best time of running the given function, and the
+    peak memory allocated during a single run.'''
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+
+    tracemalloc.start()
+
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+
+@group.command('preimport')
+@click.option('--repeat', '-r', default=5, show_default=True,
+              help='Run each reader this many times, keeping the best.')
+@click.argument('sheets', nargs=-1, required=True, type=click.Path())
+def benchmark_preimport(repeat, sheets):
+    '''Measure reading preimported data as JSON and in our format.
+
+    The given spreadsheets are converted into both formats, which we
+    then read fully, lazily and -- for our format only -- a single
+    sheet of.
+
+    '''
+
+    data = spreadsheets.load_data(sheets, exact=True)
+
+    if not data:
+        return
+
+    # pick the largest sheet for reading just one
+    title = max(data, key=lambda k: len(data[k]))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_path = os.path.join(tmpdir, 'preimport.json')
+        preimport_path = os.path.join(tmpdir, 'preimport.jsonl')
+
+        with open(json_path, 'w') as fp:
+            json.dump(data, fp)
+
+        with open(preimport_path, 'w') as fp:
+            preimport.dump(data, fp)
+
+        del data
+
+        def read_json():
+            with open(json_path) as fp:
+                return json.load(fp)
+
+        def read_all():
+            return {
+                title: list(preimport.iter_sheet(preimport_path, title))
+                for title in preimport.get_sheet_names(preimport_path)
+            }
+
+        def read_lazily():
+            for title in preimport.get_sheet_names(preimport_path):
+                collections.deque(
+                    preimport.iter_sheet(preimport_path, title),
+                    maxlen=0,
+                )
+
+        def read_sheet():
+            return list(preimport.iter_sheet(preimport_path, title))
+
+        click.echo('{:<24}{:>10}'.format('JSON', '{:.1f} KiB'.format(
+            os.path.getsize(json_path) / 1024,
+        )))
+        click.echo('{:<24}{:>10}'.format('preimport', '{:.1f} KiB'.format(
+            os.path.getsize(preimport_path) / 1024,
+        )))
+        click.echo()
+
+        baseline = None
+
+        for name, func in (
+            ('JSON', read_json),
+            ('preimport', read_all),
+            ('preimport, lazily', read_lazily),
+            ('preimport, ' + title, read_sheet),
+        ):
+            best, peak = _measure(func, repeat)
+            baseline = baseline or best
+
+            click.echo('{:<40}{:>10.3f} ms{:>8.1f}x{:>10.1f} KiB'.format(
+                name, best * 1000, baseline / best, peak / 1024,
+            ))
@@ -0,0 +1,53 @@
+#
+# Copyright (c) 2017-2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+'''Management of the local copy of DAR.
+
+'''
+
+import time
+
+import click
+
+from . import base
+from .. import dawa
+from .. import settings
+
+
+@base.cli.group('dar')
+def group():
+    '''Subcommands for the local copy of DAR.'''
+
+
+@group.command('import')
+@click.option('--store', '-s', type=click.Path(dir_okay=False),
+              default=lambda: settings.DAR_STORE_PATH,
+              help='Path of the store; defaults to DAR_STORE_PATH.')
+@click.argument('dumps', nargs=-1, required=True,
+                type=click.File(encoding='utf-8'))
+def import_(store, dumps):
+    '''Load addresses and access addresses from DAWA dumps.
+
+    See the documentation of mora.dawa on obtaining them.
+
+    '''
+
+    if not store:
+        raise click.BadParameter('no store specified', param_hint='--store')
+
+    addrstore = dawa.AddressStore(store)
+
+    for fp in dumps:
+        t0 = time.perf_counter()
+        count = addrstore.load(dawa.iter_dump(fp))
+
+        click.echo('{}: {} addresses in {:.1f}s'.format(
+            fp.name, count, time.perf_counter() - t0,
+        ))
+
+    click.echo('{}: {} addresses in total'.format(store, len(addrstore)))
@@ -79,7 +79,6 @@ def lora_update(path, input):
 @click.argument('sheets', nargs=-1, type=click.Path())
 @click.option('--target', '-t', default=settings.LORA_URL)
 @click.option('--output', '-o', type=click.File('w'))
-@click.option('--compact', '-c', is_flag=True)
 @click.option('--dry-run', '-n', is_flag=True,
               help=("don't actually change anything"))
 @click.option('--verbose', '-v', count=True,
@@ -90,11 +89,17 @@ def lora_update(path, input):
               help='Stop at first error.')
 @click.option('--include', '-I', multiple=True,
               help='include only the given types.')
-@click.option('--check', '-c', is_flag=True,
+@click.option('--check', is_flag=True,
               help=('check if import would overwrite any existing '
                     'objects'))
 @click.option('--exact', '-e', is_flag=True,
               help="don't calculate missing values")
+@click.option('--stream', is_flag=True,
+              help=('read the input lazily, rather than loading it '
+                    'all into memory'))
+@click.option('--manifest', type=click.Path(dir_okay=False),
+              help=('only import objects that changed since the last '
+                    'import using this manifest'))
 @click.option('--delimiter', '-d', default=None, type=str)
 @click.option('--charset', '-c', default=None, type=str,
               help='input file encoding')
@@ -0,0 +1,247 @@
+#
+# Copyright (c) 2017-2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+'''Local address store
+-------------------
+
+This module provides a local, on-disk copy of the addresses in DAR,
+so that we may look them up without asking DAWA -- which is
+considerably faster, and keeps working when DAWA is slow or
+unavailable.
+
+The store is an SQLite database at ``DAR_STORE_PATH``, loaded from
+dumps of DAWA, e.g.::
+
+   curl -o adresser.json \\
+     'https://dawa.aws.dk/adresser?struktur=mini&ndjson'
+   curl -o adgangsadresser.json \\
+     'https://dawa.aws.dk/adgangsadresser?struktur=mini&ndjson'
+   python -m mora.cli dar import adresser.json adgangsadresser.json
+
+Both JSON arrays and newline-delimited JSON are supported. Each
+object should use the *mini* structure, as that is what we otherwise
+get from DAWA.
+
+'''
+
+import json
+import re
+import sqlite3
+import threading
+import typing
+
+from . import settings
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS addresses (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    municipality INTEGER,
+    data TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS addresses_key ON addresses (key, kind);
+'''
+
+ADDRESS = 'adresse'
+ACCESS_ADDRESS = 'adgangsadresse'
+
+_BATCH_SIZE = 10000
+_SEPARATORS = re.compile(r'[\s\[\],]*')
+
+
+def _get_key(text: str) -> str:
+    '''Normalise the textual representation of an address for
+    lookups.'''
+    return re.sub(r'\s+', ' ', text.strip().lower())
+
+
+def _get_text(addr: dict) -> str:
+    if addr.get('betegnelse'):
+        return addr['betegnelse']
+
+    # local import, as the handlers depend on us
+    from .service.address_handler import dar
+
+    return ''.join(dar.DARAddressHandler._address_string_chunks(addr))
+
+
+def iter_dump(fp: typing.TextIO,
+              chunk_size: int=1 << 16) -> typing.Iterator[dict]:
+    '''Read the objects of a dump, one at a time, without loading all
+    of it in memory.
+
+    The dump is either a JSON array, or a sequence of objects, one
+    per line.
+
+    '''
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    while True:
+        pos = _SEPARATORS.match(buf, pos).end()
+
+        try:
+            if pos == len(buf):
+                raise ValueError('need more data')
+
+            obj, pos = decoder.raw_decode(buf, pos)
+
+        except ValueError:
+            if eof:
+                if pos == len(buf):
+                    return
+
+                raise
+
+            chunk = fp.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+
+            continue
+
+        yield obj
+
+
+class AddressStore:
+    '''An SQLite database of addresses and access addresses, keyed by
+    their UUID.
+
+    Each thread gets its own connection, as SQLite requires.
+
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self.__local = threading.local()
+
+        with self.connection as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.__local, 'connection', None)
+
+        if conn is None:
+            conn = self.__local.connection = sqlite3.connect(self.path)
+
+        return conn
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM addresses',
+        ).fetchone()[0]
+
+    def get(self, addrid: str) -> typing.Optional[dict]:
+        '''Return the given address or access address, if known.'''
+        row = self.connection.execute(
+            'SELECT data FROM addresses WHERE id = ?',
+            (str(addrid).lower(),),
+        ).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def find(self, text: str,
+             kind: str=ADDRESS) -> typing.Optional[str]:
+        '''Return the UUID of the only address with the given textual
+        representation, if any, e.g. ``Pilestræde 43, 3., 1112
+        København K``.'''
+        rows = self.connection.execute(
+            'SELECT id FROM addresses WHERE key = ? AND kind = ? LIMIT 2',
+            (_get_key(text), kind),
+        ).fetchall()
+
+        return rows[0][0] if len(rows) == 1 else None
+
+    def autocomplete(self, q: str, kind: str,
+                     municipality: typing.Optional[int]=None,
+                     limit: int=10) -> typing.List[typing.Tuple[str, str]]:
+        '''Return the text and UUID of the addresses starting with the
+        given query, optionally within a municipality.'''
+        rows = self.connection.execute(
+            'SELECT id, data FROM addresses '
+            'WHERE key >= ? AND key < ? AND kind = ? '
+            'AND (? IS NULL OR municipality = ?) '
+            'ORDER BY key LIMIT ?',
+            (
+                _get_key(q), _get_key(q) + '\uffff', kind,
+                municipality, municipality,
+                limit,
+            ),
+        )
+
+        return [
+            (_get_text(json.loads(data)), addrid)
+            for addrid, data in rows
+        ]
+
+    def load(self, addrs: typing.Iterable[dict]) -> int:
+        '''Add or replace the given addresses and access addresses,
+        returning the amount of them.
+
+        Addresses are told apart by their reference to an access
+        address.
+
+        '''
+        count = 0
+        conn = self.connection
+
+        def rows():
+            nonlocal count
+
+            for addr in addrs:
+                count += 1
+
+                yield (
+                    str(addr['id']).lower(),
+                    ADDRESS if 'adgangsadresseid' in addr else ACCESS_ADDRESS,
+                    _get_key(_get_text(addr)),
+                    int(addr['kommunekode'])
+                    if addr.get('kommunekode') else None,
+                    json.dumps(addr),
+                )
+
+        it = rows()
+
+        while True:
+            batch = [row for _, row in zip(range(_BATCH_SIZE), it)]
+
+            if not batch:
+                break
+
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO addresses VALUES (?, ?, ?, ?, ?)',
+                    batch,
+                )
+
+        return count
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> typing.Optional[AddressStore]:
+    '''Return the store at ``DAR_STORE_PATH``, or ``None`` if not
+    configured.'''
+    global _store
+
+    if not settings.DAR_STORE_PATH:
+        return None
+
+    with _store_lock:
+        if _store is None or _store.path != settings.DAR_STORE_PATH:
+            _store = AddressStore(settings.DAR_STORE_PATH)
+
+        return _store
@@ -0,0 +1,295 @@
+#
+# Copyright (c) 2017-2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+'''Unit hierarchy
+--------------
+
+This module provides an in-process index of how the organisational
+units of an organisation relate to each other over time, allowing us
+to answer questions such as "what are the ancestors of this unit?"
+or "how many children does it have?" without walking the tree one
+LoRA request at a time.
+
+Each index holds the full history of the organisation, so that it
+may serve any point in time, and is kept in
+:py:data:`mora.lora.unit_hierarchy_cache`. Whenever we write to an
+organisational unit, we mark it as changed in each index, and look it
+up anew prior to the next query.
+
+Please note that each process has an index of its own, so changes
+made through other processes only appear once the index expires,
+after ``ORG_UNIT_HIERARCHY_CACHE_TTL`` seconds. For this reason, we
+only use it where slightly outdated data is acceptable:
+
+* for prefetching the units we're likely to need, e.g. the ancestors
+  of a unit, which we then read and check as usual, and
+* for the statistics of an organisation.
+
+Anything else, such as the children of a unit, or the amount of them,
+we search for in LoRA.
+
+Building an index reads the full history of every unit of the
+organisation, so only the tree of units and the statistics of an
+organisation do so. Anything else merely uses an index that already
+exists, and otherwise reads unit by unit.
+
+'''
+
+import collections
+import datetime
+import threading
+import typing
+
+from . import lora
+from . import mapping
+from . import settings
+from . import util
+
+
+Interval = typing.Tuple[datetime.datetime, datetime.datetime]
+
+
+def _get_interval(entry: dict) -> Interval:
+    return (
+        util.parsedatetime(entry['virkning']['from']),
+        util.parsedatetime(entry['virkning']['to']),
+    )
+
+
+def _overlaps(intervals: typing.Iterable[Interval],
+              start: datetime.datetime, end: datetime.datetime) -> bool:
+    return any(
+        entry_start < end and entry_end > start
+        for entry_start, entry_end in intervals
+    )
+
+
+class UnitHierarchy:
+    '''Index of the organisational units of one organisation.
+
+    Queries take the interval of interest, typically that of a
+    :py:class:`mora.lora.Connector`, and consider any relation in
+    effect at some point within it -- just as LoRA does.
+
+    :param orgid: The UUID of the organisation.
+    :param units: Pairs of UUIDs and full registrations of its units.
+
+    '''
+
+    def __init__(self, orgid: str,
+                 units: typing.Iterable[typing.Tuple[str, dict]]):
+        self.orgid = orgid
+
+        self.__lock = threading.RLock()
+        self.__changed = set()
+
+        self.__parents = {}
+        self.__active = {}
+        self.__children = collections.defaultdict(set)
+
+        self.update(units)
+
+    def update(self, units: typing.Iterable[
+            typing.Tuple[str, typing.Optional[dict]]]):
+        '''Replace the entries of the given units, dropping those that
+        no longer exist, or never belonged to the organisation.'''
+        with self.__lock:
+            for unitid, unit in units:
+                unitid = str(unitid)
+
+                for start, end, parentid in self.__parents.pop(unitid, ()):
+                    self.__children[parentid].discard(unitid)
+
+                self.__active.pop(unitid, None)
+
+                if not unit or self.orgid not in set(
+                    mapping.BELONGS_TO_FIELD.get_uuids(unit),
+                ):
+                    continue
+
+                self.__parents[unitid] = sorted(
+                    _get_interval(entry) + (entry['uuid'],)
+                    for entry in mapping.PARENT_FIELD.get(unit)
+                )
+
+                self.__active[unitid] = [
+                    _get_interval(entry)
+                    for entry in mapping.ORG_UNIT_GYLDIGHED_FIELD.get(unit)
+                    if entry.get('gyldighed') == 'Aktiv'
+                ]
+
+                for start, end, parentid in self.__parents[unitid]:
+                    self.__children[parentid].add(unitid)
+
+    def invalidate(self, unitid: str):
+        '''Mark the given unit as changed, so that we look it up anew
+        prior to the next query; see :py:func:`get_hierarchy`.'''
+        with self.__lock:
+            self.__changed.add(str(unitid))
+
+    def pop_changed(self) -> typing.Set[str]:
+        with self.__lock:
+            changed, self.__changed = self.__changed, set()
+
+        return changed
+
+    def __contains__(self, unitid):
+        with self.__lock:
+            return str(unitid) in self.__parents
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__parents)
+
+    def is_active(self, unitid: str, start: datetime.datetime,
+                  end: datetime.datetime) -> bool:
+        with self.__lock:
+            return _overlaps(self.__active.get(str(unitid), ()), start, end)
+
+    def get_parent(self, unitid: str, start: datetime.datetime,
+                   end: datetime.datetime) -> typing.Optional[str]:
+        '''Return the parent of the given unit, which may be the
+        organisation itself, or ``None`` if unknown.'''
+        with self.__lock:
+            for parent_start, parent_end, parentid in self.__parents.get(
+                str(unitid), (),
+            ):
+                if parent_start < end and parent_end > start:
+                    return parentid
+
+        return None
+
+    def get_ancestors(self, unitid: str, start: datetime.datetime,
+                      end: datetime.datetime) -> typing.List[str]:
+        '''Return the ancestors of the given unit, nearest first, and
+        excluding the organisation itself.'''
+        ancestors = []
+
+        with self.__lock:
+            parentid = self.get_parent(unitid, start, end)
+
+            # guard against loops, as we might be asked to check for them
+            while (
+                parentid in self and
+                parentid != str(unitid) and
+                parentid not in ancestors
+            ):
+                ancestors.append(parentid)
+                parentid = self.get_parent(parentid, start, end)
+
+        return ancestors
+
+    def get_children(self, parentid: str, start: datetime.datetime,
+                     end: datetime.datetime) -> typing.List[str]:
+        '''Return the active units immediately below the given unit or
+        organisation.'''
+        with self.__lock:
+            return sorted(
+                unitid
+                for unitid in self.__children.get(str(parentid), ())
+                if self.is_active(unitid, start, end) and any(
+                    parent_start < end and parent_end > start
+                    for parent_start, parent_end, candidateid
+                    in self.__parents[unitid]
+                    if candidateid == str(parentid)
+                )
+            )
+
+    def count_children(self, parentid: str, start: datetime.datetime,
+                       end: datetime.datetime) -> int:
+        return len(self.get_children(parentid, start, end))
+
+    def count_active(self, start: datetime.datetime,
+                     end: datetime.datetime) -> int:
+        with self.__lock:
+            return sum(
+                _overlaps(intervals, start, end)
+                for intervals in self.__active.values()
+            )
+
+
+# one lock per organisation, so that concurrent requests wait for the
+# index to be built rather than building it each
+_build_locks = collections.defaultdict(threading.Lock)
+_build_locks_lock = threading.Lock()
+
+
+def build_hierarchy(orgid: str) -> UnitHierarchy:
+    '''Index every unit that ever belonged to the given organisation.'''
+    c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
+
+    def get_units():
+        start = 0
+
+        while True:
+            unitids = c.organisationenhed(
+                tilhoerer=orgid,
+                foersteresultat=start,
+                maximalantalresultater=settings.DEFAULT_PAGE_SIZE,
+            )
+
+            yield from c.organisationenhed.get_all(
+                uuid=unitids,
+                limit=len(unitids),
+            )
+
+            if len(unitids) < settings.DEFAULT_PAGE_SIZE:
+                break
+
+            start += len(unitids)
+
+    return UnitHierarchy(str(orgid), get_units())
+
+
+def get_hierarchy(orgid: str, *,
+                  build: bool=True) -> typing.Optional[UnitHierarchy]:
+    '''Return the index for the given organisation, building it if
+    needed, or ``None`` if disabled by
+    ``ORG_UNIT_HIERARCHY_CACHE_SIZE``.
+
+    :param build: Whether to build the index should we have none,
+        rather than returning ``None``. Building it reads the entire
+        organisation, so callers that mustn't block should pass
+        ``False``.
+
+    Should any units have changed since we last asked, we look up
+    just those, rather than building the index anew.
+
+    '''
+    if not orgid or lora.unit_hierarchy_cache.maxsize <= 0:
+        return None
+
+    hierarchy = lora.unit_hierarchy_cache.get(str(orgid))
+
+    if hierarchy is None:
+        if not build:
+            return None
+
+        with _build_locks_lock:
+            lock = _build_locks[str(orgid)]
+
+        with lock:
+            # another request might have built it while we waited
+            hierarchy = lora.unit_hierarchy_cache.get(str(orgid))
+
+            if hierarchy is None:
+                hierarchy = build_hierarchy(orgid)
+                lora.unit_hierarchy_cache[str(orgid)] = hierarchy
+
+    changed = hierarchy.pop_changed()
+
+    if changed:
+        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
+        units = dict(c.organisationenhed.get_all(
+            uuid=sorted(changed),
+            limit=len(changed),
+        ))
+
+        hierarchy.update((unitid, units.get(unitid)) for unitid in changed)
+
+    return hierarchy
@@ -7,21 +7,29 @@
 #
 
 import collections
-import functools
 import json
 
 import click
-import grequests
 import pyexcel
 import requests
 
 from .. import lora
 from .. import util
-from ..service import common
 
+from . import pipeline
 from . import processors
 
 
+def _get_orgid(obj):
+    orgid = obj['tilhoerer']
+
+    # fixup for aarhus
+    if orgid == '3a87187c-f25a-40a1-8d42-312b2e2b43bd':
+        orgid = "a5769433-09df-4f92-98ae-a3e45501da88"
+
+    return orgid
+
+
 def run(sheets, target, delimiter, include, jobs, **kwargs):
     click.echo('loading...')
 
@@ -43,54 +51,74 @@ def run(sheets, target, delimiter, include, jobs, **kwargs):
     # strip any UTF-8 BOM
     headers = [c.lower().lstrip('\ufeff').strip() for c in sheet.colnames]
 
+    rows = [
+        obj
+        for obj in (dict(zip(headers, row)) for row in sheet.rows())
+        if not include or any(s in obj['brugernavn'] for s in include)
+    ]
+
     session = requests.Session()
 
-    @functools.lru_cache()
-    def getclass(orgid, typename, **kwargs):
+    def get_classes(key):
+        orgid, facet = key
+
         r = session.get(
-            '{}/service/o/{}/f/{}'.format(target.rstrip('/'),
-                                          orgid, typename),
+            '{}/service/o/{}/f/{}/'.format(target.rstrip('/'),
+                                           orgid, facet),
             headers={
                 'X-Requested-With': 'XMLHttpRequest',
             },
         )
 
-        assert r.ok
+        r.raise_for_status()
 
-        for addrtype in r.json()['data']['items']:
-            if all(addrtype[k] == v for k, v in kwargs.items()):
-                return addrtype
+        return collections.OrderedDict(
+            (cls['user_key'], cls)
+            for cls in r.json()['data']['items']
+        )
+
+    # look up the classes of each organisation once, up front
+    keys = [
+        (orgid, facet)
+        for orgid in sorted(set(map(_get_orgid, rows)))
+        for facet in ('engagement_type', 'address_type')
+    ]
+
+    classes = dict(zip(keys, lora.concurrent_map(get_classes, keys, jobs)))
 
     c = lora.Connector()
 
-    unitids = set(map(
-        str.lower,
-        sheet.column[headers.index('tilknyttetenhed')],
-    ))
-    units = dict(c.organisationenhed.get_all(uuid=unitids))
+    unitids = {obj['tilknyttetenhed'].lower() for obj in rows}
+    units = dict(c.organisationenhed.get_all(uuid=unitids,
+                                             limit=len(unitids)))
 
     users = collections.OrderedDict()
     userrels = collections.defaultdict(collections.OrderedDict)
 
     missing_engagements = collections.Counter()
 
+    def wash(obj):
+        return processors.wash_address(obj['adresse'],
+                                       obj['postnummer'],
+                                       obj['postdistrikt'])
+
+    # washing addresses is the slow part, so do that concurrently
     with click.progressbar(
-        sheet.rows(),
+        pipeline.imap(wash, rows, jobs=jobs),
         label='processing',
         show_pos=True,
         width=0,
-        length=sheet.number_of_rows(),
+        length=len(rows),
     ) as bar:
-        for row in bar:
-            obj = dict(zip(headers, row))
+        for obj, future in bar:
+            addrid = future.result()
 
             userid = obj['objektid']
-            orgid = obj['tilhoerer']
+            orgid = _get_orgid(obj)
             unitid = obj['tilknyttetenhed'].lower()
 
-            # fixup for aarhus
-            if orgid == '3a87187c-f25a-40a1-8d42-312b2e2b43bd':
-                orgid = "a5769433-09df-4f92-98ae-a3e45501da88"
+            engagement_types = classes[orgid, 'engagement_type']
+            address_types = classes[orgid, 'address_type']
 
             user = {
                 "name": obj['brugernavn'],
@@ -101,10 +129,6 @@ def run(sheets, target, delimiter, include, jobs, **kwargs):
                 },
             }
 
-            if include and all(s not in obj['brugernavn']
-                               for s in include):
-                continue
-
             if (
                 obj['tilknyttedepersoner'] and
                 obj['tilknyttedepersoner'] != 'NULL'
@@ -116,10 +140,6 @@ def run(sheets, target, delimiter, include, jobs, **kwargs):
             else:
                 users[userid] = user
 
-            addrid = processors.wash_address(obj['adresse'],
-                                             obj['postnummer'],
-                                             obj['postdistrikt'])
-
             validity = {
                 'from': util.to_iso_time(obj['fra']),
                 'to': util.to_iso_time(obj['til']),
@@ -131,7 +151,7 @@ def run(sheets, target, delimiter, include, jobs, **kwargs):
             else:
                 validity['from'] = util.to_iso_time(max(
                     util.parsedatetime(obj['fra']),
-                    common.get_effect_from(
+                    util.get_effect_from(
                         units[unitid]['tilstande']
                         ['organisationenhedgyldighed'][0],
                     ),
@@ -142,24 +162,25 @@ def run(sheets, target, delimiter, include, jobs, **kwargs):
                     "org_unit": {
                         "uuid": unitid,
                     },
-                    "engagement_type": getclass(orgid, "engagement_type"),
+                    "engagement_type": next(iter(engagement_types.values()),
+                                            None),
                     'validity': validity,
                 }
 
             if addrid:
                 userrels[userid][addrid] = {
                     'type': 'address',
-                    'address_type': getclass(orgid, "address_type",
-                                             user_key="AdresseLokation"),
-                    'uuid': addrid,
+                    'address_type': address_types.get('AdresseLokation'),
+                    'org': user['org'],
+                    'value': addrid,
                     'validity': validity,
                 }
 
             if obj['email'] and obj['email'] != 'NULL':
                 userrels[userid][obj['email']] = {
                     'type': 'address',
-                    'address_type': getclass(orgid, "address_type",
-                                             user_key="Email"),
+                    'address_type': address_types.get('Email'),
+                    'org': user['org'],
                     'value': obj['email'],
                     'validity': validity,
                 }
@@ -167,8 +188,8 @@ def run(sheets, target, delimiter, include, jobs, **kwargs):
             if obj['telefon'] and obj['telefon'] != 'NULL':
                 userrels[userid][obj['telefon']] = {
                     'type': 'address',
-                    'address_type': getclass(orgid, "address_type",
-                                             user_key="Telefon"),
+                    'address_type': address_types.get('Telefon'),
+                    'org': user['org'],
                     'value': str(obj['telefon']),
                     'validity': validity,
                 }
@@ -182,48 +203,43 @@ def run(sheets, target, delimiter, include, jobs, **kwargs):
             fg='red', bold=True,
         )
 
-    with click.progressbar(users.values(),
+    # create each employee along with all of their details, in a
+    # single request
+    def create(user):
+        return pipeline.request(
+            'POST', target.rstrip('/') + '/service/e/create',
+            dict(user, details=list(userrels[user['uuid']].values())),
+            session=session,
+        )
+
+    report = pipeline.Report()
+
+    with click.progressbar(pipeline.imap(create, users.values(), jobs=jobs),
                            label='creating employees',
+                           length=len(users),
                            show_pos=True, width=0) as bar:
 
-        for r in grequests.imap(
-            (
-                grequests.post(target.rstrip('/') + '/service/e/create',
-                               session=session, json=user)
-                for user in bar
-            ),
-            size=jobs,
-        ):
-            if not r.ok:
+        for user, future in bar:
+            try:
+                r = future.result()
+            except requests.RequestException as exc:
                 click.secho('error creating:', fg='red', bold=True)
                 click.echo('< {}\n> {}'.format(
                     json.dumps(user, indent=2),
-                    r.text,
+                    exc,
                 ))
 
-    with click.progressbar(label='connecting employees',
-                           length=sum(map(len, userrels.values())),
-                           show_pos=True, width=0) as bar:
+                report.add('bruger', ok=False)
 
-        for r in grequests.imap(
-            (
-                grequests.post(
-                    '{}/service/e/{}/create'.format(target.rstrip('/'),
-                                                    userid),
-                    session=session, json=list(req.values()),
-                )
-                for userid, req in userrels.items()
-            ),
-            size=jobs,
-        ):
-            # this is kind of horrible, but requests give us no easy
-            # way of extract the original parameter to the request
-            # from the response
-            bar.update(len(json.loads(r.request.body.decode('utf-8'))))
+                continue
+
+            report.add('bruger', ok=r.ok)
 
             if not r.ok:
-                click.secho('error connecting:', fg='red', bold=True)
+                click.secho('error creating:', fg='red', bold=True)
                 click.echo('< {}\n> {}'.format(
                     json.dumps(user, indent=2),
                     r.text,
                 ))
+
+    click.echo(report)
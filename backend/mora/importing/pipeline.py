@@ -0,0 +1,269 @@
+#
+# Copyright (c) 2017-2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+'''Concurrent import pipeline
+--------------------------
+
+Helpers for sending a stream of objects to LoRA using a bounded pool
+of threads, as used by the importers.
+
+'''
+
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import itertools
+import json
+import sys
+import time
+import typing
+
+import requests
+import urllib3
+
+from .. import lora
+
+# transient statuses worth retrying
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+# methods safe to repeat, should a prior attempt have been applied
+# despite failing
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'PATCH', 'DELETE'})
+
+T = typing.TypeVar('T')
+
+
+def _failed_to_connect(exc: requests.ConnectionError) -> bool:
+    '''Whether the given error occurred prior to sending anything.'''
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+
+    reason = getattr(exc.args[0] if exc.args else None, 'reason', None)
+
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def request(method: str, url: str, obj=None, *,
+            retries: int=3, backoff: float=0.5,
+            session: requests.Session=None) -> requests.Response:
+    '''Perform the given request, retrying it with an exponential back
+    off on connection errors, timeouts and transient failures.
+
+    Only idempotent methods are retried on timeouts and transient
+    failures, as the server may have applied the request regardless;
+    anything else, e.g. ``POST``, is only retried should we fail to
+    connect.
+
+    The response of the final attempt is returned regardless of its
+    status. Requests use the session of LoRA unless another is given.
+
+    '''
+
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+
+    for attempt in itertools.count():
+        try:
+            r = (session or lora.session).request(method, url, json=obj)
+
+        except requests.ConnectionError as exc:
+            if (
+                not idempotent and not _failed_to_connect(exc) or
+                attempt >= retries
+            ):
+                raise
+
+        except requests.Timeout:
+            if not idempotent or attempt >= retries:
+                raise
+
+        else:
+            if (
+                not idempotent or
+                r.status_code not in RETRY_STATUSES or
+                attempt >= retries
+            ):
+                return r
+
+        time.sleep(backoff * 2 ** attempt)
+
+
+def fingerprint(obj) -> str:
+    '''Compute a digest of the given payload, for telling whether it
+    changed since we last imported it.'''
+    return hashlib.sha256(
+        json.dumps(obj, sort_keys=True, separators=(',', ':')).encode(),
+    ).hexdigest()
+
+
+def _get_references(obj: dict) -> typing.Iterator[str]:
+    for rels in obj.get('relationer', {}).values():
+        for rel in rels:
+            if rel.get('uuid'):
+                yield rel['uuid'].lower()
+
+
+def get_waves(lines: typing.Iterable[typing.Tuple[str, str, dict]]):
+    '''Schedule the given requests, as ``(method, path, obj)`` tuples,
+    in *waves* such that each object only refers to objects of prior
+    waves.
+
+    The objects of each wave may thus be imported in parallel. Only
+    references to objects within the import count, e.g. the parent of
+    a unit, or the facet of a class -- anything else must exist
+    already. Any cyclic references are left for a final wave.
+
+    '''
+
+    lines = list(lines)
+    ids = {path.rstrip('/').rsplit('/', 1)[-1].lower(): i
+           for i, (method, path, obj) in enumerate(lines)}
+
+    dependents = collections.defaultdict(list)
+    indegrees = []
+
+    for i, (method, path, obj) in enumerate(lines):
+        deps = {ids[ref] for ref in _get_references(obj or {})
+                if ref in ids} - {i}
+
+        for dep in deps:
+            dependents[dep].append(i)
+
+        indegrees.append(len(deps))
+
+    waves = []
+    wave = [i for i, indegree in enumerate(indegrees) if not indegree]
+    done = 0
+
+    while wave:
+        waves.append([lines[i] for i in wave])
+        done += len(wave)
+
+        nextwave = []
+
+        for i in wave:
+            for dependent in dependents[i]:
+                indegrees[dependent] -= 1
+
+                if not indegrees[dependent]:
+                    nextwave.append(dependent)
+
+        wave = sorted(nextwave)
+
+    if done < len(lines):
+        cyclic = [line for i, line in enumerate(lines) if indegrees[i]]
+
+        print('{} objects have cyclic references!'.format(len(cyclic)),
+              file=sys.stderr)
+
+        waves.append(cyclic)
+
+    return waves
+
+
+def _drain(pending, limit):
+    while len(pending) > limit:
+        item, future = pending.popleft()
+
+        concurrent.futures.wait([future])
+
+        yield item, future
+
+
+def imap(func: typing.Callable[[T], typing.Any],
+         items: typing.Iterable[T], *,
+         jobs: int=1,
+         key: typing.Optional[typing.Callable[[T], typing.Hashable]]=None,
+         ) -> typing.Iterator[typing.Tuple[T, concurrent.futures.Future]]:
+    '''Apply ``func`` to each of the given items concurrently, yielding
+    each item along with the completed future of its result.
+
+    The items are consumed lazily, keeping no more than twice the
+    amount of jobs in flight, and the results are yielded in order.
+
+    Consecutive items for which ``key`` returns the same value form a
+    *stage*, and we wait for all of a stage to complete before
+    starting on the next one. This allows e.g. importing classes prior
+    to the units referring to them.
+
+    '''
+
+    pending = collections.deque()
+    current = object()
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        for item in items:
+            if key is not None:
+                stage = key(item)
+
+                if stage != current:
+                    yield from _drain(pending, 0)
+                    current = stage
+
+            yield from _drain(pending, 2 * jobs - 1)
+
+            pending.append(
+                (item, executor.submit(lora._in_context(func), item)),
+            )
+
+        yield from _drain(pending, 0)
+
+
+class Report:
+    '''Tally of the objects imported, by type, for reporting the
+    throughput once done.
+
+    '''
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.counts = collections.OrderedDict()
+        self.failures = collections.Counter()
+        self.unchanged = collections.Counter()
+
+    def add(self, kind: str, ok: bool=True):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+        if not ok:
+            self.failures[kind] += 1
+
+    def skip(self, kind: str):
+        self.counts.setdefault(kind, 0)
+        self.unchanged[kind] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def __str__(self):
+        elapsed = time.monotonic() - self.start
+
+        lines = [
+            'imported {} objects in {} ({:.1f} per second)'.format(
+                self.total,
+                datetime.timedelta(seconds=round(elapsed, 3)),
+                self.total / elapsed if elapsed else 0,
+            ),
+        ]
+
+        for kind, count in self.counts.items():
+            notes = [
+                '{} {}'.format(counter[kind], label)
+                for label, counter in (
+                    ('failed', self.failures),
+                    ('unchanged', self.unchanged),
+                )
+                if counter[kind]
+            ]
+
+            lines.append('  {:<24}{:>8}{}'.format(
+                kind, count,
+                ' ({})'.format(', '.join(notes)) if notes else '',
+            ))
+
+        return '\n'.join(lines)
@@ -6,18 +6,122 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
+'''Preimported data
+----------------
+
+Spreadsheets are slow to read, so we can convert them into a
+*preimport* file, which the importers read just like a spreadsheet.
+
+The format consists of a header line, followed by the rows of each
+sheet as JSON, one per line::
+
+   {"format": "mora-preimport", "version": 1, "sheets": [["bruger", 0, 3]]}
+   {"brugervendtnoegle": "user", ...}
+   ...
+
+The header lists the title of each sheet, the offset of its first row
+in bytes relative to the end of the header, and the amount of rows.
+This allows reading a single sheet, or reading rows one at a time,
+without loading the entire file.
+
+'''
+
+import collections
 import json
+import typing
 
 import click
 
-from . import spreadsheets
+FORMAT = 'mora-preimport'
+VERSION = 1
+
+_MAGIC = '{{"format": "{}"'.format(FORMAT).encode('ascii')
+
+
+def _encode(row: dict) -> str:
+    # note: we only output ASCII, so lengths are the same in bytes
+    return json.dumps(row, sort_keys=True, separators=(',', ':')) + '\n'
+
+
+def dump(sheets: typing.Mapping[str, typing.Sequence[dict]],
+         fp: typing.TextIO):
+    '''Write the given sheets to the given file.'''
+
+    index = []
+    offset = 0
+
+    # compute the size of each sheet first, rather than holding all of
+    # their serialisations in memory
+    for title, rows in sheets.items():
+        index.append([title, offset, len(rows)])
+        offset += sum(len(_encode(row)) for row in rows)
+
+    fp.write(json.dumps(collections.OrderedDict((
+        ('format', FORMAT),
+        ('version', VERSION),
+        ('sheets', index),
+    ))) + '\n')
+
+    for rows in sheets.values():
+        for row in rows:
+            fp.write(_encode(row))
+
+
+def is_preimport(path: str) -> bool:
+    '''Check whether the given file contains preimported data.'''
+    try:
+        with open(path, 'rb') as fp:
+            return fp.read(len(_MAGIC)) == _MAGIC
 
+    except OSError:
+        # e.g. a book of CSV files
+        return False
 
-def run(output, sheets, compact, exact, **kwargs):
-    '''Convert an Excel spreadsheet into JSON for faster importing
+
+def _read_index(fp: typing.BinaryIO):
+    header = json.loads(fp.readline().decode('ascii'))
+
+    if header.get('format') != FORMAT or header.get('version') != VERSION:
+        raise ValueError('unsupported preimport file: {}'.format(fp.name))
+
+    return collections.OrderedDict(
+        (title, (offset, count))
+        for title, offset, count in header['sheets']
+    ), fp.tell()
+
+
+def get_sheet_names(path: str) -> typing.List[str]:
+    with open(path, 'rb') as fp:
+        index, start = _read_index(fp)
+
+    return list(index)
+
+
+def iter_sheet(path: str, title: str) -> typing.Iterator[dict]:
+    '''Read the rows of the given sheet lazily, if any.'''
+    with open(path, 'rb') as fp:
+        index, start = _read_index(fp)
+
+        if title not in index:
+            return
+
+        offset, count = index[title]
+
+        fp.seek(start + offset)
+
+        for i in range(count):
+            yield json.loads(fp.readline().decode('ascii'))
+
+
+def run(output, sheets, exact, **kwargs):
+    '''Convert an Excel spreadsheet into a preimport file for faster
+    importing
 
     '''
 
+    # local import, as the importer reads our format
+    from . import spreadsheets
+
     del kwargs['jobs'], kwargs['target']
 
     if any(kwargs.values()):
@@ -27,9 +131,4 @@ def run(output, sheets, compact, exact, **kwargs):
             'unsupported arguments: {}'.format(', '.join(unsupported_args)),
         )
 
-    d = spreadsheets.load_data(sheets, exact=exact)
-
-    if compact:
-        json.dump(d, output)
-    else:
-        json.dump(d, output, indent=2, sort_keys=True)
+    dump(spreadsheets.load_data(sheets, exact=exact), output)
@@ -8,11 +8,12 @@
 
 import re
 
+from .. import dawa
 from .. import lora
 from .. import util
 
 
-@util.cached
+@util.cached(ttl=30 * 24 * 60 * 60, maxsize=1000000)
 def _fetch(k):
     r = lora.session.get('https://dawa.aws.dk/datavask/adresser',
                          params={
@@ -26,12 +27,18 @@ def _fetch(k):
         return addrinfo['resultater'][0]['adresse']['id']
 
 
+def _lookup(k):
+    store = dawa.get_store()
+
+    return store and store.find(k) or _fetch(k)
+
+
 def wash_address(addrstring, postalcode, postaldistrict):
     if not addrstring:
         return None
 
     # first, try a direct lookup...
-    v = _fetch('{}, {} {}'.format(
+    v = _lookup('{}, {} {}'.format(
         addrstring.strip(), postalcode, postaldistrict.strip(),
     ))
 
@@ -54,7 +61,7 @@ def wash_address(addrstring, postalcode, postaldistrict):
     if q.lower().startswith('dokk1'):
         q = 'Hack Kampmanns Plads 2'
 
-    v = _fetch('{}, {} {}'.format(
+    v = _lookup('{}, {} {}'.format(
         q, postalcode, postaldistrict
     ))
 
@@ -66,7 +73,7 @@ def wash_address(addrstring, postalcode, postaldistrict):
 
     q = re.sub(r'(\s*-\s*\d+)+\Z', '', q)
 
-    v = _fetch('{}, {} {}'.format(
+    v = _lookup('{}, {} {}'.format(
         q, postalcode, postaldistrict
     ))
 
@@ -75,7 +82,7 @@ def wash_address(addrstring, postalcode, postaldistrict):
 
     if ' - ' in q:
         for p in re.split('\s+-\s+', q):
-            v = _fetch('{}, {} {}'.format(
+            v = _lookup('{}, {} {}'.format(
                 p, postalcode, postaldistrict
             ))
 
@@ -7,16 +7,21 @@
 #
 
 import collections
+import collections.abc
 import datetime
 import itertools
 import json
+import operator
 import os
 import sys
 import uuid
 
 import click
 import pyexcel
+import requests
 
+from . import pipeline
+from . import preimport
 from . import processors
 from .. import util
 from .. import lora
@@ -50,6 +55,20 @@ URN_PREFIXES = {
 }
 
 
+# the types in the order we should import them, as each may refer to
+# the ones before it
+TYPE_ORDER = (
+    'organisation',
+    'klassifikation',
+    'facet',
+    'klasse',
+    'itsystem',
+    'organisationenhed',
+    'bruger',
+    'organisationfunktion',
+)
+
+
 def nolower(s: str) -> str:
     return s if not s or not s.islower() else s.capitalize()
 
@@ -151,7 +170,13 @@ def read_paths(paths):
     for p in paths:
         fmt = os.path.splitext(p)[-1].lower()
 
-        if fmt == '.json':
+        if preimport.is_preimport(p):
+            yield collections.OrderedDict(
+                (title, list(preimport.iter_sheet(p, title)))
+                for title in preimport.get_sheet_names(p)
+            )
+
+        elif fmt == '.json':
             with open(p) as fp:
                 yield json.load(fp)
 
@@ -164,27 +189,238 @@ def read_paths(paths):
             yield from book
 
 
-def load_data(sheets, exact=False):
-    # use an ordered dictionary to ensure consistent walk order if the types
-    dest = collections.OrderedDict()
+REMAP = {
+    "funktionstype": "organisatoriskfunktionstype",
+}
 
-    remap = {
-        "funktionstype": "organisatoriskfunktionstype",
-    }
+TYPE_FORMATS = {
+    'tilknyttedepersoner': ('urn:dk:cpr:person:{:010d}', int),
+    'myndighed': ('urn:dk:kommune:{:d}', int),
+    'virksomhed': ('urn:dk:cvr:virksomhed:{:d}', int),
+}
 
-    type_formats = {
-        'tilknyttedepersoner': ('urn:dk:cpr:person:{:010d}', int),
-        'myndighed': ('urn:dk:kommune:{:d}', int),
-        'virksomhed': ('urn:dk:cvr:virksomhed:{:d}', int),
-    }
+ALLOW_INVALID_TYPES = {
+    'brugertyper',
+}
 
-    allow_invalid_types = {
-        'brugertyper',
-    }
+IGNORE_INVALID_TYPES = {
+    'organisatoriskfunktionstype',
+}
 
-    ignore_invalid_types = {
-        'organisatoriskfunktionstype',
-    }
+
+def _get_headers(colnames, title):
+    headers = [c.lower() for c in colnames]
+    headers = [REMAP.get(v, v) for v in headers]
+
+    assert len(set(headers)) == len(headers), \
+        'duplicate headers in ' + title
+
+    return headers
+
+
+class UUIDIndex(collections.abc.MutableMapping):
+    '''A compact mapping of user keys to UUIDs, for resolving
+    references between rows.
+
+    Canonical UUIDs are stored as 16 bytes rather than as strings of
+    36 characters; anything else is stored as is.
+
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.__data = {}
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = self.__data[key]
+
+        return str(uuid.UUID(bytes=value)) if isinstance(value, bytes) \
+            else value
+
+    def __setitem__(self, key, value):
+        try:
+            packed = uuid.UUID(value).bytes
+        except (TypeError, ValueError, AttributeError):
+            packed = None
+
+        if packed and str(uuid.UUID(bytes=packed)) == value:
+            value = packed
+
+        self.__data[key] = value
+
+    def __delitem__(self, key):
+        del self.__data[key]
+
+    def __iter__(self):
+        return iter(self.__data)
+
+    def __len__(self):
+        return len(self.__data)
+
+
+def _make_id(*key) -> str:
+    '''Derive an ID from the given key, such that objects lacking one
+    get the same ID each time we import them -- as e.g. the manifest
+    of previous imports requires.'''
+    return str(uuid.uuid5(
+        uuid.NAMESPACE_URL,
+        'urn:mora:import:' + ':'.join(map(str, key)),
+    ))
+
+
+def _get_id_factory(title):
+    '''Return a function for deriving the IDs of the rows of the given
+    sheet from their user key, and their position among rows sharing
+    it. The rows must be given in order.'''
+    seen = collections.Counter()
+
+    def make_id(obj):
+        key = obj.get('brugervendtnoegle') or ''
+        seen[key] += 1
+
+        return _make_id(title, key, seen[key])
+
+    return make_id
+
+
+def _prepare(obj, i, exact, make_id):
+    '''Fill in missing values of the given object, and coerce them.'''
+    if not exact:
+        # optionally generate a CPR number in a reproducible way, for
+        # test & dev -- but leave some users without a CPR number
+        if (
+            i % 100 and
+            'tilknyttedepersoner' in obj and
+            not obj['tilknyttedepersoner']
+        ):
+            hired = util.parsedatetime(obj['fra'])
+
+            obj['tilknyttedepersoner'] = int('{:%d%m%y}{:04d}'.format(
+                # randomly assume that everyone was hired on their
+                # 32nd birthday (note: 32 is divible by four,
+                # which is a rather useful property)
+                hired.replace(year=hired.year - 32),
+                i % 10000,
+            ))
+
+        # ensure that all objects have an ID
+        if not obj.get('objektid'):
+            obj['objektid'] = make_id(obj)
+
+    # coerce all dates to strings
+    for k, v in obj.items():
+        if isinstance(v, datetime.datetime):
+            obj[k] = v.isoformat()
+        elif v == '':
+            obj[k] = None
+
+
+def _get_uuid_mapping(objs):
+    # some items in the spreadsheet refer to other rows by their bvn
+    uuid_mapping = UUIDIndex(
+        (obj['brugervendtnoegle'], obj['objektid'])
+        for obj in objs
+    )
+
+    # inject some missing UUID mappings?
+    uuid_mapping.setdefault(
+        'Organisation Aarhus',
+        uuid_mapping.get('Aarhus kommune',
+                         '59141156-ed0b-457c-9535-884447c5220b')
+    )
+
+    return uuid_mapping
+
+
+def _resolve(obj, i, exact, uuid_mapping, functions):
+    '''Wash the address of the given object, and resolve its
+    references to other rows.
+
+    Any functions implied by the object are added to ``functions``.
+
+    '''
+
+    postaldistrict = obj.pop('postdistrikt', None)
+    postalcode = obj.pop('postnummer', None)
+    address = obj.pop('adresse', None)
+
+    if exact or util.is_uuid(address):
+        # just use it
+        obj['adresse'] = address
+        obj['adresse_type'] = obj.get('adresse_type')
+
+    elif address and postalcode and postaldistrict:
+
+        obj['adresse'] = processors.wash_address(address, postalcode,
+                                                 postaldistrict)
+        obj['adresse_type'] = obj.get('adresse_type')
+
+    else:
+        obj['adresse'] = None
+        obj['adresse_type'] = None
+
+    for k, v in obj.items():
+        val = obj[k]
+
+        if isinstance(val, str):
+            val = val.strip()
+
+        if (
+            not val or
+            val == 'NULL' or
+            util.is_uuid(val) or
+            str(val).startswith('urn:')
+        ):
+            continue
+
+        elif k in TYPE_FORMATS:
+            try:
+                fmt, fn = TYPE_FORMATS[k]
+                obj[k] = fmt.format(fn(val if val is not None else i))
+            except ValueError as exc:
+                print('Unknown value {!r} for {}: {}'.format(
+                    v, k, exc.args[0],
+                ))
+
+        elif k not in lora.ALL_RELATION_NAMES:
+            continue
+
+        elif k == 'tilknyttetenhed':
+            print(obj)
+
+            functions.append(dict(
+                objektid=_make_id('organisationfunktion', 'Tilknytning',
+                                  obj['objektid'], v, obj['fra']),
+                tilknyttedeenheder=v,
+                tilknyttedebrugere=obj['objektid'],
+                tilknyttedeorganisationer=(
+                    obj['tilknyttedeorganisationer']
+                ),
+                funktionsnavn='Tilknytning',
+                brugervendtnoegle='42',
+                fra=obj['fra'],
+                til=obj['til'],
+            ))
+
+            del obj[k]
+
+        elif val in uuid_mapping:
+            obj[k] = uuid_mapping[val]
+
+        elif k in ALLOW_INVALID_TYPES:
+            pass
+
+        else:
+            if k not in IGNORE_INVALID_TYPES:
+                print('BAD VALUE {!r} for {} in {}'.format(
+                    val, k, json.dumps(obj, indent=2, sort_keys=True),
+                ), file=sys.stderr)
+            obj[k] = None
+
+
+def load_data(sheets, exact=False):
+    # use an ordered dictionary to ensure consistent walk order if the types
+    dest = collections.OrderedDict()
 
     for sheet in read_paths(sheets):
         if isinstance(sheet, dict):
@@ -198,11 +434,7 @@ def load_data(sheets, exact=False):
 
         sheet.name_columns_by_row(0)
 
-        headers = [c.lower() for c in sheet.colnames]
-        headers = [remap.get(v, v) for v in headers]
-
-        assert len(set(headers)) == len(headers), \
-            'duplicate headers in ' + sheet.name
+        headers = _get_headers(sheet.colnames, sheet.name)
 
         for i, row in enumerate(sheet.rows()):
             if not any(row):
@@ -213,136 +445,196 @@ def load_data(sheets, exact=False):
 
             out.append(dict(map(lambda h, c: (h, c), headers, row)))
 
-    if not exact:
-        # optionally generate a CPR number in a reproducible way, for
-        # test & dev
-        for i, obj in enumerate(itertools.chain.from_iterable(dest.values())):
-            # leave some users without a CPR number
-            if not i % 100:
+    i = 0
+
+    for title, objs in dest.items():
+        make_id = _get_id_factory(title)
+
+        for obj in objs:
+            _prepare(obj, i, exact, make_id)
+
+            i += 1
+
+    uuid_mapping = _get_uuid_mapping(
+        itertools.chain.from_iterable(dest.values()),
+    )
+
+    functions = []
+
+    for i, obj in enumerate(itertools.chain.from_iterable(dest.values())):
+        _resolve(obj, i, exact, uuid_mapping, functions)
+
+    for i, obj in enumerate(functions):
+        _resolve(obj, i, exact, uuid_mapping, functions)
+
+    if functions:
+        dest.setdefault('organisationfunktion', []).extend(functions)
+
+    return dest
+
+
+def _iter_sheet_names(path):
+    if preimport.is_preimport(path):
+        yield from preimport.get_sheet_names(path)
+
+    elif os.path.splitext(path)[-1].lower() == '.json':
+        with open(path) as fp:
+            yield from json.load(fp)
+
+    else:
+        try:
+            yield from pyexcel.iget_book(file_name=path).sheet_names()
+        finally:
+            pyexcel.free_resources()
+
+
+def _iter_sheet(path, title):
+    '''Read the rows of the given sheet lazily, as dictionaries.'''
+    if preimport.is_preimport(path):
+        yield from preimport.iter_sheet(path, title)
+
+        return
+
+    if os.path.splitext(path)[-1].lower() == '.json':
+        # we cannot stream JSON, but at least only keep one sheet
+        with open(path) as fp:
+            rows = json.load(fp).get(title, [])
+
+        for row in rows:
+            yield dict(row)
+
+        return
+
+    try:
+        it = pyexcel.iget_array(file_name=path, sheet_name=title)
+        headers = _get_headers(next(it, []), title)
+
+        for i, row in enumerate(it):
+            if not any(row):
                 continue
 
-            if 'tilknyttedepersoner' in obj and not obj['tilknyttedepersoner']:
-                hired = util.parsedatetime(obj['fra'])
+            if not i % 5000:
+                print(i, file=sys.stderr)
 
-                obj['tilknyttedepersoner'] = int('{:%d%m%y}{:04d}'.format(
-                    # randomly assume that everyone was hired on their
-                    # 32nd birthday (note: 32 is divible by four,
-                    # which is a rather useful property)
-                    hired.replace(year=hired.year - 32),
-                    i % 10000,
-                ))
+            row = list(row) + [''] * (len(headers) - len(row))
 
-        # ensure that all objects have an ID
-        for i, obj in enumerate(itertools.chain.from_iterable(dest.values())):
-            if not obj.get('objektid'):
-                obj['objektid'] = str(uuid.uuid4())
+            yield dict(zip(headers, row))
 
-    # coerce all dates to strings
-    for obj in itertools.chain.from_iterable(dest.values()):
-        for k, v in obj.items():
-            if isinstance(v, datetime.datetime):
-                obj[k] = v.isoformat()
-            elif v == '':
-                obj[k] = None
+    finally:
+        pyexcel.free_resources()
 
-    # some items in the spreadsheet refer to other rows by their bvn
-    uuid_mapping = {
-        obj['brugervendtnoegle']: obj['objektid']
-        for obj in itertools.chain.from_iterable(dest.values())
-    }
 
-    # inject some missing UUID mappings?
-    uuid_mapping.setdefault(
-        'Organisation Aarhus',
-        uuid_mapping.get('Aarhus kommune',
-                         '59141156-ed0b-457c-9535-884447c5220b')
-    )
+def iter_data(paths, exact=False):
+    '''Read the given sheets lazily, yielding their title and objects,
+    without holding all of them in memory.
 
-    for i, obj in enumerate(itertools.chain.from_iterable(dest.values())):
-        postaldistrict = obj.pop('postdistrikt', None)
-        postalcode = obj.pop('postnummer', None)
-        address = obj.pop('adresse', None)
+    This performs two passes over the input: First, we index the user
+    keys of each row, so that we can resolve references between rows,
+    and then we read them again, one at a time. The sheets are read in
+    the order of :py:data:`TYPE_ORDER`.
 
-        if exact or util.is_uuid(address):
-            # just use it
-            obj['adresse'] = address
-            obj['adresse_type'] = obj.get('adresse_type')
+    Objects missing an ID get the same one in both passes, as
+    described in :py:func:`_get_id_factory`.
 
-        elif address and postalcode and postaldistrict:
+    '''
 
-            obj['adresse'] = processors.wash_address(address, postalcode,
-                                                     postaldistrict)
-            obj['adresse_type'] = obj.get('adresse_type')
+    sheets = collections.OrderedDict()
 
-        else:
-            obj['adresse'] = None
-            obj['adresse_type'] = None
-
-        for k, v in obj.items():
-                val = obj[k]
-
-                if isinstance(val, str):
-                    val = val.strip()
-
-                if (
-                    not val or
-                    val == 'NULL' or
-                    util.is_uuid(val) or
-                    str(val).startswith('urn:')
-                ):
-                    continue
-
-                elif k in type_formats:
-                    try:
-                        fmt, fn = type_formats[k]
-                        obj[k] = fmt.format(fn(val if val is not None else i))
-                    except ValueError as exc:
-                        print('Unknown value {!r} for {}: {}'.format(
-                            v, k, exc.args[0],
-                        ))
-
-                elif k not in lora.ALL_RELATION_NAMES:
-                    continue
-
-                elif k == 'tilknyttetenhed':
-                    print(obj)
-
-                    dest['organisationfunktion'].append(dict(
-                        objektid=str(uuid.uuid4()),
-                        tilknyttedeenheder=v,
-                        tilknyttedebrugere=obj['objektid'],
-                        tilknyttedeorganisationer=(
-                            obj['tilknyttedeorganisationer']
-                        ),
-                        funktionsnavn='Tilknytning',
-                        brugervendtnoegle='42',
-                        fra=obj['fra'],
-                        til=obj['til'],
-                    ))
-
-                    del obj[k]
-
-                elif val in uuid_mapping:
-                    obj[k] = uuid_mapping[val]
-
-                elif k in allow_invalid_types:
-                    pass
-
-                else:
-                    if k not in ignore_invalid_types:
-                        print('BAD VALUE {!r} for {} in {}'.format(
-                            val, k, json.dumps(obj, indent=2, sort_keys=True),
-                        ), file=sys.stderr)
-                    obj[k] = None
+    def rows(title):
+        for path in sheets[title]:
+            yield from _iter_sheet(path, title)
 
-    return dest
+    for path in paths:
+        for title in _iter_sheet_names(path):
+            sheets.setdefault(title, []).append(path)
+
+    # first pass: count and index the rows
+    counts = collections.OrderedDict()
+
+    def index():
+        for title in sheets:
+            print(title, file=sys.stderr)
+
+            counts[title] = 0
+            make_id = _get_id_factory(title)
+
+            for obj in rows(title):
+                _prepare(obj, 0, exact, make_id)
+
+                counts[title] += 1
+
+                yield obj
+
+    uuid_mapping = _get_uuid_mapping(index())
+
+    offsets = dict(zip(
+        counts,
+        itertools.accumulate(itertools.chain([0], counts.values())),
+    ))
+
+    # second pass: process the rows one at a time
+    functions = []
+
+    for title in sorted(sheets, key=_get_rank):
+        make_id = _get_id_factory(title)
+
+        for j, obj in enumerate(rows(title)):
+            i = offsets[title] + j
 
+            _prepare(obj, i, exact, make_id)
+            _resolve(obj, i, exact, uuid_mapping, functions)
 
-def convert(paths, include=None, exact=False):
-    print('loading input...', file=sys.stderr)
-    sheets = load_data(paths, exact=exact)
+            yield title, obj
 
-    for title, sheet in sheets.items():
+    # the functions implied by other rows
+    for i, obj in enumerate(functions):
+        _resolve(obj, i, exact, uuid_mapping, functions)
+
+        yield 'organisationfunktion', obj
+
+
+def _get_rank(title):
+    try:
+        return TYPE_ORDER.index(title)
+    except ValueError:
+        return len(TYPE_ORDER)
+
+
+def _get_type(line):
+    method, path, obj = line
+
+    return path.split('/')[2]
+
+
+def convert(paths, include=None, exact=False, stream=False):
+    '''Convert the given sheets into LoRA requests, yielding their
+    method, path and payload.
+
+    Should ``stream`` be set, we read the sheets lazily using
+    :py:func:`iter_data` rather than loading all of them first.
+
+    '''
+
+    if stream:
+        sheets = (
+            (title, None, map(operator.itemgetter(1), group))
+            for title, group in itertools.groupby(
+                iter_data(paths, exact=exact),
+                operator.itemgetter(0),
+            )
+        )
+
+    else:
+        print('loading input...', file=sys.stderr)
+
+        # import the types in order of their dependencies
+        sheets = (
+            (title, len(sheet), sheet)
+            for title, sheet in sorted(load_data(paths, exact=exact).items(),
+                                       key=lambda i: _get_rank(i[0]))
+        )
+
+    for title, count, objs in sheets:
         try:
             func = globals()['convert_' + title]
         except KeyError:
@@ -353,10 +645,13 @@ def convert(paths, include=None, exact=False):
             print('skipping {}!'.format(title), file=sys.stderr)
             continue
 
-        print('importing {} {}...'.format(len(sheet), title),
-              file=sys.stderr)
+        if count is not None:
+            print('importing {} {}...'.format(count, title),
+                  file=sys.stderr)
+        else:
+            print('importing {}...'.format(title), file=sys.stderr)
 
-        for i, obj in enumerate(sheet, 1):
+        for i, obj in enumerate(objs, 1):
             if not i % 500:
                 print(i)
 
@@ -761,7 +1056,7 @@ def convert_organisationfunktion(obj):
 
 
 def run(target, sheets, dry_run, verbose, jobs, failfast,
-        include, check, exact, **kwargs):
+        include, check, exact, stream=False, manifest=None, **kwargs):
 
     if any(kwargs.values()):
         unsupported_args = [k for k in sorted(kwargs) if kwargs[k]]
@@ -770,9 +1065,8 @@ def run(target, sheets, dry_run, verbose, jobs, failfast,
             'unsupported arguments: {}'.format(', '.join(unsupported_args)),
         )
 
-    start = util.now()
-
-    sheetlines = convert(sheets, include=include, exact=exact)
+    sheetlines = convert(sheets, include=include, exact=exact,
+                         stream=stream)
 
     if dry_run:
         for method, path, obj in sheetlines:
@@ -781,45 +1075,73 @@ def run(target, sheets, dry_run, verbose, jobs, failfast,
 
         return
 
-    def fail(r, exc):
-        if verbose:
-            print(r.url)
-        print(*exc.args)
-        if failfast:
-            raise exc
-
-    # only use grequests for parallel workloads -- and import it
-    # lazily to avoid deadlocks caused by its horrible monkey patches
-    # to builtins
-    if jobs > 1:  # pragma: no cover
-        import grequests
-
-        responses = grequests.imap(
-            (
-                grequests.request(
-                    method if not check else 'GET',
-                    target + path.rstrip('/'),
-                    json=obj,
-                    session=lora.session,
-                )
-                for method, path, obj in sheetlines
-            ),
-            size=jobs,
-            exception_handler=fail,
-        )
+    report = pipeline.Report()
+
+    if manifest and not check:
+        # only import objects that changed since we last imported
+        # them into this target
+        manifest = util.PersistentCache(manifest)
+
+        def changed(line):
+            method, path, obj = line
+
+            if manifest.get((target, path)) == pipeline.fingerprint(obj):
+                report.skip(_get_type(line))
+
+                return False
+
+            return True
+
+        sheetlines = filter(changed, sheetlines)
+
     else:
-        responses = (
-            lora.session.request(
-                method if not check else 'GET',
-                target + path.rstrip('/'),
-                json=obj,
-            )
-            for method, path, obj in sheetlines
+        manifest = None
+
+    if stream:
+        # scheduling requires all objects, so just import one type at
+        # a time, in order
+        items = ((_get_type(line), line) for line in sheetlines)
+
+    else:
+        waves = pipeline.get_waves(sheetlines)
+
+        print('scheduled {} objects in {} waves'.format(
+            sum(map(len, waves)), len(waves),
+        ), file=sys.stderr)
+
+        items = (
+            (i, line)
+            for i, wave in enumerate(waves)
+            for line in wave
         )
 
-    total = 0
+    def send(item):
+        stage, (method, path, obj) = item
+
+        return pipeline.request(
+            method if not check else 'GET',
+            target + path.rstrip('/'),
+            obj,
+        )
+
+    for (stage, line), future in pipeline.imap(send, items, jobs=jobs,
+                                               key=operator.itemgetter(0)):
+        kind = _get_type(line)
+
+        try:
+            r = future.result()
+        except requests.RequestException as exc:
+            report.add(kind, ok=False)
+
+            print(*exc.args)
+
+            if failfast:
+                raise
+
+            continue
+
+        report.add(kind, ok=r.ok or check and r.status_code == 404)
 
-    for r in responses:
         if verbose:
             print(r.url)
 
@@ -835,13 +1157,12 @@ def run(target, sheets, dry_run, verbose, jobs, failfast,
             except ValueError:
                 print(r.status_code, r.text)
 
-        if failfast:
-            r.raise_for_status()
-        else:
-            total += 1
+            if failfast:
+                r.raise_for_status()
 
-    duration = util.now() - start
+        elif manifest is not None:
+            method, path, obj = line
 
-    print('imported {} objects in {} ({} per second)'.format(
-        total, duration, total / duration.total_seconds(),
-    ))
+            manifest[target, path] = pipeline.fingerprint(obj)
+
+    print(report)
@@ -8,11 +8,17 @@
 
 from __future__ import generator_stop
 
+import bisect
 import collections
+import concurrent.futures
+import datetime
 import functools
 import itertools
+import threading
+import urllib.parse
 import uuid
 
+import flask
 import requests
 
 import flask_saml_sso
@@ -27,6 +33,37 @@ session.headers = {
     'User-Agent': 'MORA/0.1',
 }
 
+# classes and facets rarely change, but are read all the time -- so
+# we share their full history between requests, keyed by path & UUID;
+# we forget them once we write to them, but other processes keep
+# theirs for up to CLASSIFICATION_CACHE_TTL seconds
+CLASSIFICATION_PATHS = frozenset({
+    'klassifikation/klasse',
+    'klassifikation/facet',
+})
+
+# the longest request each LoRA has accepted after rejecting a longer
+# one, keyed by its URL; see Scope.get_all() -- we forget these after a
+# while, so that we recover should the limit of the server be raised,
+# or the rejection have been caused by something else
+_max_request_lengths = util.LRUCache(
+    16,
+    settings.MAX_REQUEST_LENGTH_TTL,
+)
+_max_request_length_lock = threading.Lock()
+
+classification_cache = util.LRUCache(
+    settings.CLASSIFICATION_CACHE_SIZE,
+    settings.CLASSIFICATION_CACHE_TTL,
+)
+
+# indexes of the unit hierarchy, keyed by organisation; please see
+# mora.hierarchy -- writing to a unit marks it as changed in each
+unit_hierarchy_cache = util.LRUCache(
+    settings.ORG_UNIT_HIERARCHY_CACHE_SIZE,
+    settings.ORG_UNIT_HIERARCHY_CACHE_TTL,
+)
+
 ALL_RELATION_NAMES = {
     'adresse',
     'adresser',
@@ -184,6 +221,114 @@ def get(path, uuid, **params):
         return registrations[0]
 
 
+def _get_max_request_length():
+    limit = int(settings.MAX_REQUEST_LENGTH)
+    rejected = _max_request_lengths.get(settings.LORA_URL)
+
+    if rejected is not None:
+        limit = min(limit, rejected)
+
+    return limit
+
+
+def _reduce_max_request_length(rejected_length):
+    '''Remember that the server rejected a request of the given
+    length; we then split such requests in half.'''
+    with _max_request_length_lock:
+        _max_request_lengths[settings.LORA_URL] = min(
+            _get_max_request_length(),
+            rejected_length // 2,
+        )
+
+
+def _in_context(func):
+    '''Wrap ``func`` for calling in another thread, retaining the
+    current request context, if any -- e.g. for authentication.
+
+    '''
+    if flask.has_request_context():
+        return flask.copy_current_request_context(func)
+    else:
+        return func
+
+
+def concurrent_map(func, iterable, max_workers=None):
+    '''Like :py:func:`map`, but calling ``func`` concurrently, with at
+    most ``max_workers`` -- by default ``MAX_CONCURRENT_REQUESTS`` --
+    calls in flight at once. The results are yielded in order.
+
+    '''
+    items = list(iterable)
+    workers = min(len(items),
+                  max_workers or settings.MAX_CONCURRENT_REQUESTS)
+
+    if workers <= 1:
+        yield from map(func, items)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(_in_context(func), item)
+            for item in items
+        ]
+
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # don't bother with the rest should we stop early
+            for future in futures:
+                future.cancel()
+
+
+def _forget_shared(path, uuid):
+    if path in CLASSIFICATION_PATHS:
+        classification_cache.pop((path, str(uuid)))
+    elif path == 'organisation/organisationenhed':
+        for hierarchy in unit_hierarchy_cache.values():
+            hierarchy.invalidate(uuid)
+
+
+def slice_registration(reg: dict, start: datetime.datetime,
+                       end: datetime.datetime) -> dict:
+    '''Restrict the given registration to the entries in effect at
+    some point between ``start`` and ``end`` -- just as LoRA does when
+    given ``virkningfra`` and ``virkningtil``.
+
+    This allows serving a narrow period from a registration holding
+    the entire history of an object, e.g. one read through a connector
+    spanning all time, without asking LoRA again. Any groups and keys
+    left without entries are omitted, as LoRA does.
+
+    :param reg: The registration to slice. It is left untouched.
+    :param start: The start of the period, exclusive.
+    :param end: The end of the period, exclusive.
+    :return: A new registration, sharing the entries of the original.
+
+    '''
+    sliced = {}
+
+    for group, value in reg.items():
+        if group not in ('attributter', 'tilstande', 'relationer'):
+            sliced[group] = value
+            continue
+
+        entries = {
+            key: [
+                entry for entry in entries
+                if util.parsedatetime(entry['virkning']['from']) < end and
+                util.parsedatetime(entry['virkning']['to']) > start
+            ]
+            for key, entries in value.items()
+        }
+        entries = {key: v for key, v in entries.items() if v}
+
+        if entries:
+            sliced[group] = entries
+
+    return sliced
+
+
 def fetch(path, **params):
     r = session.get(settings.LORA_URL + path, params=params)
     _check_response(r)
@@ -199,6 +344,9 @@ def create(path, obj, uuid=None):
         r = session.put('{}{}/{}'.format(settings.LORA_URL, path, uuid),
                         json=obj)
         _check_response(r)
+
+        _forget_shared(path, uuid)
+
         return uuid
     else:
         r = session.post(settings.LORA_URL + path, json=obj)
@@ -210,10 +358,15 @@ def delete(path, uuid):
     r = session.delete('{}{}/{}'.format(settings.LORA_URL, path, uuid))
     _check_response(r)
 
+    _forget_shared(path, uuid)
+
 
 def update(path, obj):
     r = session.put(settings.LORA_URL + path, json=obj)
     _check_response(r)
+
+    _forget_shared(path, r.json()['uuid'])
+
     return r.json()['uuid']
 
 
@@ -314,9 +467,53 @@ class Connector:
 
 
 class Scope:
+    '''Accessor for one type of LoRA objects, e.g.
+    ``organisation/organisationenhed``, using the defaults of the
+    given :py:class:`Connector`.
+
+    Each scope keeps an identity map of the registrations it has
+    fetched, keyed by UUID and any additional query parameters, for
+    the lifetime of its connector. As a consequence, repeated lookups
+    of the same object yield the same registration; callers should
+    not modify it.
+
+    Classes and facets are furthermore kept in the process-wide
+    :py:data:`classification_cache`, which holds their full history
+    and is shared between connectors.
+
+    '''
+
     def __init__(self, connector, path):
         self.connector = connector
         self.path = path
+        self.__registrations = {}
+
+    @staticmethod
+    def __get_key(uuid, params):
+        return str(uuid), tuple(sorted(
+            (k, str(v)) for k, v in params.items()
+        ))
+
+    def __forget(self, uuid):
+        for key in [k for k in self.__registrations if k[0] == str(uuid)]:
+            del self.__registrations[key]
+
+        _forget_shared(self.path, uuid)
+
+    @property
+    def __is_shared(self):
+        return (
+            self.path in CLASSIFICATION_PATHS and
+            classification_cache.maxsize > 0 and
+            self.connector.defaults.keys() <= {'virkningfra', 'virkningtil'}
+        )
+
+    def __get_shared(self, uuid):
+        reg = classification_cache.get((self.path, str(uuid)))
+
+        if reg is not None:
+            return slice_registration(reg, self.connector.start,
+                                      self.connector.end)
 
     @property
     def base_path(self):
@@ -337,6 +534,18 @@ class Scope:
 
     __call__ = fetch
 
+    def fetch_many(self, searches):
+        '''Perform each of the given searches, concurrently, and
+        return their results in order.
+
+        :param searches: An iterable of keyword arguments for
+            :py:meth:`fetch`.
+
+        '''
+        return list(concurrent_map(
+            lambda params: self.fetch(**params), searches,
+        ))
+
     def get_all(self, *, start=0, limit=settings.DEFAULT_PAGE_SIZE, **params):
         params['maximalantalresultater'] = limit
         params['foersteresultat'] = start
@@ -348,41 +557,199 @@ class Scope:
 
         wantregs = params.keys() & {'registreretfra', 'registrerettil'}
 
-        # as an optimisation, we want to minimize the amount of
-        # roundtrips whilst also avoiding too large requests -- to
-        # this, we calculate in advance how many we can request
-        available_length = settings.MAX_REQUEST_LENGTH
-        available_length -= 4  # for 'GET '
+        # serve whatever we already know from memory, and only ask
+        # LoRA for the rest
+        if not wantregs:
+            missing = []
+
+            for objid in uuids:
+                key = self.__get_key(objid, {})
+
+                if key not in self.__registrations:
+                    missing.append(objid)
+                elif self.__registrations[key] is not None:
+                    yield str(objid), self.__registrations[key]
+
+            uuids = missing
+
+        # likewise for the shared cache, which needs the full history
+        shared = not wantregs and self.__is_shared
+        fetchparams = {}
+
+        if shared:
+            missing = []
+
+            for objid in uuids:
+                reg = self.__get_shared(objid)
+
+                if reg is None:
+                    missing.append(objid)
+                else:
+                    self.__registrations[self.__get_key(objid, {})] = reg
+                    yield str(objid), reg
+
+            uuids = missing
+            fetchparams.update(virkningfra='-infinity', virkningtil='infinity')
+
+        chunks = util.splitlist(uuids, self.__get_chunk_size(**fetchparams))
+
+        for chunk, results in self.__fetch_chunks(list(chunks),
+                                                  **fetchparams):
+            notfound = set(map(str, chunk))
+
+            for d in results:
+                if wantregs:
+                    yield d['id'], d['registreringer']
+                    continue
+
+                notfound.discard(d['id'])
+
+                reg = d['registreringer'][0]
+
+                if shared:
+                    classification_cache[self.path, d['id']] = reg
+                    reg = slice_registration(reg, self.connector.start,
+                                             self.connector.end)
+
+                self.__registrations[self.__get_key(d['id'], {})] = reg
+
+                yield d['id'], reg
+
+            if not wantregs:
+                # remember the absent ones as well
+                for objid in notfound:
+                    self.__registrations[self.__get_key(objid, {})] = None
+
+    def __get_chunk_size(self, **params):
+        '''Determine how many UUIDs we can look up at once.
+
+        As an optimisation, we want to minimize the amount of
+        roundtrips whilst also avoiding too large requests -- to
+        this, we calculate in advance how many we can request, given
+        the ``MAX_REQUEST_LENGTH`` setting, or any lower limit imposed
+        by the server within the last ``MAX_REQUEST_LENGTH_TTL``
+        seconds.
+
+        '''
+        available_length = _get_max_request_length()
+        available_length -= len('GET ?')
         available_length -= len(self.base_path)
+        available_length -= len(urllib.parse.urlencode({
+            **self.connector.defaults,
+            **params,
+        }))
+
+        per_length = len('&uuid=') + 36
+
+        return max(available_length // per_length, 1)
+
+    def __fetch_chunk(self, chunk, **params):
+        '''Look up the given UUIDs, splitting them up further should
+        LoRA -- or any proxy in front of it -- consider the request
+        too long. We then remember the limit for any subsequent
+        lookups.
+
+        '''
+        r = session.get(self.base_path, params={
+            **self.connector.defaults,
+            **params,
+            'uuid': chunk,
+        })
+
+        # only a long URL helps splitting, unlike e.g. large headers
+        if r.status_code == 414 and len(chunk) > 1:
+            _reduce_max_request_length(len('GET ') + len(r.request.url))
 
-        for k, v in itertools.chain(self.connector.defaults.items(),
-                                    params.items()):
-            available_length -= len(k) + len(str(v)) + 2
+            middle = len(chunk) // 2
 
-        per_length = 36 + len('&uuid=')
+            return (
+                self.__fetch_chunk(chunk[:middle], **params) +
+                self.__fetch_chunk(chunk[middle:], **params)
+            )
 
-        for chunk in util.splitlist(uuids, int(available_length / per_length)):
-            for d in self.fetch(uuid=chunk):
-                yield d['id'], (d['registreringer'] if wantregs
-                                else d['registreringer'][0])
+        _check_response(r)
+
+        try:
+            return r.json()['results'][0]
+        except IndexError:
+            return []
+
+    def __fetch_chunks(self, chunks, **params):
+        '''Fetch each of the given chunks of UUIDs, yielding them along
+        with their results in order.
+
+        Should there be more than one, we issue the requests
+        concurrently, with at most ``MAX_CONCURRENT_REQUESTS`` in
+        flight at once.
+
+        '''
+        return zip(chunks, concurrent_map(
+            functools.partial(self.__fetch_chunk, **params), chunks,
+        ))
+
+    def prefetch(self, uuids):
+        '''Fetch the given objects, skipping those already known, in
+        as few requests as possible, so that subsequent calls to
+        :py:meth:`get` are served from memory.
+
+        '''
+        uuids = util.uniqueify(map(str, filter(None, uuids)))
+
+        for objid, obj in self.get_all(uuid=uuids, limit=len(uuids)):
+            pass
 
     def paged_get(self, func, *,
                   start=0, limit=settings.DEFAULT_PAGE_SIZE,
+                  lazy=False,
                   **params):
+        '''Get a page of objects, converted using ``func``.
+
+        With ``lazy``, the ``items`` are a generator, fetching and
+        converting the objects as they're consumed; suitable for
+        :py:func:`mora.util.stream_json`.
+
+        '''
 
         uuids = self.fetch(**params)
 
+        items = (
+            func(self.connector, obj_id, obj)
+            for obj_id, obj in self.get_all(
+                start=start, limit=limit, **params)
+        )
+
         return {
             'total': len(uuids),
             'offset': start,
-            'items': [
-                func(self.connector, obj_id, obj)
-                for obj_id, obj in self.get_all(
-                    start=start, limit=limit, **params)
-            ],
+            'items': items if lazy else list(items),
         }
 
     def get(self, uuid, **params):
+        key = self.__get_key(uuid, params)
+
+        if key not in self.__registrations:
+            self.__registrations[key] = self.__get(uuid, **params)
+
+        return self.__registrations[key]
+
+    def __get(self, uuid, **params):
+        if not params and self.__is_shared:
+            reg = self.__get_shared(uuid)
+
+            if reg is None:
+                reg = self.__get(uuid, virkningfra='-infinity',
+                                 virkningtil='infinity')
+
+                if reg is None:
+                    return None
+
+                classification_cache[self.path, str(uuid)] = reg
+
+                reg = slice_registration(reg, self.connector.start,
+                                         self.connector.end)
+
+            return reg
+
         d = self.fetch(uuid=str(uuid), **params)
 
         if not d or not d[0]:
@@ -399,6 +766,9 @@ class Scope:
 
             return registrations[0]
 
+    # note: we forget objects only once written, as concurrent readers
+    # might otherwise put the prior version back in the shared caches
+
     def create(self, obj, uuid=None):
         if uuid:
             r = session.put('{}/{}'.format(self.base_path, uuid),
@@ -407,12 +777,18 @@ class Scope:
             r = session.post(self.base_path, json=obj)
 
         _check_response(r)
+
+        if uuid:
+            self.__forget(uuid)
+
         return r.json()['uuid']
 
     def delete(self, uuid):
         r = session.delete('{}/{}'.format(self.base_path, uuid))
         _check_response(r)
 
+        self.__forget(uuid)
+
     def update(self, obj, uuid):
         r = session.request(
             'PATCH',
@@ -420,6 +796,9 @@ class Scope:
             json=obj,
         )
         _check_response(r)
+
+        self.__forget(uuid)
+
         return r.json()['uuid']
 
     def get_effects(self, obj, relevant, also=None, **params):
@@ -432,8 +811,6 @@ class Scope:
         if not reg:
             return
 
-        chunks = set()
-
         everything = collections.defaultdict(tuple)
 
         for group in relevant:
@@ -441,46 +818,57 @@ class Scope:
         for group in also or {}:
             everything[group] += also[group]
 
-        # extract all beginning and end timestamps for all effects
-        for group, keys in relevant.items():
-            if group not in reg:
-                continue
-
-            entries = reg[group]
-
-            for key in keys:
-                if key not in entries:
-                    continue
-
-                for entry in entries[key]:
-                    chunks.update((
-                        util.parsedatetime(entry['virkning']['from']),
-                        util.parsedatetime(entry['virkning']['to']),
-                    ))
-
-        # sort them, and apply the filter, if given
-        chunks = self.connector.get_date_chunks(chunks)
-
-        def filter_list(entries, start, end):
-            for entry in entries:
-                entry_start = util.parsedatetime(entry['virkning']['from'])
-                entry_end = util.parsedatetime(entry['virkning']['to'])
-
-                if entry_start < end and entry_end > start:
-                    yield entry
+        # parse the validity of each entry exactly once
+        entries = {
+            (group, key): [
+                (
+                    util.parsedatetime(entry['virkning']['from']),
+                    util.parsedatetime(entry['virkning']['to']),
+                    entry,
+                )
+                for entry in reg[group][key]
+            ]
+            for group in everything
+            if group in reg
+            for key in everything[group]
+            if key in reg[group]
+        }
 
-        # finally, extract chunks corresponding to each cut-off
-        for start, end in chunks:
-            effect = {
+        # the beginning and end timestamps of all relevant effects
+        # delimit the chunks; sort them, and apply the filter, if given
+        chunks = list(self.connector.get_date_chunks({
+            timestamp
+            for (group, key), parsed in entries.items()
+            if key in relevant.get(group, ())
+            for start, end, entry in parsed
+            for timestamp in (start, end)
+        }))
+
+        starts = [start for start, end in chunks]
+        ends = [end for start, end in chunks]
+
+        effects = [
+            {
                 group: {
-                    key: list(filter_list(reg[group][key], start, end))
+                    key: []
                     for key in everything[group]
-                    if key in everything[group] and key in reg[group]
+                    if key in reg[group]
                 }
                 for group in everything
                 if group in reg
             }
-
+            for chunk in chunks
+        ]
+
+        # the chunks are sorted and disjoint, so each entry belongs to
+        # a consecutive run of them, which we find by bisection
+        for (group, key), parsed in entries.items():
+            for entry_start, entry_end, entry in parsed:
+                for i in range(bisect.bisect_right(ends, entry_start),
+                               bisect.bisect_left(starts, entry_end)):
+                    effects[i][group][key].append(entry)
+
+        for (start, end), effect in zip(chunks, effects):
             if any(k for g in effect.values() for k in g.values()):
                 yield start, end, effect
 
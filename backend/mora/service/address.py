@@ -7,6 +7,8 @@
 #
 
 import collections
+import functools
+import itertools
 import re
 
 import flask
@@ -14,6 +16,7 @@ import requests
 
 from . import handlers
 from .. import common
+from .. import dawa
 from .. import exceptions
 from .. import lora
 from .. import mapping
@@ -125,31 +128,46 @@ def address_autocomplete(orgid):
     # apartments etc.
     #
 
+    # Should DAWA fail us, we fall back to the local store, if any.
+    #
+
+    store = dawa.get_store()
+
+    def autocomplete(path, kind, count):
+        try:
+            r = session.get(
+                'https://dawa.aws.dk/{}/autocomplete'.format(path),
+                # use a list to work around unordered dicts in Python < 3.6
+                params=[
+                    ('per_side', count),
+                    ('noformat', '1'),
+                    ('kommunekode', code),
+                    ('q', q),
+                ],
+            )
+
+            r.raise_for_status()
+
+            return [(addr['tekst'], addr[kind]['id']) for addr in r.json()]
+
+        except (requests.RequestException, ValueError):
+            if not store:
+                raise
+
+            flask.current_app.logger.exception(
+                'DAWA autocomplete failed, using local store',
+            )
+
+            return store.autocomplete(q, kind, code, count)
+
     addrs = collections.OrderedDict(
-        (addr['tekst'], addr['adgangsadresse']['id'])
-        for addr in session.get(
-            'https://dawa.aws.dk/adgangsadresser/autocomplete',
-            # use a list to work around unordered dicts in Python < 3.6
-            params=[
-                ('per_side', settings.AUTOCOMPLETE_ACCESS_ADDRESS_COUNT),
-                ('noformat', '1'),
-                ('kommunekode', code),
-                ('q', q),
-            ],
-        ).json()
+        autocomplete('adgangsadresser', dawa.ACCESS_ADDRESS,
+                     settings.AUTOCOMPLETE_ACCESS_ADDRESS_COUNT),
     )
 
-    for addr in session.get(
-        'https://dawa.aws.dk/adresser/autocomplete',
-        # use a list to work around unordered dicts in Python < 3.6
-        params=[
-            ('per_side', settings.AUTOCOMPLETE_ADDRESS_COUNT),
-            ('noformat', '1'),
-            ('kommunekode', code),
-            ('q', q),
-        ],
-    ).json():
-        addrs.setdefault(addr['tekst'], addr['adresse']['id'])
+    for text, addrid in autocomplete('adresser', dawa.ADDRESS,
+                                     settings.AUTOCOMPLETE_ADDRESS_COUNT):
+        addrs.setdefault(text, addrid)
 
     return flask.jsonify([
         {
@@ -178,7 +196,7 @@ class AddressRequestHandler(handlers.OrgFunkRequestHandler,
         }
 
         function_effects = [
-            cls.get_one_mo_object(effect, start, end, funcid)
+            (effect, start, end, funcid)
             for funcid, funcobj in c.organisationfunktion.get_all(
                 funktionsnavn=cls.function_key,
                 **search,
@@ -211,12 +229,32 @@ class AddressRequestHandler(handlers.OrgFunkRequestHandler,
             if util.is_reg_valid(effect)
         ]
 
-        return flask.jsonify(function_effects)
+        effects = [effect for effect, start, end, funcid in function_effects]
 
-    @classmethod
-    def get_one_mo_object(cls, effect, start, end, funcid):
-        c = common.get_connector()
+        def prefetch(scope, field):
+            scope.prefetch(itertools.chain.from_iterable(
+                map(field.get_uuids, effects),
+            ))
 
+        # look up all addresses and related objects at once, rather
+        # than one address at a time
+        collections.deque(lora.concurrent_map(lambda func: func(), (
+            functools.partial(base.prefetch_effects, effects),
+            functools.partial(prefetch, c.klasse,
+                              mapping.ADDRESS_TYPE_FIELD),
+            functools.partial(prefetch, c.bruger,
+                              mapping.USER_FIELD),
+            functools.partial(prefetch, c.organisationenhed,
+                              mapping.ASSOCIATED_ORG_UNIT_FIELD),
+        )), maxlen=0)
+
+        return flask.jsonify([
+            cls.get_one_mo_object(c, *args)
+            for args in function_effects
+        ])
+
+    @classmethod
+    def get_one_mo_object(cls, c, effect, start, end, funcid):
         address_type_uuid = mapping.ADDRESS_TYPE_FIELD(effect)[0].get('uuid')
 
         try:
@@ -314,8 +352,7 @@ class AddressRequestHandler(handlers.OrgFunkRequestHandler,
         function_uuid = util.get_uuid(req)
 
         # Get the current org-funktion which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.organisationfunktion.get(uuid=function_uuid)
+        original = self.get_original(function_uuid)
 
         if not original:
             exceptions.ErrorCodes.E_NOT_FOUND()
@@ -6,6 +6,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 import abc
+import collections
 import inspect
 
 from ... import exceptions
@@ -39,6 +40,12 @@ class AddressHandler(metaclass=_AddressHandlerMeta):
     def __init__(self, value):
         self._value = value
 
+    @classmethod
+    def prefetch(cls, values):
+        """Prepare for handling each of the given values, e.g. by
+        looking them up all at once, rather than one at a time"""
+        pass
+
     @classmethod
     def from_effect(cls, effect):
         """Initialize handler from LoRa object"""
@@ -148,3 +155,19 @@ def get_handler_for_scope(scope: str) -> AddressHandler:
         raise exceptions.ErrorCodes.E_INVALID_INPUT(
             'Invalid address scope type {}'.format(scope))
     return handler
+
+
+def prefetch_effects(effects):
+    """Prefetch the addresses of the given LoRa objects, so that
+    subsequently initializing their handlers is quick"""
+    values = collections.defaultdict(list)
+
+    for effect in effects:
+        for addr in mapping.SINGLE_ADDRESS_FIELD(effect):
+            handler = ADDRESS_HANDLERS.get(addr.get('objekttype'))
+
+            if handler and addr.get('urn', '').startswith(handler.prefix):
+                values[handler].append(addr['urn'][len(handler.prefix):])
+
+    for handler, handler_values in values.items():
+        handler.prefetch(handler_values)
@@ -9,7 +9,11 @@ import flask
 import requests
 
 from . import base
+from ... import dawa
+from ... import lora
 from ... import mapping
+from ... import settings
+from ... import util
 
 session = requests.Session()
 session.headers = {
@@ -18,6 +22,22 @@ session.headers = {
 
 NOT_FOUND = "Ukendt"
 
+ENDPOINTS = (
+    'adresser',
+    'adgangsadresser',
+    'historik/adresser',
+    'historik/adgangsadresser',
+)
+
+address_cache = util.LRUCache(settings.DAR_ADDRESS_CACHE_SIZE,
+                              settings.DAR_ADDRESS_CACHE_TTL)
+'''Addresses, or rather the message of the :py:exc:`LookupError` for
+unknown ones, keyed by their UUID.'''
+
+endpoint_cache = util.LRUCache(settings.DAR_ADDRESS_CACHE_SIZE)
+'''The DAR endpoint where we last found each address, so that we may
+try that one first once it expires from :py:data:`address_cache`.'''
+
 
 class DARAddressHandler(base.AddressHandler):
     scope = 'DAR'
@@ -64,12 +84,61 @@ class DARAddressHandler(base.AddressHandler):
         else:
             return super().get_mo_address_and_properties()
 
+    @classmethod
+    def prefetch(cls, values):
+        """Look up the given addresses concurrently"""
+        # without a cache, we'd merely look them up twice
+        if address_cache.maxsize <= 0:
+            return
+
+        addrids = util.uniqueify(
+            v for v in values if address_cache.get(v) is None
+        )
+
+        def fetch(addrid):
+            try:
+                cls._fetch_from_dar(addrid)
+            except Exception:
+                # we report the error once we actually need it
+                pass
+
+        for r in lora.concurrent_map(
+            fetch, addrids, settings.DAR_MAX_CONCURRENT_REQUESTS,
+        ):
+            pass
+
     @staticmethod
     def _fetch_from_dar(addrid):
-        for addrtype in (
-            'adresser', 'adgangsadresser',
-            'historik/adresser', 'historik/adgangsadresser'
-        ):
+        addrobj = address_cache.get(addrid)
+
+        if addrobj is None:
+            try:
+                addrobj = DARAddressHandler._fetch_uncached(addrid)
+            except LookupError as exc:
+                addrobj = str(exc)
+
+            address_cache[addrid] = addrobj
+
+        # raise a new error each time, as raising a shared one from
+        # several threads would mangle its traceback
+        if isinstance(addrobj, str):
+            raise LookupError(addrobj)
+
+        return addrobj
+
+    @staticmethod
+    def _fetch_uncached(addrid):
+        store = dawa.get_store()
+        addrobj = store and store.get(addrid)
+
+        if addrobj:
+            return addrobj
+
+        # try wherever we last found it first
+        last_endpoint = endpoint_cache.get(addrid)
+
+        for addrtype in sorted(ENDPOINTS,
+                               key=lambda e: e != last_endpoint):
             r = session.get(
                 'https://dawa.aws.dk/' + addrtype,
                 # use a list to work around unordered dicts in Python < 3.6
@@ -91,6 +160,8 @@ class DARAddressHandler(base.AddressHandler):
         else:
             raise LookupError('no such address {!r}'.format(addrid))
 
+        endpoint_cache[addrid] = addrtype
+
         return addrobjs.pop()
 
     @staticmethod
@@ -89,8 +89,7 @@ class AssociationRequestHandler(handlers.OrgFunkRequestHandler):
     def prepare_edit(self, req: dict):
         association_uuid = req.get('uuid')
         # Get the current org-funktion which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.organisationfunktion.get(uuid=association_uuid)
+        original = self.get_original(association_uuid)
 
         data = req.get('data')
         new_from, new_to = util.get_validities(data)
@@ -30,6 +30,7 @@ import itertools
 import flask
 
 from . import address
+from . import address_handler
 from . import employee
 from . import facet
 from . import handlers
@@ -58,7 +59,7 @@ DETAIL_TYPES = {
 @blueprint.route(
     '/<any("e", "ou"):type>/<uuid:id>/details/<function>',
 )
-@util.restrictargs('at', 'validity', 'start', 'limit')
+@util.restrictargs('at', 'validity', 'start', 'limit', 'stream')
 def get_detail(type, id, function):
     '''Obtain the list of engagements, associations, roles, etc.
     corresponding to a user or organisational unit. See
@@ -89,6 +90,9 @@ def get_detail(type, id, function):
         values.
     :queryparam int start: Index of first item for paging.
     :queryparam int limit: Maximum items.
+    :queryparam string stream: Send the items as they're serialised,
+        rather than all at once; useful for very long listings. Use
+        ``ndjson`` for newline-delimited JSON with one item per line.
 
     :param type: 'ou' for querying a unit; 'e' for querying an
         employee.
@@ -385,11 +389,6 @@ def get_detail(type, id, function):
 
     c = common.get_connector()
 
-    info = DETAIL_TYPES[type]
-    search = {
-        info.search: id,
-    }
-
     cls = handlers.get_handler_for_role_type(function)
 
     if issubclass(cls, handlers.ReadingRequestHandler):
@@ -399,13 +398,201 @@ def get_detail(type, id, function):
     if function not in handlers.FUNCTION_KEYS:
         exceptions.ErrorCodes.E_UNKNOWN_ROLE_TYPE(type=function)
 
-    search.update(
+    stream = util.get_stream_format()
+
+    result = get_details(
+        c, type, [id], [function],
         limit=int(flask.request.args.get('limit', 0)) or
         settings.DEFAULT_PAGE_SIZE,
         start=int(flask.request.args.get('start', 0)),
-        funktionsnavn=handlers.FUNCTION_KEYS[function],
+        lazy=bool(stream),
+    )[id][function]
+
+    return util.jsonify_stream(result, result, stream)
+
+
+@blueprint.route(
+    '/<any("e", "ou"):type>/details/',
+    methods=['POST'],
+)
+@util.restrictargs('at', 'validity')
+def get_bulk_details(type):
+    '''Obtain the details of many employees or organisational units
+    at once.
+
+    .. :quickref: Detail; Get many
+
+    This is equivalent to issuing a
+    :http:get:`/service/(any:type)/(uuid:id)/details/(function)`
+    request for each employee or unit and function, but considerably
+    faster, as each related class, unit, etc. is only read once.
+
+    :queryparam date at: Show details valid at this point in time,
+        in ISO-8601 format.
+    :queryparam string validity: Only show *past*, *present* or
+        *future* values -- which the default being to show *present*
+        values.
+
+    :param type: 'ou' for querying units; 'e' for querying employees.
+
+    :<json list uuids: The UUIDs to query, i.e. the IDs of the
+        employees or units.
+    :<json list functions: The details to read, see
+        :http:get:`/service/(any:type)/(uuid:id)/details/` for the
+        available values.
+
+    :>json object <uuid>: The details of each employee or unit, keyed
+        by function, as returned by
+        :http:get:`/service/(any:type)/(uuid:id)/details/(function)`.
+
+    :status 200: On success.
+    :status 400: On invalid input.
+
+    **Example Request**:
+
+    .. sourcecode:: json
+
+      {
+        "uuids": [
+          "53181ed2-f1de-4c4a-a8fd-ab358c2c454a",
+          "6ee24785-ee9a-4502-81c2-7697009c9053"
+        ],
+        "functions": ["engagement", "leave"]
+      }
+
+    **Example Response**:
+
+    .. sourcecode:: json
+
+      {
+        "53181ed2-f1de-4c4a-a8fd-ab358c2c454a": {
+          "engagement": [
+            {
+              "engagement_type": {
+                "example": null,
+                "name": "Ansat",
+                "scope": "TEXT",
+                "user_key": "ansat",
+                "uuid": "06f95678-166a-455a-a2ab-121a8d92ea23"
+              },
+              "job_function": {
+                "example": null,
+                "name": "Specialist",
+                "scope": "TEXT",
+                "user_key": "specialist",
+                "uuid": "890d4ff0-b453-4900-b79b-dbb461eda3ee"
+              },
+              "org_unit": {
+                "name": "Humanistisk fakultet",
+                "user_key": "hum",
+                "uuid": "9d07123e-47ac-4a9a-88c8-da82e3a4bc9e",
+                "validity": {
+                  "from": "2016-01-01",
+                  "to": null
+                }
+              },
+              "person": {
+                "name": "Anders And",
+                "uuid": "53181ed2-f1de-4c4a-a8fd-ab358c2c454a"
+              },
+              "uuid": "d000591f-8705-4324-897a-075e3623f37b",
+              "validity": {
+                "from": "2017-01-01",
+                "to": null
+              }
+            }
+          ],
+          "leave": []
+        },
+        "6ee24785-ee9a-4502-81c2-7697009c9053": {
+          "engagement": [],
+          "leave": []
+        }
+      }
+
+    '''
+
+    req = flask.request.get_json()
+
+    if not isinstance(req, dict):
+        exceptions.ErrorCodes.E_INVALID_INPUT(request=req)
+
+    ids = util.uniqueify(util.checked_get(req, 'uuids', [], required=True))
+    functions = util.uniqueify(
+        util.checked_get(req, 'functions', [], required=True),
     )
 
+    for objid in ids:
+        if not util.is_uuid(objid):
+            exceptions.ErrorCodes.E_INVALID_UUID(
+                message='Invalid uuid: {!r}'.format(objid),
+                obj=req,
+            )
+
+    readers = []
+    orgfuncs = []
+
+    for function in functions:
+        cls = handlers.get_handler_for_role_type(function)
+
+        if issubclass(cls, handlers.ReadingRequestHandler):
+            readers.append((function, cls))
+        elif function in handlers.FUNCTION_KEYS:
+            orgfuncs.append(function)
+        else:
+            exceptions.ErrorCodes.E_UNKNOWN_ROLE_TYPE(type=function)
+
+    c = common.get_connector()
+
+    result = get_details(c, type, ids, orgfuncs)
+
+    # the remaining details have their own implementation; they still
+    # benefit from sharing the connector, though
+    for function, cls in readers:
+        for objid in ids:
+            result[objid][function] = cls.get(c, type, objid).get_json()
+
+    return flask.jsonify(result)
+
+
+def get_details(c, type, ids, functions, *,
+                start=0, limit=settings.DEFAULT_PAGE_SIZE, lazy=False):
+    '''Read the given ``organisationfunktion``-based details for
+    each of the given employees or units.
+
+    All functions are fetched at once, and each related class, unit,
+    user, etc. is only fetched and converted once, regardless of how
+    many of the functions refer to it.
+
+    :param c: The connector to use.
+    :param type: 'ou' for units; 'e' for employees.
+    :param ids: The UUIDs of the employees or units.
+    :param functions: The detail types to read, e.g. ``engagement``.
+    :param start: Index of first item for paging, for each subject.
+    :param limit: Maximum items, for each subject.
+    :param lazy: Return iterators converting each detail as they're
+        consumed, rather than lists, so that we never hold all of the
+        converted details at once -- e.g. when streaming them.
+
+    :return: The sorted details, keyed by UUID and detail type.
+
+    '''
+
+    info = DETAIL_TYPES[type]
+    keys = [(objid, function) for objid in ids for function in functions]
+
+    # first, find the functions of each subject; as LoRA requires all
+    # of the given relations to match, we need a search for each
+    found = dict(zip(keys, c.organisationfunktion.fetch_many(
+        {
+            info.search: objid,
+            'funktionsnavn': handlers.FUNCTION_KEYS[function],
+            'foersteresultat': start,
+            'maximalantalresultater': limit,
+        }
+        for objid, function in keys
+    )))
+
     # TODO: the logic encoded in the functions below belong in the
     # 'mapping' module, as part of e.g. FieldTuples
     def get_address(effect):
@@ -535,38 +722,44 @@ def get_detail(type, id, function):
         },
     }
 
-    # first, extract all the effects
-    function_effects = [
-        (start, end, funcid, effect)
-        for funcid, funcobj in c.organisationfunktion.get_all(**search)
-        for start, end, effect in c.organisationfunktion.get_effects(
-            funcobj,
-            {
-                'relationer': (
-                    'opgaver',
-                    'adresser',
-                    'tilknyttedefunktioner',
-                    'organisatoriskfunktionstype',
-                    'tilknyttedeenheder',
-                    'tilknyttedebrugere',
-                ),
-                'tilstande': (
-                    'organisationfunktiongyldighed',
-                ),
-            },
-            {
-                'attributter': (
-                    'organisationfunktionegenskaber',
-                ),
-                'relationer': (
-                    'tilhoerer',
-                    'tilknyttedeorganisationer',
-                    'tilknyttedeitsystemer',
-                ),
-            },
+    # then, fetch all of them at once, and extract the effects
+    funcids = util.uniqueify(itertools.chain.from_iterable(found.values()))
+
+    function_effects = collections.defaultdict(list)
+
+    for funcid, funcobj in c.organisationfunktion.get_all(
+        uuid=funcids, limit=len(funcids),
+    ):
+        function_effects[funcid].extend(
+            (start, end, funcid, effect)
+            for start, end, effect in c.organisationfunktion.get_effects(
+                funcobj,
+                {
+                    'relationer': (
+                        'opgaver',
+                        'adresser',
+                        'tilknyttedefunktioner',
+                        'organisatoriskfunktionstype',
+                        'tilknyttedeenheder',
+                        'tilknyttedebrugere',
+                    ),
+                    'tilstande': (
+                        'organisationfunktiongyldighed',
+                    ),
+                },
+                {
+                    'attributter': (
+                        'organisationfunktionegenskaber',
+                    ),
+                    'relationer': (
+                        'tilhoerer',
+                        'tilknyttedeorganisationer',
+                        'tilknyttedeitsystemer',
+                    ),
+                },
+            )
+            if util.is_reg_valid(effect)
         )
-        if util.is_reg_valid(effect)
-    ]
 
     def as_values(vs):
         if vs is None:
@@ -576,11 +769,15 @@ def get_detail(type, id, function):
             yield v.get('uuid', None)
 
     # extract all object IDs
-    for cache, getter, cachegetter, aslist in converters[function].values():
-        if cache is not None:
-            for start, end, funcid, effect in function_effects:
-                for v in as_values((cachegetter or getter)(effect)):
-                    cache[v] = None
+    for (objid, function), found_funcids in found.items():
+        for cache, getter, cachegetter, aslist in (
+            converters[function].values()
+        ):
+            if cache is not None:
+                for funcid in found_funcids:
+                    for *_, effect in function_effects[funcid]:
+                        for v in as_values((cachegetter or getter)(effect)):
+                            cache[v] = None
 
     # fetch and convert each object once, rather than multiple times
     #
@@ -588,7 +785,8 @@ def get_detail(type, id, function):
     # handle cross-function links first, the only instance being this
     # detail referring to an address
     address_functions = collections.OrderedDict(
-        c.organisationfunktion.get_all(uuid=function_cache)
+        c.organisationfunktion.get_all(uuid=function_cache,
+                                       limit=len(function_cache))
     )
 
     # extract address type ids from address functions
@@ -601,9 +799,13 @@ def get_detail(type, id, function):
     # fetch all classes
     class_cache.update({
         classid: facet.get_one_class(c, classid, classobj)
-        for classid, classobj in c.klasse.get_all(uuid=class_cache)
+        for classid, classobj in c.klasse.get_all(uuid=class_cache,
+                                                  limit=len(class_cache))
     })
 
+    # look up all addresses at once
+    address_handler.base.prefetch_effects(address_functions.values())
+
     function_cache.update({
         funcid: {
             mapping.UUID: funcid,
@@ -625,7 +827,7 @@ def get_detail(type, id, function):
     user_cache.update({
         userid: employee.get_one_employee(c, userid, user)
         for userid, user in
-        c.bruger.get_all(uuid=user_cache)
+        c.bruger.get_all(uuid=user_cache, limit=len(user_cache))
     })
 
     unit_cache.update({
@@ -633,7 +835,7 @@ def get_detail(type, id, function):
             c, unitid, unit, details=orgunit.UnitDetails.MINIMAL,
         )
         for unitid, unit in
-        c.organisationenhed.get_all(uuid=unit_cache)
+        c.organisationenhed.get_all(uuid=unit_cache, limit=len(unit_cache))
     })
 
     itsystem_cache.update({
@@ -641,7 +843,7 @@ def get_detail(type, id, function):
             c, systemid, system,
         )
         for systemid, system in
-        c.itsystem.get_all(uuid=itsystem_cache)
+        c.itsystem.get_all(uuid=itsystem_cache, limit=len(itsystem_cache))
     })
 
     # fetch and convert each object once, rather than multiple times
@@ -669,7 +871,7 @@ def get_detail(type, id, function):
             return None
 
     # finally, gather it all in the appropriate objects
-    def convert(start, end, funcid, effect):
+    def convert(function, start, end, funcid, effect):
         func = {
             key: get_one(effect, *args)
             for key, args in converters[function].items()
@@ -691,7 +893,32 @@ def get_detail(type, id, function):
                                    default=' '),
                 util.get_obj_value(obj, (mapping.ORG_UNIT, mapping.NAME)))
 
-    return flask.jsonify(sorted(
-        itertools.starmap(convert, function_effects),
-        key=sort_key
-    ))
+    def get_sort_key(function, start, end, funcid, effect):
+        # convert just what we sort by, so that we needn't convert
+        # all details before sending any of them
+        return sort_key({
+            mapping.VALIDITY: {
+                mapping.FROM: util.to_iso_date(start),
+            },
+            **{
+                key: get_one(effect, *converters[function][key])
+                for key in (mapping.PERSON, mapping.ORG_UNIT)
+                if key in converters[function]
+            },
+        })
+
+    result = collections.OrderedDict((objid, {}) for objid in ids)
+
+    for (objid, function), found_funcids in found.items():
+        details = itertools.starmap(convert, sorted(
+            (
+                (function, *args)
+                for funcid in found_funcids
+                for args in function_effects[funcid]
+            ),
+            key=lambda args: get_sort_key(*args),
+        ))
+
+        result[objid][function] = details if lazy else list(details)
+
+    return result
@@ -26,6 +26,7 @@ import flask
 from . import handlers
 from .. import exceptions
 from .. import util
+from .. import validator
 
 blueprint = flask.Blueprint('detail_writing', __name__, static_url_path='',
                             url_prefix='/service')
@@ -43,7 +44,11 @@ def handle_requests(
     else:
         exceptions.ErrorCodes.E_INVALID_INPUT(request=reqs)
 
-    requests = handlers.generate_requests(reqs, request_type)
+    with validator.prefetched(reqs):
+        if request_type == handlers.RequestType.EDIT:
+            handlers.prefetch_originals(reqs)
+
+        requests = handlers.generate_requests(reqs, request_type)
 
     uuids = handlers.submit_requests(requests)
     if is_single_request:
@@ -74,6 +79,16 @@ def create():
         "to": "2017-12-31",
       }
 
+    Requests in the same payload are submitted concurrently, and must
+    thus be independent of each other -- e.g. they cannot refer to an
+    object created by another request of the same payload. Only
+    requests for the same object are submitted in order. Should some
+    of the requests fail, the rest are submitted nonetheless, and the
+    response is an ``E_PARTIAL_FAILURE`` error listing the ``results``
+    of each request, with ``null`` for those not written, and the
+    ``errors`` of the failed ones, with their ``index``. Should all
+    of them fail, the response is the error of the first one.
+
     Request payload contains a list of creation objects, each differentiated
     by the attribute ``type``. Each of these object types are detailed below:
 
@@ -435,6 +450,16 @@ def edit():
         "to": "2017-12-31"
       }
 
+    Requests in the same payload are submitted concurrently, and must
+    thus be independent of each other -- e.g. they cannot refer to an
+    object created by another request of the same payload. Only
+    requests for the same object are submitted in order. Should some
+    of the requests fail, the rest are submitted nonetheless, and the
+    response is an ``E_PARTIAL_FAILURE`` error listing the ``results``
+    of each request, with ``null`` for those not written, and the
+    ``errors`` of the failed ones, with their ``index``. Should all
+    of them fail, the response is the error of the first one.
+
     Request payload contains a list of edit objects, each differentiated
     by the attribute ``type``. Each of these object types are detailed below:
 
@@ -17,6 +17,7 @@ For more information regarding reading relations involving employees, refer to
 :http:get:`/service/(any:type)/(uuid:id)/details/`
 
 '''
+import collections
 import copy
 import uuid
 import enum
@@ -53,6 +54,7 @@ class EmployeeDetails(enum.Enum):
 class EmployeeRequestHandler(handlers.RequestHandler):
     __slots__ = ('details_requests',)
     role_type = "employee"
+    object_type = 'bruger'
 
     def prepare_create(self, req):
         c = lora.Connector()
@@ -116,8 +118,7 @@ class EmployeeRequestHandler(handlers.RequestHandler):
             userid = util.get_uuid(data, fallback=original_data)
 
         # Get the current org-unit which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.bruger.get(uuid=userid)
+        original = self.get_original(userid)
         new_from, new_to = util.get_validities(data)
 
         validator.is_edit_from_date_before_today(new_from)
@@ -230,7 +231,7 @@ def get_one_employee(c, userid, user=None, details=EmployeeDetails.MINIMAL):
 
 
 @blueprint.route('/o/<uuid:orgid>/e/')
-@util.restrictargs('at', 'start', 'limit', 'query')
+@util.restrictargs('at', 'start', 'limit', 'query', 'stream')
 def list_employees(orgid):
     '''Query employees in an organisation.
 
@@ -245,6 +246,10 @@ def list_employees(orgid):
     :queryparam string query: Filter by employees matching this string.
         Please note that this only applies to attributes of the user, not the
         relations or engagements they have.
+    :queryparam string stream: Send the items as they're serialised,
+        rather than all at once; useful for very large pages. Use
+        ``ndjson`` for newline-delimited JSON with one item per line,
+        omitting ``offset`` and ``total``.
 
     :>json string items: The returned items.
     :>json string offset: Pagination offset.
@@ -297,9 +302,11 @@ def list_employees(orgid):
         else:
             kwargs.update(vilkaarligattr='%{}%'.format(args['query']))
 
-    return flask.jsonify(
-        c.bruger.paged_get(get_one_employee, **kwargs)
-    )
+    stream = util.get_stream_format()
+
+    page = c.bruger.paged_get(get_one_employee, lazy=bool(stream), **kwargs)
+
+    return util.jsonify_stream(page, page['items'], stream)
 
 
 @blueprint.route('/e/<uuid:id>/')
@@ -351,6 +358,118 @@ def get_employee(id):
         exceptions.ErrorCodes.E_USER_NOT_FOUND()
 
 
+def _terminate_employees(terminations) -> list:
+    '''Terminate the given employees, given as pairs of their UUID
+    and the request to terminate them.
+
+    Employees terminated on the same date share their lookups, and we
+    submit the termination of all their functions at once. We check
+    that every employee exists prior to writing anything, and return
+    the result of each employee in order, as
+    :py:func:`mora.service.handlers.try_submit_requests` does: its
+    UUID if terminated, the first error of its functions if any
+    failed, or ``None`` if it wasn't submitted. We only write history
+    entries for employees terminated in full.
+
+    '''
+    terminations = list(terminations)
+    by_date = collections.OrderedDict()
+
+    for i, (employee_uuid, request) in enumerate(terminations):
+        by_date.setdefault(util.get_valid_to(request), []).append(i)
+
+    connectors = collections.OrderedDict()
+
+    for date, indices in by_date.items():
+        c = connectors[date] = lora.Connector(
+            virkningfra=date,
+            virkningtil='infinity',
+        )
+
+        c.bruger.prefetch(terminations[i][0] for i in indices)
+
+        for i in indices:
+            if not c.bruger.get(terminations[i][0]):
+                exceptions.ErrorCodes.E_USER_NOT_FOUND(
+                    employee_uuid=terminations[i][0],
+                )
+
+    request_handlers = []
+    # the index of the employee of each request handler
+    owners = []
+
+    for date, indices in by_date.items():
+        c = connectors[date]
+
+        requests = collections.OrderedDict(
+            (funcid, i)
+            for i, funcids in zip(
+                indices,
+                c.organisationfunktion.fetch_many(
+                    dict(
+                        tilknyttedebrugere=terminations[i][0],
+                        gyldighed='Aktiv',
+                    )
+                    for i in indices
+                ),
+            )
+            for funcid in funcids
+        )
+
+        if not requests:
+            continue
+
+        for objid, obj in c.organisationfunktion.get_all(
+            uuid=list(requests),
+            limit=len(requests),
+        ):
+            i = requests[objid]
+
+            request_handlers.append(
+                handlers.get_handler_for_function(obj)(
+                    {
+                        'date': date,
+                        'uuid': objid,
+                        'original': obj,
+                        'request': terminations[i][1],
+                    },
+                    handlers.RequestType.TERMINATE,
+                ),
+            )
+            owners.append(i)
+
+    results = [employee_uuid for employee_uuid, request in terminations]
+
+    for i, result in zip(
+        owners,
+        handlers.try_submit_requests(request_handlers),
+    ):
+        # keep the first error of each employee
+        if not isinstance(results[i], Exception) and \
+                not isinstance(result, str):
+            results[i] = result
+
+    # Write a noop entry to the users, to be used for the history
+    def add_history_entry(i):
+        date = util.get_valid_to(terminations[i][1])
+
+        try:
+            common.add_history_entry(
+                connectors[date].bruger,
+                terminations[i][0],
+                "Afslut medarbejder",
+            )
+        except Exception as exc:
+            results[i] = exc
+
+    collections.deque(lora.concurrent_map(
+        add_history_entry,
+        [i for i, result in enumerate(results) if isinstance(result, str)],
+    ), maxlen=0)
+
+    return results
+
+
 @blueprint.route('/e/<uuid:employee_uuid>/terminate', methods=['POST'])
 @util.restrictargs('force')
 def terminate_employee(employee_uuid):
@@ -382,36 +501,95 @@ def terminate_employee(employee_uuid):
 
     """
     request = flask.request.get_json()
-    date = util.get_valid_to(request)
-
-    c = lora.Connector(virkningfra=date, virkningtil='infinity')
-
-    request_handlers = [
-        handlers.get_handler_for_function(obj)(
-            {
-                'date': date,
-                'uuid': objid,
-                'original': obj,
-                'request': request
-            },
-            handlers.RequestType.TERMINATE,
-        )
-        for objid, obj in c.organisationfunktion.get_all(
-            tilknyttedebrugere=employee_uuid,
-            gyldighed='Aktiv',
-        )
-    ]
 
-    for handler in request_handlers:
-        handler.submit()
+    result, = _terminate_employees([(employee_uuid, request)])
 
-    # Write a noop entry to the user, to be used for the history
-    common.add_history_entry(c.bruger, employee_uuid, "Afslut medarbejder")
+    if isinstance(result, Exception):
+        raise result
 
     # TODO:
     return flask.jsonify(employee_uuid), 200
 
 
+@blueprint.route('/e/terminate', methods=['POST'])
+@util.restrictargs('force')
+def terminate_employees():
+    """Terminates many employees and all of their roles at once, e.g. at
+    the end of the year. See
+    :http:post:`/service/e/(uuid:employee_uuid)/terminate` for details.
+
+    .. :quickref: Employee; Terminate many
+
+    :query boolean force: When ``true``, bypass validations.
+
+    :statuscode 200: The termination succeeded.
+    :statuscode 400: The same employee occurs more than once; nothing
+        was written.
+    :statuscode 404: One of the employees doesn't exist; nothing was
+        written.
+    :statuscode 500: Some of the terminations failed. The error lists
+        the UUID of each terminated employee in ``results`` -- or
+        ``null`` if not terminated -- and the ``errors``, each along
+        with the ``index`` of its employee. Employees are terminated
+        concurrently, and only those terminated in full get a history
+        entry.
+
+    :<jsonarr string uuid: The UUID of the employee to be terminated.
+    :<jsonarr string to: When the termination should occur, as an ISO 8601
+        date.
+    :<jsonarr boolean terminate_all: *Optional* - perform full termination,
+        i.e. terminate the associated manager functions as well.
+
+    :>jsonarr string: The UUIDs of the terminated employees.
+
+    **Example Request**:
+
+    .. sourcecode:: json
+
+      [
+        {
+          "uuid": "53181ed2-f1de-4c4a-a8fd-ab358c2c454a",
+          "validity": {
+            "to": "2018-12-31"
+          }
+        },
+        {
+          "uuid": "6ee24785-ee9a-4502-81c2-7697009c9053",
+          "validity": {
+            "to": "2018-12-31"
+          },
+          "terminate_all": true
+        }
+      ]
+
+    """
+    reqs = flask.request.get_json()
+
+    if not isinstance(reqs, list) or \
+            not all(isinstance(req, dict) for req in reqs):
+        exceptions.ErrorCodes.E_INVALID_INPUT(request=reqs)
+
+    employee_uuids = [util.get_uuid(req) for req in reqs]
+
+    duplicates = sorted(
+        employee_uuid
+        for employee_uuid, count in collections.Counter(
+            employee_uuids,
+        ).items()
+        if count > 1
+    )
+
+    if duplicates:
+        exceptions.ErrorCodes.E_INVALID_INPUT(
+            'duplicate employees',
+            employee_uuid=duplicates,
+        )
+
+    return flask.jsonify(handlers.check_results(
+        _terminate_employees(zip(employee_uuids, reqs)),
+    ))
+
+
 @blueprint.route('/e/<uuid:employee_uuid>/history/', methods=['GET'])
 @util.restrictargs()
 def get_employee_history(employee_uuid):
@@ -77,8 +77,7 @@ class EngagementRequestHandler(handlers.OrgFunkRequestHandler):
         engagement_uuid = util.get_uuid(req)
 
         # Get the current org-funktion which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.organisationfunktion.get(uuid=engagement_uuid)
+        original = self.get_original(engagement_uuid)
 
         # Get org unit uuid for validation purposes
         org_unit = util.get_obj_value(
@@ -126,7 +126,7 @@ def get_one_class(c, classid, clazz=None):
 
 
 @blueprint.route('/o/<uuid:orgid>/f/<facet>/')
-@util.restrictargs('limit', 'start')
+@util.restrictargs('limit', 'start', 'stream')
 def get_classes(orgid: uuid.UUID, facet: str):
     '''List classes available in the given facet.
 
@@ -138,6 +138,10 @@ def get_classes(orgid: uuid.UUID, facet: str):
 
     :queryparam int start: Index of first item for paging.
     :queryparam int limit: Maximum items.
+    :queryparam string stream: Send the classes as they're serialised,
+        rather than all at once; useful for very large facets. Use
+        ``ndjson`` for newline-delimited JSON with one class per line,
+        omitting the facet itself.
 
     :>jsonarr string name: Human-readable name.
     :>jsonarr string uuid: Machine-friendly UUID.
@@ -210,14 +214,17 @@ def get_classes(orgid: uuid.UUID, facet: str):
 
     assert len(facetids) <= 1, 'Facet is not unique'
 
-    return flask.jsonify(
-        facetids and get_one_facet(
-            c,
-            facetids[0],
-            orgid,
-            data=c.klasse.paged_get(get_one_class,
-                                    facet=facetids,
-                                    ansvarlig=orgid,
-                                    publiceret='Publiceret',
-                                    start=start, limit=limit),
-        ))
+    stream = util.get_stream_format()
+
+    page = c.klasse.paged_get(get_one_class,
+                              facet=facetids,
+                              ansvarlig=orgid,
+                              publiceret='Publiceret',
+                              start=start, limit=limit,
+                              lazy=bool(stream))
+
+    return util.jsonify_stream(
+        get_one_facet(c, facetids[0], orgid, data=page),
+        page['items'],
+        stream,
+    )
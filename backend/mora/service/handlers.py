@@ -12,6 +12,8 @@ handlers for the various detail types.
 '''
 
 import abc
+import collections
+import copy
 import enum
 import inspect
 import typing
@@ -20,6 +22,7 @@ from .. import common
 from .. import exceptions
 from .. import lora
 from .. import mapping
+from .. import settings
 from .. import util
 from .. import validator
 
@@ -68,6 +71,11 @@ class RequestHandler(metaclass=_RequestHandlerMeta):
     The `role_type` for corresponding details to this attribute.
     '''
 
+    object_type = None
+    '''
+    The type of LoRA objects edited by this handler, e.g. ``bruger``.
+    '''
+
     @classmethod
     def _register(cls):
         assert cls.role_type is not None
@@ -97,6 +105,20 @@ class RequestHandler(metaclass=_RequestHandlerMeta):
         else:
             raise NotImplementedError
 
+    @classmethod
+    def get_original(cls, objid: str) -> typing.Optional[dict]:
+        """
+        Obtain the entire history of the given object, prior to
+        editing it. The result is a copy, and may be modified freely.
+
+        :param objid: The UUID of the object.
+        """
+        c = validator.get_shared_connector() or lora.Connector(
+            virkningfra='-infinity', virkningtil='infinity',
+        )
+
+        return copy.deepcopy(getattr(c, cls.object_type).get(objid))
+
     @abc.abstractmethod
     def prepare_create(self, request: dict):
         """
@@ -156,6 +178,8 @@ class OrgFunkRequestHandler(RequestHandler):
 
     __slots__ = ()
 
+    object_type = 'organisationfunktion'
+
     function_key = None
     '''
     When set, automatically register this class as a writing handler
@@ -256,5 +280,145 @@ def generate_requests(
     ]
 
 
+def prefetch_originals(requests: typing.List[dict]):
+    '''Look up the objects to edit by the given requests at once, so
+    that :py:meth:`RequestHandler.get_original` needn't look them up
+    one at a time.
+
+    '''
+    c = validator.get_shared_connector()
+
+    if c is None:
+        return
+
+    uuids = collections.defaultdict(set)
+
+    for req in requests:
+        if not isinstance(req, dict):
+            continue
+
+        cls = HANDLERS_BY_ROLE_TYPE.get(req.get('type'))
+
+        if cls is None or cls.object_type is None:
+            continue
+
+        # the handlers take the UUID from one of these, in this order
+        for obj in (req, req.get('data'), req.get('original')):
+            if isinstance(obj, dict) and util.is_uuid(obj.get(mapping.UUID)):
+                uuids[cls.object_type].add(obj[mapping.UUID])
+                break
+
+    collections.deque(lora.concurrent_map(
+        lambda args: getattr(c, args[0]).prefetch(sorted(args[1])),
+        uuids.items(),
+    ), maxlen=0)
+
+
+def _submit_in_order(requests: typing.List[RequestHandler]) -> list:
+    results = []
+
+    for request in requests:
+        try:
+            results.append(request.submit())
+        except Exception as exc:
+            # the remaining requests may depend on this one
+            results.append(exc)
+            break
+
+    return results + [None] * (len(requests) - len(results))
+
+
+def try_submit_requests(requests: typing.List[RequestHandler]) -> list:
+    '''Submit the given requests to LoRA, returning the result of each
+    of them, in order: the UUID once written, the exception raised
+    when submitting it, or ``None`` if not submitted at all.
+
+    We consider the requests independent of each other unless they
+    concern the same object, and submit them concurrently, with at
+    most ``MAX_CONCURRENT_WRITES`` in flight at once. Requests for the
+    same object are submitted one at a time, in order, and none after
+    the first of them to fail. Please note that a failure thus doesn't
+    stop the submission of the other requests.
+
+    With ``MAX_CONCURRENT_WRITES`` set to 1, we instead submit all
+    requests one at a time, in order, and stop at the first failure.
+
+    '''
+
+    if settings.MAX_CONCURRENT_WRITES <= 1:
+        return _submit_in_order(requests)
+
+    groups = collections.OrderedDict()
+
+    for i, request in enumerate(requests):
+        groups.setdefault(request.uuid or i, []).append(i)
+
+    results = [None] * len(requests)
+
+    for indices, group_results in zip(groups.values(), lora.concurrent_map(
+        lambda indices: _submit_in_order([requests[i] for i in indices]),
+        groups.values(),
+        settings.MAX_CONCURRENT_WRITES,
+    )):
+        for i, result in zip(indices, group_results):
+            results[i] = result
+
+    return results
+
+
+def get_error_body(exc: Exception) -> dict:
+    '''Describe the given error, as we would in a response.'''
+    if not isinstance(exc, exceptions.HTTPException):
+        exc = exceptions.HTTPException(exceptions.ErrorCodes.E_UNKNOWN,
+                                       str(exc) or None, cause=exc)
+
+    return exc.body
+
+
+def check_results(results: list) -> typing.List[str]:
+    '''Check the given results, as returned by
+    :py:func:`try_submit_requests`, and return them should all have
+    been written.
+
+    Should nothing have been written, we raise the error of the first
+    failure. Otherwise, should anything fail, we raise
+    :py:attr:`mora.exceptions.ErrorCodes.E_PARTIAL_FAILURE`, listing
+    each result -- or ``None`` if it wasn't written -- and each error,
+    along with its index.
+
+    '''
+
+    errors = [
+        (i, result)
+        for i, result in enumerate(results)
+        if isinstance(result, Exception)
+    ]
+
+    if not errors:
+        return results
+
+    written = [
+        None if isinstance(result, Exception) else result
+        for result in results
+    ]
+
+    if not any(written):
+        raise errors[0][1]
+
+    exceptions.ErrorCodes.E_PARTIAL_FAILURE(
+        results=written,
+        errors=[
+            {
+                'index': i,
+                **get_error_body(exc),
+            }
+            for i, exc in errors
+        ],
+    )
+
+
 def submit_requests(requests: typing.List[RequestHandler]) -> typing.List[str]:
-    return [request.submit() for request in requests]
+    '''Submit the given requests to LoRA, returning their UUIDs in
+    order. See :py:func:`try_submit_requests` and
+    :py:func:`check_results`.'''
+    return check_results(try_submit_requests(requests))
@@ -92,8 +92,7 @@ class ItsystemRequestHandler(handlers.OrgFunkRequestHandler):
         function_uuid = util.get_uuid(req)
 
         # Get the current org-funktion which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.organisationfunktion.get(uuid=function_uuid)
+        original = self.get_original(function_uuid)
 
         if not original:
             exceptions.ErrorCodes.E_NOT_FOUND()
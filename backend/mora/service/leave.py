@@ -70,8 +70,7 @@ class LeaveRequestHandler(handlers.OrgFunkRequestHandler):
     def prepare_edit(self, req: dict):
         leave_uuid = req.get('uuid')
         # Get the current org-funktion which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.organisationfunktion.get(uuid=leave_uuid)
+        original = self.get_original(leave_uuid)
 
         data = req.get('data')
         new_from, new_to = util.get_validities(data)
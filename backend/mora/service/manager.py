@@ -139,8 +139,7 @@ class ManagerRequestHandler(handlers.OrgFunkRequestHandler):
     def prepare_edit(self, req: dict):
         manager_uuid = req.get('uuid')
         # Get the current org-funktion which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.organisationfunktion.get(uuid=manager_uuid)
+        original = self.get_original(manager_uuid)
 
         data = req.get('data')
         new_from, new_to = util.get_validities(data)
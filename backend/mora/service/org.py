@@ -14,18 +14,38 @@ This section describes how to interact with organisations.
 
 '''
 
+import json
 import operator
+import threading
+import time
 
 import flask
+import flask_saml_sso
 import werkzeug
 
 from .. import common
+from .. import hierarchy
+from .. import lora
 from .. import mapping
+from .. import settings
 from .. import util
 
 blueprint = flask.Blueprint('organisation', __name__, static_url_path='',
                             url_prefix='/service')
 
+FUNCTION_COUNTS = (
+    ('engagement_count', mapping.ENGAGEMENT_KEY),
+    ('association_count', mapping.ASSOCIATION_KEY),
+    ('leave_count', mapping.LEAVE_KEY),
+    ('role_count', mapping.ROLE_KEY),
+    ('manager_count', mapping.MANAGER_KEY),
+)
+
+# keyed by organisation and user; see get_statistics_snapshot()
+_snapshots = util.LRUCache(settings.ORG_STATISTICS_SNAPSHOT_CACHE_SIZE)
+_snapshots_lock = threading.Lock()
+_refreshing = {}
+
 
 def get_one_organisation(c, orgid, org=None):
     if not org:
@@ -43,6 +63,141 @@ def get_one_organisation(c, orgid, org=None):
     }
 
 
+def get_statistics(c, orgid, *, active=False, build=True):
+    '''Count the units, employees and functions of an organisation.
+
+    Rather than one search after the other, we issue them all at once,
+    and use the index of the unit hierarchy for counting units, where
+    available.
+
+    :param active: Also count the active employees and functions, as
+        e.g. ``active_person_count``. Please note that this is
+        considerably slower.
+    :param build: Whether to build the index of the unit hierarchy, if
+        missing, rather than searching for the units.
+
+    '''
+
+    searches = [
+        ('person_count', c.bruger, {'tilhoerer': orgid}),
+    ] + [
+        (key, c.organisationfunktion, {
+            'tilknyttedeorganisationer': orgid,
+            'funktionsnavn': funktionsnavn,
+        })
+        for key, funktionsnavn in FUNCTION_COUNTS
+    ]
+
+    if active:
+        searches += [
+            ('active_' + key, scope, dict(params, gyldighed='Aktiv'))
+            for key, scope, params in searches
+        ]
+
+    unit_hierarchy = hierarchy.get_hierarchy(orgid, build=build)
+
+    if unit_hierarchy:
+        r = {
+            'child_count': unit_hierarchy.count_children(orgid,
+                                                         c.start, c.end),
+            'unit_count': unit_hierarchy.count_active(c.start, c.end),
+        }
+    else:
+        r = {}
+
+        searches += [
+            ('child_count', c.organisationenhed, {
+                'overordnet': orgid,
+                'gyldighed': 'Aktiv',
+            }),
+            ('unit_count', c.organisationenhed, {
+                'tilhoerer': orgid,
+                'gyldighed': 'Aktiv',
+            }),
+        ]
+
+    r.update(zip(
+        (key for key, scope, params in searches),
+        lora.concurrent_map(
+            lambda search: len(search[1](**search[2])),
+            searches,
+        ),
+    ))
+
+    return r
+
+
+def _get_user_key():
+    '''Identify the user of the current request, if authenticated.
+
+    Snapshots are computed with the credentials of whoever triggered
+    them, and what LoRA lets us read may depend on those, so we only
+    share them between requests of the same user.
+
+    '''
+    if (
+        not flask.has_request_context() or
+        not flask.current_app.config['SAML_AUTH_ENABLE']
+    ):
+        return None
+
+    return json.dumps(flask_saml_sso.get_session_attributes(),
+                      sort_keys=True, default=str)
+
+
+def _refresh_statistics(key):
+    orgid, user = key
+
+    try:
+        r = get_statistics(lora.Connector(), orgid, active=True)
+
+        with _snapshots_lock:
+            _snapshots[key] = time.monotonic(), r
+
+    finally:
+        with _snapshots_lock:
+            del _refreshing[key]
+
+
+def get_statistics_snapshot(c, orgid):
+    '''Get the current statistics of an organisation, including the
+    active counts, from a snapshot refreshed in the background.
+
+    Should the snapshot be older than ``ORG_STATISTICS_SNAPSHOT_TTL``
+    or missing, we start refreshing it. In the latter case, we return
+    the quick counts meanwhile, so as to never block on the slow ones
+    -- nor on building the index of the unit hierarchy.
+
+    Each user gets their own snapshot, computed using their
+    credentials; see :py:func:`_get_user_key`.
+
+    '''
+
+    key = str(orgid), _get_user_key()
+
+    with _snapshots_lock:
+        taken, r = _snapshots.get(key, (None, None))
+
+        if key not in _refreshing and (
+            taken is None or
+            time.monotonic() - taken >= settings.ORG_STATISTICS_SNAPSHOT_TTL
+        ):
+            func = _refresh_statistics
+
+            if flask.has_request_context():
+                func = flask.copy_current_request_context(func)
+
+            _refreshing[key] = threading.Thread(
+                target=func,
+                args=(key,),
+                name='statistics-{}'.format(orgid),
+                daemon=True,
+            )
+            _refreshing[key].start()
+
+    return r if r is not None else get_statistics(c, orgid, build=False)
+
+
 @blueprint.route('/o/')
 @util.restrictargs('at')
 def list_organisations():
@@ -112,6 +267,11 @@ def get_organisation(orgid):
     :<json int leave_count: Amount of leaves in this organisation.
     :<json int role_count: Amount of roles in this organisation.
     :<json int manager_count: Amount of managers in this organisation.
+    :<json int active_person_count: Amount of people currently active
+        in this organisation. Likewise for all other counts of people
+        and functions above, e.g. ``active_engagement_count``. Only
+        available when ``ORG_STATISTICS_SNAPSHOT_TTL`` is set, in
+        which case all counts may be somewhat outdated.
 
     :status 200: Whenever the organisation exists and is readable.
     :status 404: When no such organisation exists.
@@ -145,36 +305,18 @@ def get_organisation(orgid):
     except (KeyError, TypeError):
         raise werkzeug.exceptions.NotFound
 
-    units = c.organisationenhed(tilhoerer=orgid, gyldighed='Aktiv')
-    children = c.organisationenhed(overordnet=orgid, gyldighed='Aktiv')
-
-    # FIXME: we should filter for activity, but that's extremely slow
-    # 0.8s -> 12.3s for 28k users and 33k functions
+    # filtering for activity is extremely slow -- 0.8s -> 12.3s for
+    # 28k users and 33k functions -- so we only do so in the background
     # https://redmine.magenta-aps.dk/issues/21273
-    users = c.bruger(tilhoerer=orgid)
-    engagements = c.organisationfunktion(tilknyttedeorganisationer=orgid,
-                                         funktionsnavn=mapping.ENGAGEMENT_KEY)
-    associations = c.organisationfunktion(
-        tilknyttedeorganisationer=orgid,
-        funktionsnavn=mapping.ASSOCIATION_KEY,
-    )
-    leaves = c.organisationfunktion(tilknyttedeorganisationer=orgid,
-                                    funktionsnavn=mapping.LEAVE_KEY)
-    roles = c.organisationfunktion(tilknyttedeorganisationer=orgid,
-                                   funktionsnavn=mapping.ROLE_KEY)
-    managers = c.organisationfunktion(tilknyttedeorganisationer=orgid,
-                                      funktionsnavn=mapping.MANAGER_KEY)
+    if settings.ORG_STATISTICS_SNAPSHOT_TTL > 0 and \
+            not flask.request.args.get('at'):
+        statistics = get_statistics_snapshot(c, orgid)
+    else:
+        statistics = get_statistics(c, orgid, build=False)
 
     return flask.jsonify({
         'name': attrs['organisationsnavn'],
         'user_key': attrs['brugervendtnoegle'],
         'uuid': orgid,
-        'child_count': len(children),
-        'unit_count': len(units),
-        'person_count': len(users),
-        'engagement_count': len(engagements),
-        'association_count': len(associations),
-        'leave_count': len(leaves),
-        'role_count': len(roles),
-        'manager_count': len(managers),
+        **statistics,
     })
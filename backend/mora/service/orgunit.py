@@ -24,6 +24,7 @@ import functools
 import itertools
 import locale
 import operator
+import typing
 import uuid
 import json
 
@@ -36,6 +37,7 @@ from . import handlers
 from . import org
 from .. import common
 from .. import exceptions
+from .. import hierarchy
 from .. import lora
 from .. import mapping
 from .. import settings
@@ -68,6 +70,7 @@ class OrgUnitRequestHandler(handlers.ReadingRequestHandler):
     __slots__ = ()
 
     role_type = 'org_unit'
+    object_type = 'organisationenhed'
 
     @classmethod
     def has(cls, scope, reg):
@@ -187,8 +190,7 @@ class OrgUnitRequestHandler(handlers.ReadingRequestHandler):
         unitid = util.get_uuid(data, fallback=original_data)
 
         # Get the current org-unit which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.organisationenhed.get(uuid=unitid)
+        original = self.get_original(unitid)
 
         if not original:
             exceptions.ErrorCodes.E_ORG_UNIT_NOT_FOUND(org_unit_uuid=unitid)
@@ -305,10 +307,57 @@ def _inject_org_units(details, org_unit_uuid, valid_from, valid_to):
     return decorated
 
 
+def get_child_counts(c, units: typing.Mapping[str, dict]) -> typing.Dict[
+        str, int]:
+    '''Count the active units nested immediately beneath each of the
+    given units.
+
+    Where the index of the unit hierarchy is at hand, we count them
+    using that, without searching at all. LoRA cannot search for the
+    children of several units at once, though, so short of reading the
+    entire organisation, the remaining units take a search each. We
+    issue those concurrently, fetching merely the UUIDs of the
+    children.
+
+    :param units: A mapping of unit UUIDs to their registrations.
+    :return: A mapping of unit UUIDs to the amount of children.
+
+    '''
+
+    counts = {}
+    unindexed = []
+    hierarchies = {}
+
+    for unitid, unit in units.items():
+        orgid = next(mapping.BELONGS_TO_FIELD.get_uuids(unit), None)
+
+        if orgid not in hierarchies:
+            hierarchies[orgid] = hierarchy.get_hierarchy(orgid, build=False)
+
+        unit_hierarchy = hierarchies[orgid]
+
+        if unit_hierarchy and unitid in unit_hierarchy:
+            counts[unitid] = unit_hierarchy.count_children(unitid,
+                                                           c.start, c.end)
+        else:
+            unindexed.append(unitid)
+
+    counts.update(zip(unindexed, map(len, c.organisationenhed.fetch_many(
+        dict(overordnet=unitid, gyldighed='Aktiv')
+        for unitid in unindexed
+    ))))
+
+    return counts
+
+
 def get_one_orgunit(c, unitid, unit=None,
-                    details=UnitDetails.NCHILDREN, validity=None) -> dict:
+                    details=UnitDetails.NCHILDREN, validity=None,
+                    child_count=None) -> dict:
     '''Internal API for returning one organisation unit.
 
+    :param child_count: The amount of children of the unit, if
+        already known; see :py:func:`get_child_counts`.
+
     '''
 
     if not unit:
@@ -332,11 +381,22 @@ def get_one_orgunit(c, unitid, unit=None,
     }
 
     if details is UnitDetails.NCHILDREN:
-        children = c.organisationenhed(overordnet=unitid, gyldighed='Aktiv')
+        if child_count is None:
+            child_count = get_child_counts(c, {unitid: unit})[unitid]
 
-        r['child_count'] = len(children)
+        r['child_count'] = child_count
 
     elif details is UnitDetails.FULL:
+        # building the index reads the entire organisation, which
+        # isn't worth it for the ancestors of a single unit
+        unit_hierarchy = hierarchy.get_hierarchy(orgid, build=False)
+
+        if unit_hierarchy:
+            # fetch all ancestors at once, rather than one per level
+            c.organisationenhed.prefetch(
+                unit_hierarchy.get_ancestors(unitid, c.start, c.end),
+            )
+
         parent = get_one_orgunit(c, parentid, details=UnitDetails.FULL)
 
         r[mapping.ORG] = org.get_one_organisation(
@@ -453,11 +513,14 @@ def get_children(type, parentid):
     if not obj or not obj.get('attributter'):
         exceptions.ErrorCodes.E_ORG_UNIT_NOT_FOUND(org_unit_uuid=parentid)
 
+    childobjs = dict(c.organisationenhed.get_all(overordnet=parentid,
+                                                 gyldighed='Aktiv'))
+    child_counts = get_child_counts(c, childobjs)
+
     children = [
-        get_one_orgunit(c, childid, child)
-        for childid, child in
-        c.organisationenhed.get_all(overordnet=parentid,
-                                    gyldighed='Aktiv')
+        get_one_orgunit(c, childid, child,
+                        child_count=child_counts[childid])
+        for childid, child in childobjs.items()
     ]
 
     children.sort(key=operator.itemgetter('name'))
@@ -548,9 +611,10 @@ def get_unit_tree(c, unitids, with_siblings=False):
             c, unitid, units[unitid],
             details=(
                 UnitDetails.NCHILDREN
-                if with_siblings and unitid not in children
+                if unitid in child_counts
                 else UnitDetails.MINIMAL
             ),
+            child_count=child_counts.get(unitid),
         )
 
         if unitid in children:
@@ -566,10 +630,48 @@ def get_unit_tree(c, unitids, with_siblings=False):
 
         return r
 
+    def get_children(parentid, orgid):
+        # the index might be outdated, so we search for the children,
+        # even though we've most likely prefetched them
+        return dict(c.organisationenhed.get_all(
+            overordnet=parentid,
+            tilhoerer=orgid,
+            gyldighed='Aktiv'
+        ))
+
+    def prefetch():
+        '''Use the index of the hierarchy to fetch every unit we're
+        likely to need in one go, rather than level by level.'''
+        needed = set()
+
+        for unitid, unit in c.organisationenhed.get_all(
+            uuid=unitids,
+            limit=len(unitids),
+        ):
+            orgid = next(mapping.BELONGS_TO_FIELD.get_uuids(unit), None)
+            unit_hierarchy = hierarchy.get_hierarchy(orgid)
+
+            if not unit_hierarchy:
+                continue
+
+            ancestors = unit_hierarchy.get_ancestors(unitid, c.start, c.end)
+
+            needed.update(ancestors)
+
+            if with_siblings:
+                for parentid in [orgid] + ancestors:
+                    needed.update(unit_hierarchy.get_children(
+                        parentid, c.start, c.end,
+                    ))
+
+        c.organisationenhed.prefetch(needed)
+
     orgs = set()
     units = {}
     children = collections.defaultdict(set)
 
+    prefetch()
+
     leaves = set(unitids)
 
     while leaves:
@@ -589,11 +691,7 @@ def get_unit_tree(c, unitids, with_siblings=False):
             parentid = get_parent(leafid)
 
             if with_siblings:
-                siblings = dict(c.organisationenhed.get_all(
-                    overordnet=parentid,
-                    tilhoerer=get_org(leafid),
-                    gyldighed='Aktiv'
-                ))
+                siblings = get_children(parentid, get_org(leafid))
 
                 units.update(siblings)
                 children[parentid].update(siblings.keys())
@@ -608,6 +706,13 @@ def get_unit_tree(c, unitids, with_siblings=False):
     if not orgs:
         exceptions.ErrorCodes.E_ORG_UNIT_NOT_FOUND(org_unit_uuid=unitids)
 
+    # count the children of all leaves in one go
+    child_counts = get_child_counts(c, {
+        unitid: unit
+        for unitid, unit in units.items()
+        if with_siblings and unitid not in children
+    })
+
     return get_units(
         child
         for org in orgs
@@ -686,7 +791,7 @@ def get_orgunit(unitid):
 
 
 @blueprint.route('/o/<uuid:orgid>/ou/')
-@util.restrictargs('at', 'start', 'limit', 'query')
+@util.restrictargs('at', 'start', 'limit', 'query', 'stream')
 def list_orgunits(orgid):
     '''Query organisational units in an organisation.
 
@@ -699,6 +804,10 @@ def list_orgunits(orgid):
     :queryparam int start: Index of first unit for paging.
     :queryparam int limit: Maximum items
     :queryparam string query: Filter by units matching this string.
+    :queryparam string stream: Send the items as they're serialised,
+        rather than all at once; useful for very large pages. Use
+        ``ndjson`` for newline-delimited JSON with one item per line,
+        omitting ``offset`` and ``total``.
 
     :>json string items: The returned items.
     :>json string offset: Pagination offset.
@@ -755,13 +864,16 @@ def list_orgunits(orgid):
     if 'query' in args:
         kwargs.update(vilkaarligattr='%{}%'.format(args['query']))
 
-    return flask.jsonify(
-        c.organisationenhed.paged_get(
-            functools.partial(get_one_orgunit, details=UnitDetails.MINIMAL),
-            **kwargs,
-        )
+    stream = util.get_stream_format()
+
+    page = c.organisationenhed.paged_get(
+        functools.partial(get_one_orgunit, details=UnitDetails.MINIMAL),
+        lazy=bool(stream),
+        **kwargs,
     )
 
+    return util.jsonify_stream(page, page['items'], stream)
+
 
 @blueprint.route('/o/<uuid:orgid>/ou/tree')
 @util.restrictargs('at', 'query', 'uuid')
@@ -74,8 +74,7 @@ class RoleRequestHandler(handlers.OrgFunkRequestHandler):
     def prepare_edit(self, req: dict):
         role_uuid = req.get('uuid')
         # Get the current org-funktion which the user wants to change
-        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
-        original = c.organisationfunktion.get(uuid=role_uuid)
+        original = self.get_original(role_uuid)
 
         if not original:
             exceptions.ErrorCodes.E_NOT_FOUND(uuid=role_uuid)
@@ -13,13 +13,56 @@ BASE_DIR = _path.dirname(_path.dirname(_path.abspath(__file__)))
 CONFIG_FILE = getenv('OS2MO_CONFIG_FILE',
                      _path.join(BASE_DIR, '..', 'setup', 'mora.json'))
 
+# the longest GET request to send to LoRA; raise it if your server
+# accepts more, so that bulk lookups need fewer requests
 MAX_REQUEST_LENGTH = 4096
+# for how many seconds to honour any lower limit the server imposed by
+# rejecting a request as too long
+MAX_REQUEST_LENGTH_TTL = 600
+# how many bulk requests to LoRA each lookup may have in flight
+MAX_CONCURRENT_REQUESTS = 5
+# how many writes to LoRA to have in flight at once when creating or
+# editing many details; use 1 to submit them one at a time, in
+# order, stopping at the first failure
+MAX_CONCURRENT_WRITES = 5
 DEFAULT_PAGE_SIZE = 2000
 TREE_SEARCH_LIMIT = 100
 
 LORA_URL = 'http://localhost:8080/'
 CA_BUNDLE = None
 
+# process-wide cache of classes & facets; a size of zero disables it
+# -- changes made through other processes appear once entries expire
+CLASSIFICATION_CACHE_SIZE = 4096
+CLASSIFICATION_CACHE_TTL = 300
+
+# process-wide indexes of the unit hierarchy, one per organisation;
+# again, a size of zero disables them -- changes made through other
+# processes appear once they expire, so we only use them for
+# prefetching and statistics
+ORG_UNIT_HIERARCHY_CACHE_SIZE = 16
+ORG_UNIT_HIERARCHY_CACHE_TTL = 60
+
+# when positive, show the statistics of an organisation from a
+# snapshot refreshed in the background, at most this many seconds
+# old; this also enables counting active employees and functions,
+# which is too slow to do on each request -- each user gets their
+# own snapshot, computed with their credentials
+ORG_STATISTICS_SNAPSHOT_TTL = 0
+# how many of those snapshots to keep, i.e. organisations times users
+ORG_STATISTICS_SNAPSHOT_CACHE_SIZE = 256
+
+# addresses looked up in DAR, along with which of its endpoints had
+# them; a size of zero disables caching
+DAR_ADDRESS_CACHE_SIZE = 4096
+DAR_ADDRESS_CACHE_TTL = 3600
+# how many lookups to have in flight at once when showing many
+# addresses
+DAR_MAX_CONCURRENT_REQUESTS = 10
+# path to a local SQLite copy of DAR, consulted prior to DAWA; see
+# the 'dar import' command
+DAR_STORE_PATH = ''
+
 # for our autocomplete support
 AUTOCOMPLETE_ACCESS_ADDRESS_COUNT = 5
 AUTOCOMPLETE_ADDRESS_COUNT = 10
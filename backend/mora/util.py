@@ -16,6 +16,7 @@ various small functions used in many places.
 
 
 import collections
+import collections.abc
 import copy
 import datetime
 import functools
@@ -24,11 +25,13 @@ import operator
 
 import itertools
 import json
-import marshal
 import os
 import re
+import sqlite3
 import sys
 import tempfile
+import threading
+import time
 import typing
 import urllib.parse
 import uuid
@@ -195,7 +198,72 @@ def to_iso_date(s, is_end: bool=False):
     return dt.date().isoformat()
 
 
+# the timestamps emitted by LoRA, i.e. PostgreSQL, such as
+# '2017-01-01 00:00:00+01', and the ISO 8601 ones we send to it
+_TIMESTAMP_RE = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)'
+    r'(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6}))?)?)?'
+    r'(?:(Z)|([+-])(\d\d)(?::?(\d\d)(?::?(\d\d))?)?)?'
+)
+
+# the amount of parsed timestamps to remember
+TIMESTAMP_CACHE_SIZE = 16384
+
+
+def _parse_timestamp(s: str) -> typing.Optional[datetime.datetime]:
+    '''Parse a timestamp in one of the formats used by LoRA, without
+    resorting to the generic -- and slow -- parsers of
+    :py:mod:`dateutil`. Anything else yields ``None``.
+
+    '''
+    m = _TIMESTAMP_RE.fullmatch(s)
+
+    if not m:
+        return None
+
+    (year, month, day, hour, minute, second, fraction,
+     utc, sign, tzhours, tzminutes, tzseconds) = m.groups()
+
+    try:
+        dt = datetime.datetime(
+            int(year), int(month), int(day),
+            int(hour or 0), int(minute or 0), int(second or 0),
+            int((fraction or '').ljust(6, '0')),
+        )
+
+        if utc:
+            tzinfo = datetime.timezone.utc
+        elif sign:
+            offset = datetime.timedelta(
+                hours=int(tzhours),
+                minutes=int(tzminutes or 0),
+                seconds=int(tzseconds or 0),
+            )
+
+            tzinfo = datetime.timezone(-offset if sign == '-' else offset)
+        else:
+            return dt.replace(tzinfo=DEFAULT_TIMEZONE)
+
+    except ValueError:
+        # e.g. an offset in seconds, which Python 3.6 doesn't support
+        return None
+
+    return dt.replace(tzinfo=tzinfo).astimezone(DEFAULT_TIMEZONE)
+
+
+@functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
 def from_iso_time(s):
+    '''Parse an ISO 8601 timestamp, localised to our default timezone.
+
+    The results are cached, as we typically parse the same handful of
+    timestamps over and over again.
+
+    '''
+    dt = _parse_timestamp(s)
+
+    if dt is not None:
+        return dt
+
     dt = dateutil.parser.isoparse(s)
 
     if not dt.tzinfo:
@@ -384,7 +452,171 @@ def get_cpr_birthdate(number: typing.Union[int, str]) -> datetime.datetime:
         raise ValueError('invalid CPR number {}'.format(number))
 
 
-def cached(func):
+def _as_tuple(obj):
+    '''Recursively convert lists to tuples, undoing their conversion
+    to JSON.'''
+    if isinstance(obj, list):
+        return tuple(map(_as_tuple, obj))
+
+    return obj
+
+
+class PersistentCache(collections.abc.MutableMapping):
+    '''A persistent mapping backed by an SQLite database, suitable for
+    memoising expensive lookups across runs.
+
+    Values must be serialisable as JSON; keys are compared by their
+    JSON representation, using :py:class:`str` for anything else, such
+    as UUIDs. Each write is a single, atomic statement, so several
+    threads or processes may use the same file concurrently. Entries
+    optionally expire after ``ttl`` seconds, and once the cache holds
+    more than ``maxsize`` entries, the oldest ones are evicted.
+
+    The database is only opened on first use.
+
+    .. doctest::
+
+        >>> cache = PersistentCache(':memory:', maxsize=2)
+        >>> cache['a', 1] = 'b'
+        >>> cache['a', 1]
+        'b'
+        >>> len(cache)
+        1
+
+    '''
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        created REAL NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS cache_created ON cache (created);
+    '''
+
+    # amount of writes between checking the size of the cache
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self, path: str, *,
+                 ttl: typing.Optional[float]=None,
+                 maxsize: typing.Optional[int]=None):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__writes = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.__local, 'connection', None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.SCHEMA)
+
+            self.__local.connection = conn
+
+            self.prune()
+
+        return conn
+
+    @staticmethod
+    def _key(key) -> str:
+        return json.dumps(key, sort_keys=True, separators=(',', ':'),
+                          default=str)
+
+    def _min_created(self) -> float:
+        return time.time() - self.ttl if self.ttl else float('-inf')
+
+    def __getitem__(self, key):
+        row = self.connection.execute(
+            'SELECT value FROM cache WHERE key = ? AND created > ?',
+            (self._key(key), self._min_created()),
+        ).fetchone()
+
+        if row is None:
+            raise KeyError(key)
+
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+            (self._key(key), json.dumps(value), time.time()),
+        )
+
+        with self.__lock:
+            self.__writes += 1
+            prune = self.__writes % self.PRUNE_INTERVAL == 0
+
+        if prune:
+            self.prune()
+
+    def __delitem__(self, key):
+        cursor = self.connection.execute(
+            'DELETE FROM cache WHERE key = ?', (self._key(key),),
+        )
+
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __iter__(self):
+        rows = self.connection.execute(
+            'SELECT key FROM cache WHERE created > ?',
+            (self._min_created(),),
+        ).fetchall()
+
+        for (key,) in rows:
+            yield _as_tuple(json.loads(key))
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM cache WHERE created > ?',
+            (self._min_created(),),
+        ).fetchone()[0]
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+    def prune(self):
+        '''Remove expired entries, and the oldest ones exceeding the
+        maximum size.'''
+        conn = self.connection
+
+        if self.ttl:
+            conn.execute('DELETE FROM cache WHERE created <= ?',
+                         (self._min_created(),))
+
+        if self.maxsize is not None:
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                '  SELECT key FROM cache ORDER BY created DESC '
+                '  LIMIT -1 OFFSET ?'
+                ')',
+                (self.maxsize,),
+            )
+
+
+def cached(func=None, *,
+           ttl: typing.Optional[float]=None,
+           maxsize: typing.Optional[int]=None):
+    '''Decorator persistently memoising the results of the given
+    function in a :py:class:`PersistentCache` in the temporary
+    directory.
+
+    The arguments and results of the function must be serialisable as
+    JSON. Use either as ``@cached`` or e.g. ``@cached(ttl=3600)``.
+
+    '''
+
+    if func is None:
+        return functools.partial(cached, ttl=ttl, maxsize=maxsize)
+
     @functools.wraps(func)
     def wrapper(*args):
         try:
@@ -392,12 +624,8 @@ def cached(func):
         except KeyError:
             wrapper.cache[args] = result = func(*args)
 
-            with open(wrapper.cache_file, 'wb') as fp:
-                marshal.dump(wrapper.cache, fp, marshal.version)
-
             return result
 
-    wrapper.cache = {}
     wrapper.uncached = wrapper.__wrapped__
 
     wrapper.cache_file = os.path.join(
@@ -408,18 +636,135 @@ def cached(func):
                 func.__name__,
                 str(os.getuid()),
             ],
-        ) + '.data',
+        ) + '.sqlite3',
     )
 
-    try:
-        with open(wrapper.cache_file, 'rb') as fp:
-            wrapper.cache = marshal.load(fp)
-    except (IOError, EOFError):
-        wrapper.cache = {}
+    wrapper.cache = PersistentCache(wrapper.cache_file,
+                                    ttl=ttl, maxsize=maxsize)
 
     return wrapper
 
 
+class LRUCache:
+    '''A thread-safe, size-bounded mapping, optionally expiring its
+    entries after ``ttl`` seconds.
+
+    Once full, the least recently used entry is evicted. The cache
+    counts its hits and misses, available through :py:attr:`stats`;
+    merely checking for a key with ``in`` counts as neither.
+
+    .. doctest::
+
+        >>> cache = LRUCache(2)
+        >>> cache['a'] = 1
+        >>> cache['b'] = 2
+        >>> cache.get('a')
+        1
+        >>> cache['c'] = 3
+        >>> cache.get('b') is None
+        True
+        >>> 'c' in cache
+        True
+        >>> cache.stats
+        {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 1}
+
+    '''
+
+    def __init__(self, maxsize: int, ttl: typing.Optional[float]=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.Lock()
+        self.__data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.values())
+
+    def __contains__(self, key):
+        '''Whether the key has an entry that hasn't expired yet,
+        without counting it as used.'''
+        with self.__lock:
+            try:
+                expiry, value = self.__data[key]
+            except KeyError:
+                return False
+
+            return expiry is None or expiry > time.monotonic()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            try:
+                expiry, value = self.__data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expiry is not None and expiry <= time.monotonic():
+                del self.__data[key]
+                self.misses += 1
+                return default
+
+            self.__data.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def __setitem__(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+
+        with self.__lock:
+            self.__data[key] = expiry, value
+            self.__data.move_to_end(key)
+
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def values(self) -> list:
+        '''Return the entries that haven't expired yet, without
+        counting them as used.'''
+        now = time.monotonic()
+
+        with self.__lock:
+            return [
+                value
+                for expiry, value in self.__data.values()
+                if expiry is None or expiry > now
+            ]
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            try:
+                return self.__data.pop(key)[1]
+            except KeyError:
+                return default
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        now = time.monotonic()
+
+        with self.__lock:
+            return {
+                'size': sum(
+                    expiry is None or expiry > now
+                    for expiry, value in self.__data.values()
+                ),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
 URN_SAFE = frozenset(b'abcdefghijklmnopqrstuvwxyz'
                      b'0123456789'
                      b'+')
@@ -782,6 +1127,109 @@ def get_args_flag(name: str):
         return bool(v)
 
 
+def get_stream_format() -> typing.Optional[str]:
+    '''Get the format requested through the ``stream`` argument of the
+    Flask request.
+
+    This is ``'ndjson'`` when asking for newline-delimited JSON,
+    ``'json'`` for any other true :py:func:`flag <get_args_flag>` and
+    :py:data:`None` otherwise.
+
+    '''
+
+    if flask.request.args.get('stream', '').lower() == 'ndjson':
+        return 'ndjson'
+    elif get_args_flag('stream'):
+        return 'json'
+    else:
+        return None
+
+
+def _is_lazy(obj):
+    return isinstance(obj, collections.abc.Iterator) or (
+        isinstance(obj, dict) and any(map(_is_lazy, obj.values()))
+    )
+
+
+def _iter_json(obj):
+    if isinstance(obj, collections.abc.Iterator):
+        yield '['
+
+        for i, item in enumerate(obj):
+            if i:
+                yield ','
+
+            yield from _iter_json(item)
+
+        yield ']'
+
+    elif _is_lazy(obj):
+        yield '{'
+
+        for i, k in enumerate(sorted(obj)):
+            yield (',' if i else '') + flask.json.dumps(str(k)) + ':'
+            yield from _iter_json(obj[k])
+
+        yield '}'
+
+    else:
+        yield flask.json.dumps(obj)
+
+
+def stream_json(obj) -> flask.Response:
+    '''Like :py:func:`flask.jsonify`, but serialise and send the
+    response as we go, rather than building it in memory first.
+
+    Any iterators in the given object -- such as the ``items`` of a
+    lazy :py:meth:`mora.lora.Scope.paged_get` -- are consumed one
+    item at a time and sent as arrays. A top-level list is sent item
+    by item as well.
+
+    '''
+
+    if isinstance(obj, (list, tuple)):
+        obj = iter(obj)
+
+    def generate():
+        yield from _iter_json(obj)
+        yield '\n'
+
+    return flask.Response(
+        flask.stream_with_context(generate()),
+        mimetype='application/json',
+    )
+
+
+def stream_ndjson(items: typing.Iterable) -> flask.Response:
+    '''Send the given items as newline-delimited JSON, serialising
+    each one as we go.'''
+
+    return flask.Response(
+        flask.stream_with_context(
+            flask.json.dumps(item) + '\n' for item in items
+        ),
+        mimetype='application/x-ndjson',
+    )
+
+
+def jsonify_stream(obj, items: typing.Iterable,
+                   stream: typing.Optional[str]) -> flask.Response:
+    '''Send the given object in the format returned by
+    :py:func:`get_stream_format`.
+
+    As newline-delimited JSON has no room for the object itself, only
+    the ``items`` are sent in that case.
+
+    '''
+
+    if stream == 'ndjson':
+        return stream_ndjson(items)
+    elif stream:
+        return stream_json(obj)
+    else:
+        return flask.jsonify(obj)
+
+
 class StrUUIDConverter(werkzeug.routing.UUIDConverter):
     """Custom URL converter returning UUIDs as strings rather than UUIDs"""
     def to_python(self, value):
@@ -7,11 +7,15 @@
 #
 
 import collections
+import contextlib
 import datetime
 import functools
 import typing
 
+import flask
+
 from . import exceptions
+from . import hierarchy
 from . import lora
 from . import mapping
 from . import util
@@ -30,6 +34,65 @@ def forceable(fn):
     return wrapper
 
 
+def get_shared_connector() -> typing.Optional[lora.Connector]:
+    '''Return the connector shared within :py:func:`prefetched`, if
+    any. It holds the entire history of its objects.'''
+    return flask.g.get('validation_connector')
+
+
+@contextlib.contextmanager
+def prefetched(reqs: typing.Iterable[dict]):
+    '''Look up the units and employees referred to by the given
+    requests at once, and share them between the validations performed
+    within this context, rather than having each validation look them
+    up on its own.
+
+    Any other units and employees, e.g. those of the original object of
+    an edit, are looked up as needed, and shared as well. See
+    :py:func:`get_shared_connector`.
+
+    '''
+
+    c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
+
+    uuids = collections.defaultdict(set)
+
+    # skipping validations means we needn't look anything up for them
+    if util.get_args_flag('force'):
+        reqs = ()
+
+    for req in reqs:
+        if not isinstance(req, dict):
+            continue
+
+        for obj in (req, req.get('data')):
+            if not isinstance(obj, dict):
+                continue
+
+            for key, scope in (
+                (mapping.ORG_UNIT, c.organisationenhed),
+                (mapping.PARENT, c.organisationenhed),
+                (mapping.PERSON, c.bruger),
+            ):
+                value = obj.get(key)
+
+                if isinstance(value, dict) and util.is_uuid(value.get('uuid')):
+                    uuids[scope].add(value['uuid'])
+
+    collections.deque(lora.concurrent_map(
+        lambda args: args[0].prefetch(sorted(args[1])),
+        uuids.items(),
+    ), maxlen=0)
+
+    previous = get_shared_connector()
+    flask.g.validation_connector = c
+
+    try:
+        yield
+    finally:
+        flask.g.validation_connector = previous
+
+
 def _is_date_range_valid(parent: typing.Union[dict, str],
                          startdate: datetime.datetime,
                          enddate: datetime.datetime, lora_scope,
@@ -122,10 +185,10 @@ def is_date_range_in_org_unit_range(org_unit_obj, valid_from, valid_to):
     # query for the full range of effects; otherwise,
     # _get_active_validity() won't return any useful data for time
     # intervals predating the creation of the unit
-    scope = lora.Connector(
+    scope = (get_shared_connector() or lora.Connector(
         virkningfra=util.to_lora_time(util.NEGATIVE_INFINITY),
         virkningtil=util.to_lora_time(util.POSITIVE_INFINITY)
-    ).organisationenhed
+    )).organisationenhed
 
     if org_unit_obj.get('allow_nonexistent'):
         org_unit_valid_from = org_unit_obj.get(mapping.VALID_FROM)
@@ -186,7 +249,18 @@ def is_date_range_in_employee_range(employee_obj: dict,
                               exceptions.ErrorCodes.V_DATE_OUTSIDE_EMPL_RANGE)
     else:
         employee_uuid = employee_obj.get(mapping.UUID)
-        employee = scope.get(employee_uuid)
+        shared = get_shared_connector()
+
+        if shared is None:
+            employee = scope.get(employee_uuid)
+        else:
+            # the shared employee holds its entire history, so restrict
+            # it to the dates in question, just as LoRA would
+            employee = shared.bruger.get(employee_uuid)
+
+            if employee:
+                employee = lora.slice_registration(employee,
+                                                   valid_from, valid_to)
 
         if not employee:
             exceptions.ErrorCodes.E_USER_NOT_FOUND(employee_uuid=employee_uuid)
@@ -245,6 +319,15 @@ def is_candidate_parent_valid(unitid: str, parent: str,
 
     c = lora.Connector(effective_date=from_date)
 
+    unit_hierarchy = hierarchy.get_hierarchy(orgid, build=False)
+
+    if unit_hierarchy:
+        # fetch the candidate and its ancestors at once, rather than
+        # one per level
+        c.organisationenhed.prefetch(
+            [parent] + unit_hierarchy.get_ancestors(parent, c.start, c.end),
+        )
+
     while True:
         # this captures moving to a child as well as moving into a loop
         if parent in seen:
@@ -5,11 +5,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
+import threading
+from unittest.mock import patch
+
 from . import util
 
-from mora.service.address_handler import (dar, ean, email, phone, pnumber,
-                                          text,
-                                          www)
+from mora.service.address_handler import (base, dar, ean, email, phone,
+                                          pnumber, text, www)
 
 
 @util.mock('dawa-addresses.json')
@@ -99,6 +101,143 @@ class DarAddressHandlerTests(util.TestCase):
         self.assertEqual(expected, actual)
 
 
+def make_address(street):
+    return {
+        'vejnavn': street,
+        'husnr': '1',
+        'postnr': '8000',
+        'postnrnavn': 'Aarhus C',
+    }
+
+
+@util.mock()
+class DarAddressLookupTests(util.TestCase):
+    addresses = {
+        'adresser': {
+            '00000000-0000-0000-0000-00000000000a': make_address('Adresse'),
+        },
+        'adgangsadresser': {
+            '00000000-0000-0000-0000-00000000000b': make_address('Adgang'),
+        },
+        'historik/adgangsadresser': {
+            '00000000-0000-0000-0000-00000000000c': make_address('Historik'),
+        },
+    }
+
+    def test_prefetch(self, mock):
+        dawa = util.DAWAStandIn(mock, self.addresses)
+
+        addrids = [
+            '00000000-0000-0000-0000-00000000000a',
+            '00000000-0000-0000-0000-00000000000b',
+            '00000000-0000-0000-0000-00000000000c',
+            '00000000-0000-0000-0000-00000000000d',
+        ]
+
+        dar.DARAddressHandler.prefetch(addrids + addrids)
+
+        # each endpoint in turn, until found
+        self.assertEqual(1 + 2 + 4 + 4, len(dawa.requests))
+        self.assertNotIn(
+            threading.current_thread().name,
+            {thread for endpoint, addrid, thread in dawa.requests},
+        )
+
+        self.assertEqual(
+            [
+                'Adresse 1, 8000 Aarhus C',
+                'Adgang 1, 8000 Aarhus C',
+                'Historik 1, 8000 Aarhus C',
+                'Ukendt',
+            ],
+            [
+                dar.DARAddressHandler(addrid)
+                .get_mo_address_and_properties()['name']
+                for addrid in addrids
+            ],
+        )
+
+        # all served from the cache
+        self.assertEqual(11, len(dawa.requests))
+
+        with self.subTest('unknown addresses'):
+            errors = []
+
+            for i in range(2):
+                with self.assertRaises(LookupError) as cm:
+                    dar.DARAddressHandler._fetch_from_dar(addrids[3])
+
+                errors.append(cm.exception)
+
+            # a fresh error each time, but the same message
+            self.assertIsNot(errors[0], errors[1])
+            self.assertEqual(
+                ["no such address '{}'".format(addrids[3])] * 2,
+                [str(exc) for exc in errors],
+            )
+            self.assertEqual(11, len(dawa.requests))
+
+        with self.subTest('remembering the endpoint'):
+            dar.address_cache.clear()
+            del dawa.requests[:]
+
+            dar.DARAddressHandler.prefetch(addrids[2:3])
+
+            self.assertEqual(
+                [
+                    ('historik/adgangsadresser',
+                     '00000000-0000-0000-0000-00000000000c'),
+                ],
+                [
+                    (endpoint, addrid)
+                    for endpoint, addrid, thread in dawa.requests
+                ],
+            )
+
+        with self.subTest('without a cache'), \
+                patch.object(dar.address_cache, 'maxsize', 0):
+            dar.address_cache.clear()
+            del dawa.requests[:]
+
+            dar.DARAddressHandler.prefetch(addrids)
+
+            self.assertEqual([], dawa.requests)
+
+            self.assertEqual(
+                'Adresse 1, 8000 Aarhus C',
+                dar.DARAddressHandler(addrids[0])
+                .get_mo_address_and_properties()['name'],
+            )
+            self.assertEqual(1, len(dawa.requests))
+
+    def test_prefetch_effects(self, mock):
+        dawa = util.DAWAStandIn(mock, self.addresses)
+
+        base.prefetch_effects([
+            {
+                'relationer': {
+                    'adresser': [{
+                        'objekttype': 'DAR',
+                        'urn': 'urn:dar:00000000-0000-0000-0000-00000000000a',
+                    }],
+                },
+            },
+            {
+                'relationer': {
+                    'adresser': [{
+                        'objekttype': 'EMAIL',
+                        'urn': 'urn:mailto:mail@example.com',
+                    }],
+                },
+            },
+        ])
+
+        self.assertEqual(
+            [('adresser', '00000000-0000-0000-0000-00000000000a')],
+            [(endpoint, addrid) for endpoint, addrid, thread in dawa.requests],
+        )
+
+
 class EANAddressHandlerTests(util.TestCase):
     handler = ean.EANAddressHandler
 
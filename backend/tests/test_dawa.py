@@ -0,0 +1,163 @@
+#
+# Copyright (c) 2017-2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import io
+import json
+import os
+import tempfile
+
+from mora import dawa
+from mora.importing import processors
+from mora.service.address_handler import dar
+
+from . import util
+
+ADDRESS = {
+    'adgangsadresseid': '0a3f507a-da84-32b8-e044-0003ba298018',
+    'dør': None,
+    'etage': '3',
+    'husnr': '43',
+    'id': '0a3f50a0-23c9-32b8-e044-0003ba298018',
+    'kommunekode': '0101',
+    'postnr': '1112',
+    'postnrnavn': 'København K',
+    'supplerendebynavn': None,
+    'vejnavn': 'Pilestræde',
+    'x': 12.57924839,
+    'y': 55.68113676,
+}
+
+ACCESS_ADDRESS = {
+    'betegnelse': 'Pilestræde 43, 1112 København K',
+    'husnr': '43',
+    'id': '0a3f507a-da84-32b8-e044-0003ba298018',
+    'kommunekode': '0101',
+    'postnr': '1112',
+    'postnrnavn': 'København K',
+    'supplerendebynavn': None,
+    'vejnavn': 'Pilestræde',
+    'x': 12.57924839,
+    'y': 55.68113676,
+}
+
+
+class Tests(util.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        self.path = os.path.join(tmpdir.name, 'dar.db')
+
+        self.store = dawa.AddressStore(self.path)
+        self.store.load([ADDRESS, ACCESS_ADDRESS])
+
+    def test_iter_dump(self):
+        objs = [{'id': str(i), 'tekst': 'æ' * i} for i in range(50)]
+
+        for name, text in (
+            ('array', json.dumps(objs, indent=2)),
+            ('compact array', json.dumps(objs, separators=(',', ':'))),
+            ('lines', ''.join(json.dumps(obj) + '\n' for obj in objs)),
+            ('empty', '[]\n'),
+        ):
+            for chunk_size in (1, 7, 1 << 16):
+                with self.subTest(name, chunk_size=chunk_size):
+                    self.assertEqual(
+                        objs if name != 'empty' else [],
+                        list(dawa.iter_dump(io.StringIO(text), chunk_size)),
+                    )
+
+        with self.subTest('truncated'), self.assertRaises(ValueError):
+            list(dawa.iter_dump(io.StringIO(json.dumps(objs)[:-10]), 7))
+
+    def test_store(self):
+        self.assertEqual(2, len(self.store))
+
+        self.assertEqual(ADDRESS, self.store.get(ADDRESS['id']))
+        self.assertEqual(ACCESS_ADDRESS,
+                         self.store.get(ACCESS_ADDRESS['id'].upper()))
+        self.assertIsNone(
+            self.store.get('00000000-0000-0000-0000-000000000000'),
+        )
+
+        self.assertEqual(
+            ADDRESS['id'],
+            self.store.find('Pilestræde  43, 3., 1112 københavn K'),
+        )
+        self.assertEqual(
+            ACCESS_ADDRESS['id'],
+            self.store.find('Pilestræde 43, 1112 København K',
+                            dawa.ACCESS_ADDRESS),
+        )
+        self.assertIsNone(self.store.find('Pilestræde 43, 1112 København K'))
+
+        self.assertEqual(
+            [('Pilestræde 43, 3., 1112 København K', ADDRESS['id'])],
+            self.store.autocomplete('pilestræde 4', dawa.ADDRESS),
+        )
+        self.assertEqual(
+            [('Pilestræde 43, 1112 København K', ACCESS_ADDRESS['id'])],
+            self.store.autocomplete('Pilestræde', dawa.ACCESS_ADDRESS, 101),
+        )
+        self.assertEqual(
+            [],
+            self.store.autocomplete('Pilestræde', dawa.ACCESS_ADDRESS, 751),
+        )
+
+        with self.subTest('reloading'):
+            self.store.load([dict(ADDRESS, etage='4')])
+
+            self.assertEqual(2, len(self.store))
+            self.assertEqual('4', self.store.get(ADDRESS['id'])['etage'])
+
+    @util.mock('importing-wash.json')
+    def test_lookups(self, mock):
+        dawa_requests = util.DAWAStandIn(mock, {}).requests
+
+        with util.override_settings(DAR_STORE_PATH=self.path):
+            self.assertEqual(
+                'Pilestræde 43, 3., 1112 København K',
+                dar.DARAddressHandler(ADDRESS['id']).name,
+            )
+
+            self.assertEqual(
+                ADDRESS['id'],
+                processors.wash_address('Pilestræde 43, 3.', 1112,
+                                        'København K'),
+            )
+
+        self.assertEqual([], dawa_requests)
+
+    @util.mock('reading-organisation.json')
+    def test_autocomplete_fallback(self, mock):
+        mock.get('https://dawa.aws.dk/adgangsadresser/autocomplete',
+                 status_code=503)
+        mock.get('https://dawa.aws.dk/adresser/autocomplete',
+                 status_code=503)
+
+        with util.override_settings(DAR_STORE_PATH=self.path):
+            self.assertRequestResponse(
+                '/service/o/456362c4-0ee4-4e5e-a72c-751239745e62/'
+                'address_autocomplete/?q=Pilestræde&global=1',
+                [
+                    {
+                        'location': {
+                            'name': 'Pilestræde 43, 1112 København K',
+                            'uuid': ACCESS_ADDRESS['id'],
+                        },
+                    },
+                    {
+                        'location': {
+                            'name': 'Pilestræde 43, 3., 1112 København K',
+                            'uuid': ADDRESS['id'],
+                        },
+                    },
+                ],
+            )
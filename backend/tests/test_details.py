@@ -6,10 +6,113 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
+import json
+from unittest.mock import patch
+
+import freezegun
+import requests
+import requests_mock
+
+from mora import lora
+from mora.service import detail_reading
 from mora.service import detail_writing
 
 from . import util
 
+USERS = {
+    '53181ed2-f1de-4c4a-a8fd-ab358c2c454a': 'Anders And',
+    '6ee24785-ee9a-4502-81c2-7697009c9053': 'Fedtmule',
+}
+
+VIRKNING = {
+    'from': '2017-01-01 00:00:00+01',
+    'from_included': True,
+    'to': 'infinity',
+    'to_included': False,
+}
+
+
+def rel(uuid):
+    return [{'uuid': uuid, 'virkning': VIRKNING}]
+
+
+def engagement(userid):
+    return {
+        'attributter': {
+            'organisationfunktionegenskaber': [{
+                'brugervendtnoegle': 'eng',
+                'funktionsnavn': 'Engagement',
+                'virkning': VIRKNING,
+            }],
+        },
+        'relationer': {
+            'opgaver': rel('job'),
+            'organisatoriskfunktionstype': rel('type'),
+            'tilknyttedebrugere': rel(userid),
+            'tilknyttedeenheder': rel('unit'),
+        },
+        'tilstande': {
+            'organisationfunktiongyldighed': [{
+                'gyldighed': 'Aktiv',
+                'virkning': VIRKNING,
+            }],
+        },
+    }
+
+
+OBJECTS = {
+    'organisationfunktion': {
+        'eng' + userid[:4]: engagement(userid)
+        for userid in USERS
+    },
+    'klasse': {
+        classid: {
+            'attributter': {
+                'klasseegenskaber': [{
+                    'brugervendtnoegle': classid,
+                    'titel': classid.title(),
+                    'virkning': VIRKNING,
+                }],
+            },
+        }
+        for classid in ('job', 'type')
+    },
+    'bruger': {
+        userid: {
+            'attributter': {
+                'brugeregenskaber': [{
+                    'brugervendtnoegle': name.lower(),
+                    'brugernavn': name,
+                    'virkning': VIRKNING,
+                }],
+            },
+        }
+        for userid, name in USERS.items()
+    },
+    'organisationenhed': {
+        'unit': {
+            'attributter': {
+                'organisationenhedegenskaber': [{
+                    'brugervendtnoegle': 'unit',
+                    'enhedsnavn': 'Unit',
+                    'virkning': VIRKNING,
+                }],
+            },
+            'relationer': {
+                'enhedstype': rel('2a9e1a13-fb20-4ae4-97b0-a1bb8a2fd2a5'),
+                'overordnet': rel('org'),
+                'tilhoerer': rel('org'),
+            },
+            'tilstande': {
+                'organisationenhedgyldighed': [{
+                    'gyldighed': 'Aktiv',
+                    'virkning': VIRKNING,
+                }],
+            },
+        },
+    },
+}
+
 
 class Tests(util.TestCase):
     maxDiff = None
@@ -69,3 +172,914 @@ class Tests(util.TestCase):
             },
             status_code=400,
         )
+
+        self.assertRequestResponse(
+            '/service/e/details/',
+            {
+                'description': 'Unknown role type.',
+                'error': True,
+                'error_key': 'E_UNKNOWN_ROLE_TYPE',
+                'status': 400,
+                'type': 'blyf',
+            },
+            json={
+                'uuids': ['00000000-0000-0000-0000-000000000000'],
+                'functions': ['engagement', 'blyf'],
+            },
+            status_code=400,
+        )
+
+        self.assertRequestResponse(
+            '/service/e/details/',
+            {
+                'description': "Invalid uuid: 'kaflaflibob'",
+                'error': True,
+                'error_key': 'E_INVALID_UUID',
+                'obj': {
+                    'uuids': ['kaflaflibob'],
+                    'functions': ['engagement'],
+                },
+                'status': 400,
+            },
+            json={
+                'uuids': ['kaflaflibob'],
+                'functions': ['engagement'],
+            },
+            status_code=400,
+        )
+
+        self.assertRequestResponse(
+            '/service/e/details/',
+            {
+                'description': 'Invalid input.',
+                'error': True,
+                'error_key': 'E_INVALID_INPUT',
+                'request': ['00000000-0000-0000-0000-000000000000'],
+                'status': 400,
+            },
+            json=['00000000-0000-0000-0000-000000000000'],
+            status_code=400,
+        )
+
+        self.assertRequestResponse(
+            '/service/e/details/',
+            {
+                'description': 'Invalid input.',
+                'error': True,
+                'error_key': 'E_INVALID_INPUT',
+                'request': None,
+                'status': 400,
+            },
+            method='POST',
+            status_code=400,
+        )
+
+    def mock_objects(self, m):
+        def get(request, context):
+            objs = OBJECTS[request.path.rsplit('/', 1)[-1]]
+
+            if 'uuid' in request.qs:
+                return {
+                    'results': [[
+                        {
+                            'id': objid,
+                            'registreringer': [objs[objid]],
+                        }
+                        for objid in request.qs['uuid']
+                        if objid in objs
+                    ]],
+                }
+
+            # searching for engagements of a user
+            return {
+                'results': [[
+                    funcid
+                    for funcid, funcobj in sorted(objs.items())
+                    if funcobj['relationer']['tilknyttedebrugere'][0]['uuid']
+                    in request.qs['tilknyttedebrugere']
+                ]],
+            }
+
+        for path in OBJECTS:
+            m.get('http://mox/organisation/' + path, json=get)
+            m.get('http://mox/klassifikation/' + path, json=get)
+
+    @freezegun.freeze_time('2018-01-01')
+    @util.mock()
+    def test_bulk_details(self, m):
+        self.mock_objects(m)
+
+        def engagement_for(userid):
+            return {
+                'engagement_type': {
+                    'example': None,
+                    'name': 'Type',
+                    'scope': None,
+                    'user_key': 'type',
+                    'uuid': 'type',
+                },
+                'job_function': {
+                    'example': None,
+                    'name': 'Job',
+                    'scope': None,
+                    'user_key': 'job',
+                    'uuid': 'job',
+                },
+                'org_unit': {
+                    'name': 'Unit',
+                    'user_key': 'unit',
+                    'uuid': 'unit',
+                    'validity': {
+                        'from': '2017-01-01',
+                        'to': None,
+                    },
+                },
+                'person': {
+                    'name': USERS[userid],
+                    'uuid': userid,
+                },
+                'uuid': 'eng' + userid[:4],
+                'validity': {
+                    'from': '2017-01-01',
+                    'to': None,
+                },
+            }
+
+        userids = sorted(USERS) + ['00000000-0000-0000-0000-000000000000']
+
+        self.assertRequestResponse(
+            '/service/e/details/',
+            {
+                userid: {
+                    'engagement': [engagement_for(userid)]
+                    if userid in USERS else [],
+                }
+                for userid in userids
+            },
+            json={
+                'uuids': userids,
+                'functions': ['engagement'],
+            },
+        )
+
+        # one search per user, and then a single lookup of the
+        # engagements, classes, users and units each
+        self.assertEqual(
+            [
+                ('bruger', True),
+                ('klasse', True),
+                ('organisationenhed', True),
+                ('organisationfunktion', False),
+                ('organisationfunktion', False),
+                ('organisationfunktion', False),
+                ('organisationfunktion', True),
+            ],
+            sorted(
+                (r.path.rsplit('/', 1)[-1], 'uuid' in r.qs)
+                for r in m.request_history
+            ),
+        )
+
+    @freezegun.freeze_time('2018-01-01')
+    @util.mock()
+    def test_streaming_details(self, m):
+        self.mock_objects(m)
+
+        userid = sorted(USERS)[0]
+        url = '/service/e/{}/details/engagement'.format(userid)
+
+        earlier = json.loads(
+            json.dumps(engagement(userid)).replace('2017-01-01', '2016-01-01'),
+        )
+
+        with patch.dict(OBJECTS['organisationfunktion'], {
+            'a-later': engagement(userid),
+            'b-earlier': earlier,
+        }):
+            expected = self.client.get(url).json
+
+            self.assertEqual(
+                ['b-earlier', 'a-later', 'eng' + userid[:4]],
+                [obj['uuid'] for obj in expected],
+            )
+
+            with self.subTest('json'):
+                r = self.client.get(url + '?stream=1')
+
+                self.assertEqual(expected,
+                                 json.loads(r.get_data(as_text=True)))
+
+            with self.subTest('ndjson'):
+                r = self.client.get(url + '?stream=ndjson')
+
+                self.assertEqual(
+                    expected,
+                    [
+                        json.loads(line)
+                        for line in r.get_data(as_text=True).splitlines()
+                    ],
+                )
+
+            with self.subTest('lazy'), self.app.test_request_context():
+                details = detail_reading.get_details(
+                    lora.Connector(), 'e', [userid], ['engagement'],
+                    lazy=True,
+                )[userid]['engagement']
+
+                self.assertNotIsInstance(details, list)
+                self.assertEqual(expected, list(details))
+
+    @freezegun.freeze_time('2018-01-01')
+    @util.mock()
+    def test_address_lookups(self, m):
+        unitid = '9d07123e-47ac-4a9a-88c8-da82e3a4bc9e'
+        userids = sorted(USERS)
+
+        def address(i):
+            return {
+                'attributter': {
+                    'organisationfunktionegenskaber': [{
+                        'brugervendtnoegle': 'addr',
+                        'funktionsnavn': 'Adresse',
+                        'virkning': VIRKNING,
+                    }],
+                },
+                'relationer': {
+                    'adresser': [{
+                        'objekttype': 'EMAIL',
+                        'urn': 'urn:mailto:{}@example.com'.format(i),
+                        'virkning': VIRKNING,
+                    }],
+                    'organisatoriskfunktionstype': rel('email'),
+                    'tilknyttedeenheder': rel(unitid),
+                    'tilknyttedebrugere': rel(userids[i % 2]),
+                },
+                'tilstande': {
+                    'organisationfunktiongyldighed': [{
+                        'gyldighed': 'Aktiv',
+                        'virkning': VIRKNING,
+                    }],
+                },
+            }
+
+        objects = dict(OBJECTS)
+        objects['organisationfunktion'] = {
+            'addr{:02d}'.format(i): address(i)
+            for i in range(50)
+        }
+        objects['organisationenhed'] = {
+            unitid: OBJECTS['organisationenhed']['unit'],
+        }
+        objects['bruger'] = {
+            userid: {
+                **userobj,
+                'tilstande': {
+                    'brugergyldighed': [{
+                        'gyldighed': 'Aktiv',
+                        'virkning': VIRKNING,
+                    }],
+                },
+            }
+            for userid, userobj in OBJECTS['bruger'].items()
+        }
+        objects['klasse'] = {
+            'email': {
+                'attributter': {
+                    'klasseegenskaber': [{
+                        'brugervendtnoegle': 'email',
+                        'omfang': 'EMAIL',
+                        'titel': 'Email',
+                        'virkning': VIRKNING,
+                    }],
+                },
+            },
+        }
+
+        def get(request, context):
+            objs = objects[request.path.rsplit('/', 1)[-1]]
+
+            if 'uuid' in request.qs:
+                return {
+                    'results': [[
+                        {
+                            'id': objid,
+                            'registreringer': [objs[objid]],
+                        }
+                        for objid in request.qs['uuid']
+                        if objid in objs
+                    ]],
+                }
+
+            # searching for the addresses of the unit
+            self.assertEqual([unitid], request.qs['tilknyttedeenheder'])
+
+            return {
+                'results': [sorted(objs)],
+            }
+
+        for path in objects:
+            m.get('http://mox/organisation/' + path, json=get)
+            m.get('http://mox/klassifikation/' + path, json=get)
+
+        r = self.client.get(
+            '/service/ou/{}/details/address'.format(unitid),
+        )
+
+        self.assertEqual(200, r.status_code)
+
+        actual = r.json
+
+        self.assertEqual(
+            ['addr{:02d}'.format(i) for i in range(50)],
+            [addr['uuid'] for addr in actual],
+        )
+        self.assertEqual(
+            [USERS[userids[i % 2]] for i in range(50)],
+            [addr['person']['name'] for addr in actual],
+        )
+        self.assertEqual({'Unit'},
+                         {addr['org_unit']['name'] for addr in actual})
+        self.assertEqual({'Email'},
+                         {addr['address_type']['name'] for addr in actual})
+        self.assertEqual(
+            ['{}@example.com'.format(i) for i in range(50)],
+            [addr['value'] for addr in actual],
+        )
+
+        # a search, and then a single lookup of the addresses,
+        # classes, users and units each
+        self.assertEqual(
+            [
+                ('bruger', True),
+                ('klasse', True),
+                ('organisationenhed', True),
+                ('organisationfunktion', False),
+                ('organisationfunktion', True),
+            ],
+            sorted(
+                (r.path.rsplit('/', 1)[-1], 'uuid' in r.qs)
+                for r in m.request_history
+            ),
+        )
+
+    @freezegun.freeze_time('2018-01-01')
+    @util.mock()
+    def test_bulk_create_validation(self, m):
+        unitid = '9d07123e-47ac-4a9a-88c8-da82e3a4bc9e'
+        typeid = '62ec821f-4179-4758-bfdf-134529d186e9'
+        userids = sorted(USERS)
+
+        objects = {
+            'organisationenhed': {
+                unitid: OBJECTS['organisationenhed']['unit'],
+            },
+            'bruger': {
+                userid: {
+                    **userobj,
+                    'tilstande': {
+                        'brugergyldighed': [{
+                            'gyldighed': 'Aktiv',
+                            'virkning': VIRKNING,
+                        }],
+                    },
+                }
+                for userid, userobj in OBJECTS['bruger'].items()
+            },
+        }
+
+        def get(request, context):
+            objs = objects[request.path.rsplit('/', 1)[-1]]
+
+            return {
+                'results': [[
+                    {
+                        'id': objid,
+                        'registreringer': [objs[objid]],
+                    }
+                    for objid in request.qs['uuid']
+                    if objid in objs
+                ]],
+            }
+
+        m.get('http://mox/organisation/organisationenhed', json=get)
+        m.get('http://mox/organisation/bruger', json=get)
+        m.post('http://mox/organisation/organisationfunktion',
+               json={'uuid': 'eng'})
+
+        self.assertRequestResponse(
+            '/service/details/create',
+            ['eng'] * 20,
+            json=[
+                {
+                    'type': 'engagement',
+                    'org_unit': {'uuid': unitid},
+                    'person': {'uuid': userids[i % 2]},
+                    'engagement_type': {'uuid': typeid},
+                    'validity': {
+                        'from': '2017-06-01',
+                        'to': None,
+                    },
+                }
+                for i in range(20)
+            ],
+        )
+
+        # the validations look up the unit and the users just once
+        self.assertEqual(
+            [
+                ('bruger', sorted(userids)),
+                ('organisationenhed', [unitid]),
+            ],
+            sorted(
+                (r.path.rsplit('/', 1)[-1], r.qs['uuid'])
+                for r in m.request_history
+                if r.method == 'GET' and r.qs['virkningfra'] == ['-infinity']
+            ),
+        )
+        self.assertEqual(
+            0,
+            sum(
+                r.path.endswith('/bruger') and
+                r.qs['virkningfra'] != ['-infinity']
+                for r in m.request_history
+            ),
+        )
+
+        with self.subTest('outside the range of the employee'):
+            self.assertRequestResponse(
+                '/service/details/create',
+                {
+                    'description': 'Date range exceeds validity '
+                                   'range of associated employee.',
+                    'error': True,
+                    'error_key': 'V_DATE_OUTSIDE_EMPL_RANGE',
+                    'status': 400,
+                    'employee_uuid': userids[1],
+                    'valid_from': '2017-01-01',
+                    'valid_to': None,
+                },
+                json=[
+                    {
+                        'type': 'engagement',
+                        'org_unit': {'uuid': unitid},
+                        'person': {'uuid': userid},
+                        'engagement_type': {'uuid': typeid},
+                        'validity': {
+                            'from': '2016-06-01' if userid == userids[1]
+                            else '2017-06-01',
+                            'to': None,
+                        },
+                    }
+                    for userid in userids
+                ],
+                status_code=400,
+            )
+
+    @freezegun.freeze_time('2018-01-01')
+    @util.mock()
+    def test_bulk_create_failures(self, m):
+        unitid = '9d07123e-47ac-4a9a-88c8-da82e3a4bc9e'
+        typeid = '62ec821f-4179-4758-bfdf-134529d186e9'
+        userid = sorted(USERS)[0]
+
+        funcids = [
+            '{:08d}-0000-0000-0000-000000000000'.format(i)
+            for i in range(8)
+        ]
+
+        m.get(
+            'http://mox/organisation/organisationenhed',
+            json={
+                'results': [[{
+                    'id': unitid,
+                    'registreringer': [OBJECTS['organisationenhed']['unit']],
+                }]],
+            },
+        )
+        m.get(
+            'http://mox/organisation/bruger',
+            json={
+                'results': [[{
+                    'id': userid,
+                    'registreringer': [OBJECTS['bruger'][userid]],
+                }]],
+            },
+        )
+
+        def put(funcid, ok):
+            m.put(
+                'http://mox/organisation/organisationfunktion/' + funcid,
+                json={'uuid': funcid} if ok else {'message': 'no way'},
+                status_code=200 if ok else 400,
+            )
+
+        def create(funcids):
+            return self.client.post(
+                '/service/details/create?force=1',
+                json=[
+                    {
+                        'type': 'engagement',
+                        'uuid': funcid,
+                        'org_unit': {'uuid': unitid},
+                        'person': {'uuid': userid},
+                        'engagement_type': {'uuid': typeid},
+                        'validity': {
+                            'from': '2017-06-01',
+                            'to': None,
+                        },
+                    }
+                    for funcid in funcids
+                ],
+            )
+
+        for i, funcid in enumerate(funcids):
+            put(funcid, i != 3)
+
+        with self.subTest('partial failure'):
+            r = create(funcids)
+
+            self.assertEqual(500, r.status_code)
+            self.assertEqual('E_PARTIAL_FAILURE', r.json['error_key'])
+            self.assertEqual(
+                funcids[:3] + [None] + funcids[4:],
+                r.json['results'],
+            )
+            self.assertEqual(
+                [(3, 'E_INVALID_INPUT', 'no way')],
+                [
+                    (err['index'], err['error_key'], err['description'])
+                    for err in r.json['errors']
+                ],
+            )
+
+            # everything was submitted, in some order or another
+            self.assertEqual(
+                sorted(funcids),
+                sorted(
+                    r.path.rsplit('/', 1)[-1]
+                    for r in m.request_history
+                    if r.method == 'PUT'
+                ),
+            )
+
+        with self.subTest('total failure'):
+            self.assertRequestResponse(
+                '/service/details/create?force=1',
+                {
+                    'description': 'no way',
+                    'error': True,
+                    'error_key': 'E_INVALID_INPUT',
+                    'status': 400,
+                },
+                json=[
+                    {
+                        'type': 'engagement',
+                        'uuid': funcids[3],
+                        'org_unit': {'uuid': unitid},
+                        'person': {'uuid': userid},
+                        'engagement_type': {'uuid': typeid},
+                        'validity': {
+                            'from': '2017-06-01',
+                            'to': None,
+                        },
+                    },
+                ] * 2,
+                status_code=400,
+            )
+
+        with self.subTest('one at a time'), \
+                util.override_settings(MAX_CONCURRENT_WRITES=1):
+            m.reset_mock()
+
+            r = create(funcids)
+
+            self.assertEqual('E_PARTIAL_FAILURE', r.json['error_key'])
+            self.assertEqual(funcids[:3] + [None] * 5, r.json['results'])
+
+            # we stop at the first failure
+            self.assertEqual(
+                funcids[:4],
+                [
+                    r.path.rsplit('/', 1)[-1]
+                    for r in m.request_history
+                    if r.method == 'PUT'
+                ],
+            )
+
+            put(funcids[3], True)
+
+            self.assertEqual(funcids, create(funcids).json)
+
+        with self.subTest('other errors'):
+            m.put(
+                'http://mox/organisation/organisationfunktion/' + funcids[5],
+                exc=requests.ConnectionError('no connection'),
+            )
+
+            r = create(funcids)
+
+            self.assertEqual('E_PARTIAL_FAILURE', r.json['error_key'])
+            self.assertEqual(
+                funcids[:5] + [None] + funcids[6:],
+                r.json['results'],
+            )
+            self.assertEqual(
+                [(5, 'E_UNKNOWN', 'no connection')],
+                [
+                    (err['index'], err['error_key'], err['description'])
+                    for err in r.json['errors']
+                ],
+            )
+
+    @freezegun.freeze_time('2018-01-01')
+    @util.mock()
+    def test_bulk_edit_originals(self, m):
+        userid = sorted(USERS)[0]
+
+        funcids = [
+            '{:08d}-0000-0000-0000-000000000000'.format(i)
+            for i in range(10)
+        ]
+
+        original = engagement(userid)
+        original['relationer']['tilknyttedeenheder'] = rel(
+            '9d07123e-47ac-4a9a-88c8-da82e3a4bc9e',
+        )
+
+        def get(request, context):
+            return {
+                'results': [[
+                    {
+                        'id': funcid,
+                        'registreringer': [original],
+                    }
+                    for funcid in request.qs['uuid']
+                ]],
+            }
+
+        m.get('http://mox/organisation/organisationfunktion', json=get)
+
+        for funcid in funcids:
+            m.patch(
+                'http://mox/organisation/organisationfunktion/' + funcid,
+                json={'uuid': funcid},
+            )
+
+        self.assertRequestResponse(
+            '/service/details/edit?force=1',
+            funcids + funcids[:1],
+            json=[
+                {
+                    'type': 'engagement',
+                    'uuid': funcid,
+                    'data': {
+                        'job_function': {
+                            'uuid': '3ef81e52-0deb-487d-9d0e-a69bbe0277d8',
+                        },
+                        # prior to the original, so we extend it
+                        'validity': {
+                            'from': '2016-06-01',
+                        },
+                    },
+                }
+                for funcid in funcids + funcids[:1]
+            ],
+        )
+
+        # a single lookup of all originals
+        self.assertEqual(
+            [sorted(funcids)],
+            [
+                sorted(r.qs['uuid'])
+                for r in m.request_history
+                if r.method == 'GET'
+            ],
+        )
+
+        # editing the same object twice yields the same change, as
+        # each edit gets its own copy of the original
+        first, *rest, last = (
+            r.json()
+            for r in m.request_history
+            if r.method == 'PATCH' and r.path.endswith(funcids[0])
+        )
+
+        self.assertEqual([], rest)
+        self.assertEqual(first, last)
+
+    @freezegun.freeze_time('2018-01-01')
+    @util.mock()
+    def test_bulk_terminate(self, m):
+        userids = sorted(USERS)
+
+        functions = {
+            '{:08d}-{}'.format(i, userid[9:]): (userid, engagement(userid))
+            for userid in userids
+            for i in range(3)
+        }
+
+        def get_functions(request, context):
+            if 'uuid' in request.qs:
+                return {
+                    'results': [[
+                        {
+                            'id': funcid,
+                            'registreringer': [functions[funcid][1]],
+                        }
+                        for funcid in request.qs['uuid']
+                    ]],
+                }
+
+            return {
+                'results': [[
+                    funcid
+                    for funcid, (userid, funcobj) in sorted(functions.items())
+                    if userid in request.qs['tilknyttedebrugere']
+                ]],
+            }
+
+        def get_users(request, context):
+            return {
+                'results': [[
+                    {
+                        'id': userid,
+                        'registreringer': [{
+                            **OBJECTS['bruger'][userid],
+                            'tilstande': {
+                                'brugergyldighed': [{
+                                    'gyldighed': 'Aktiv',
+                                    'virkning': VIRKNING,
+                                }],
+                            },
+                        }],
+                    }
+                    for userid in request.qs['uuid']
+                    if userid in USERS
+                ]],
+            }
+
+        failing = set()
+
+        def patch(request, context):
+            objid = request.path.rsplit('/', 1)[-1]
+
+            if objid in failing:
+                context.status_code = 400
+                return {'message': 'no way'}
+
+            return {
+                'uuid': objid,
+            }
+
+        m.get('http://mox/organisation/organisationfunktion',
+              json=get_functions)
+        m.get('http://mox/organisation/bruger', json=get_users)
+        m.patch(requests_mock.ANY, json=patch)
+
+        self.assertRequestResponse(
+            '/service/e/terminate',
+            userids,
+            json=[
+                {
+                    'uuid': userid,
+                    'validity': {
+                        'to': '2018-06-30',
+                    },
+                }
+                for userid in userids
+            ],
+        )
+
+        self.assertEqual(
+            sorted(
+                [('organisationfunktion', funcid) for funcid in functions] +
+                [('bruger', userid) for userid in userids]
+            ),
+            sorted(
+                tuple(r.path.rsplit('/', 2)[-2:])
+                for r in m.request_history
+                if r.method == 'PATCH'
+            ),
+        )
+
+        # one search per user, and then a single lookup of the
+        # functions and users each
+        self.assertEqual(
+            [
+                ('bruger', True),
+                ('organisationfunktion', False),
+                ('organisationfunktion', False),
+                ('organisationfunktion', True),
+            ],
+            sorted(
+                (r.path.rsplit('/', 1)[-1], 'uuid' in r.qs)
+                for r in m.request_history
+                if r.method == 'GET'
+            ),
+        )
+
+        with self.subTest('invalid input'):
+            self.assertRequestResponse(
+                '/service/e/terminate',
+                {
+                    'description': 'Invalid input.',
+                    'error': True,
+                    'error_key': 'E_INVALID_INPUT',
+                    'request': {'uuid': userids[0]},
+                    'status': 400,
+                },
+                json={'uuid': userids[0]},
+                status_code=400,
+            )
+
+        def get_patches():
+            patches = sorted(
+                tuple(r.path.rsplit('/', 2)[-2:])
+                for r in m.request_history
+                if r.method == 'PATCH'
+            )
+
+            m.reset_mock()
+
+            return patches
+
+        def terminate(userids):
+            return self.client.post(
+                '/service/e/terminate',
+                json=[
+                    {
+                        'uuid': userid,
+                        'validity': {
+                            'to': '2018-06-30',
+                        },
+                    }
+                    for userid in userids
+                ],
+            )
+
+        get_patches()
+
+        with self.subTest('unknown employee'):
+            unknown = '00000000-0000-0000-0000-000000000000'
+
+            r = terminate(userids + [unknown])
+
+            self.assertEqual(404, r.status_code)
+            self.assertEqual('E_USER_NOT_FOUND', r.json['error_key'])
+            self.assertEqual(unknown, r.json['employee_uuid'])
+
+            # nothing was written
+            self.assertEqual([], get_patches())
+
+        with self.subTest('duplicate employee'):
+            r = terminate(userids + userids[:1])
+
+            self.assertEqual(400, r.status_code)
+            self.assertEqual('E_INVALID_INPUT', r.json['error_key'])
+            self.assertEqual(userids[:1], r.json['employee_uuid'])
+
+            # nothing was written
+            self.assertEqual([], get_patches())
+
+        with self.subTest('partial failure'):
+            failing.add(sorted(
+                funcid
+                for funcid, (userid, funcobj) in functions.items()
+                if userid == userids[0]
+            )[1])
+
+            r = terminate(userids)
+
+            self.assertEqual(500, r.status_code)
+            self.assertEqual('E_PARTIAL_FAILURE', r.json['error_key'])
+            self.assertEqual([None] + userids[1:], r.json['results'])
+            self.assertEqual(
+                [(0, 'E_INVALID_INPUT', 'no way')],
+                [
+                    (err['index'], err['error_key'], err['description'])
+                    for err in r.json['errors']
+                ],
+            )
+
+            # every function was submitted, but only the employees
+            # terminated in full got a history entry
+            self.assertEqual(
+                sorted(
+                    [('organisationfunktion', funcid)
+                     for funcid in functions] +
+                    [('bruger', userid) for userid in userids[1:]]
+                ),
+                get_patches(),
+            )
+
+        with self.subTest('total failure'):
+            r = terminate(userids[:1])
+
+            self.assertEqual(400, r.status_code)
+            self.assertEqual('E_INVALID_INPUT', r.json['error_key'])
+            self.assertEqual(
+                [('organisationfunktion', funcid)
+                 for funcid, (userid, funcobj) in sorted(functions.items())
+                 if userid == userids[0]],
+                get_patches(),
+            )
@@ -0,0 +1,347 @@
+#
+# Copyright (c) 2017-2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import threading
+import time
+from unittest.mock import patch
+
+from mora import hierarchy
+from mora import lora
+from mora import util as mora_util
+from mora.service import orgunit
+
+from . import util
+
+
+def make_unit(parents, active=(('2000-01-01', 'infinity'),)):
+    return {
+        'relationer': {
+            'overordnet': [
+                {
+                    'uuid': parentid,
+                    'virkning': {
+                        'from': start,
+                        'to': end,
+                    },
+                }
+                for parentid, start, end in parents
+            ],
+            'tilhoerer': [
+                {
+                    'uuid': 'org',
+                    'virkning': {
+                        'from': '2000-01-01',
+                        'to': 'infinity',
+                    },
+                },
+            ],
+        },
+        'tilstande': {
+            'organisationenhedgyldighed': [
+                {
+                    'gyldighed': 'Aktiv',
+                    'virkning': {
+                        'from': start,
+                        'to': end,
+                    },
+                }
+                for start, end in active
+            ],
+        },
+    }
+
+
+UNITS = {
+    'root': make_unit([('org', '2000-01-01', 'infinity')]),
+    'a': make_unit([('root', '2000-01-01', 'infinity')]),
+    'b': make_unit([('root', '2000-01-01', 'infinity')],
+                   active=[('2000-01-01', '2010-01-01')]),
+    'c': make_unit([('a', '2000-01-01', '2010-01-01'),
+                    ('b', '2010-01-01', 'infinity')]),
+    'd': make_unit([('c', '2000-01-01', 'infinity')]),
+}
+
+
+def at(date):
+    start = mora_util.parsedatetime(date)
+
+    return start, start + mora_util.MINIMAL_INTERVAL
+
+
+class Tests(util.TestCase):
+    def test_queries(self):
+        h = hierarchy.UnitHierarchy('org', UNITS.items())
+
+        self.assertEqual(5, len(h))
+        self.assertIn('d', h)
+        self.assertNotIn('org', h)
+
+        self.assertEqual('org', h.get_parent('root', *at('2005-01-01')))
+        self.assertEqual('a', h.get_parent('c', *at('2005-01-01')))
+        self.assertEqual('b', h.get_parent('c', *at('2015-01-01')))
+        self.assertIsNone(h.get_parent('c', *at('1990-01-01')))
+        self.assertIsNone(h.get_parent('x', *at('2005-01-01')))
+
+        self.assertEqual(['c', 'a', 'root'],
+                         h.get_ancestors('d', *at('2005-01-01')))
+        self.assertEqual(['c', 'b', 'root'],
+                         h.get_ancestors('d', *at('2015-01-01')))
+        self.assertEqual([], h.get_ancestors('root', *at('2005-01-01')))
+
+        self.assertEqual(['root'], h.get_children('org', *at('2005-01-01')))
+        self.assertEqual(['a', 'b'], h.get_children('root',
+                                                    *at('2005-01-01')))
+        self.assertEqual(['a'], h.get_children('root', *at('2015-01-01')))
+        self.assertEqual(['c'], h.get_children('a', *at('2005-01-01')))
+        self.assertEqual([], h.get_children('a', *at('2015-01-01')))
+
+        self.assertEqual(1, h.count_children('b', *at('2015-01-01')))
+        self.assertEqual(0, h.count_children('b', *at('2005-01-01')))
+
+        self.assertEqual(5, h.count_active(*at('2005-01-01')))
+        self.assertEqual(4, h.count_active(*at('2015-01-01')))
+        self.assertEqual(0, h.count_active(*at('1990-01-01')))
+
+        with self.subTest('within an interval'):
+            start, end = (mora_util.parsedatetime('2005-01-01'),
+                          mora_util.parsedatetime('2015-01-01'))
+
+            self.assertEqual('a', h.get_parent('c', start, end))
+            self.assertEqual(['a', 'b'], h.get_children('root', start, end))
+            self.assertEqual(['c'], h.get_children('b', start, end))
+
+    def test_update(self):
+        h = hierarchy.UnitHierarchy('org', UNITS.items())
+
+        h.update([
+            # moved
+            ('d', make_unit([('b', '2000-01-01', 'infinity')])),
+            # created
+            ('e', make_unit([('a', '2000-01-01', 'infinity')])),
+            # deleted
+            ('b', None),
+        ])
+
+        self.assertEqual(['c', 'e'], h.get_children('a', *at('2005-01-01')))
+        self.assertEqual([], h.get_children('c', *at('2005-01-01')))
+        self.assertEqual(['a'], h.get_children('root', *at('2005-01-01')))
+        self.assertNotIn('b', h)
+        self.assertEqual(['c', 'd'], h.get_children('b', *at('2015-01-01')))
+        self.assertEqual([], h.get_ancestors('d', *at('2005-01-01')))
+
+    def test_loops(self):
+        h = hierarchy.UnitHierarchy('org', [
+            ('a', make_unit([('b', '2000-01-01', 'infinity')])),
+            ('b', make_unit([('a', '2000-01-01', 'infinity')])),
+        ])
+
+        self.assertEqual(['b'], h.get_ancestors('a', *at('2005-01-01')))
+
+    @util.mock()
+    def test_caching(self, m):
+        m.get(
+            'http://mox/organisation/organisationenhed'
+            '?tilhoerer=org&foersteresultat=0&maximalantalresultater=2000'
+            '&virkningfra=-infinity&virkningtil=infinity',
+            complete_qs=True,
+            json={
+                'results': [sorted(UNITS)],
+            },
+        )
+
+        m.get(
+            'http://mox/organisation/organisationenhed'
+            '?uuid=a&uuid=b&uuid=c&uuid=d&uuid=root'
+            '&virkningfra=-infinity&virkningtil=infinity',
+            complete_qs=True,
+            json={
+                'results': [[
+                    {
+                        'id': unitid,
+                        'registreringer': [UNITS[unitid]],
+                    }
+                    for unitid in sorted(UNITS)
+                ]],
+            },
+        )
+
+        h = hierarchy.get_hierarchy('org')
+
+        self.assertEqual(5, len(h))
+        self.assertEqual(2, m.call_count)
+
+        self.assertIs(h, hierarchy.get_hierarchy('org'))
+        self.assertEqual(2, m.call_count)
+
+        with self.subTest('writing invalidates'):
+            m.delete('http://mox/organisation/organisationenhed/d')
+            m.get(
+                'http://mox/organisation/organisationenhed'
+                '?uuid=d&virkningfra=-infinity&virkningtil=infinity',
+                complete_qs=True,
+                json={
+                    'results': [],
+                },
+            )
+
+            lora.Connector().organisationenhed.delete('d')
+
+            # we merely look up the unit we deleted
+            self.assertIs(h, hierarchy.get_hierarchy('org'))
+            self.assertEqual(4, m.call_count)
+
+            self.assertNotIn('d', h)
+            self.assertEqual([], h.get_children('c', *at('2005-01-01')))
+            self.assertEqual(4, len(h))
+
+        with self.subTest('building once'):
+            lora.unit_hierarchy_cache.clear()
+
+            def build(orgid):
+                time.sleep(0.05)
+
+                return hierarchy.UnitHierarchy(orgid, [])
+
+            with patch('mora.hierarchy.build_hierarchy',
+                       side_effect=build) as build_hierarchy:
+                results = []
+
+                threads = [
+                    threading.Thread(target=lambda: results.append(
+                        hierarchy.get_hierarchy('org'),
+                    ))
+                    for i in range(4)
+                ]
+
+                for thread in threads:
+                    thread.start()
+
+                for thread in threads:
+                    thread.join()
+
+            self.assertEqual(1, build_hierarchy.call_count)
+            self.assertEqual(4, len(results))
+            self.assertEqual(1, len(set(map(id, results))))
+
+        with self.subTest('disabled'), \
+                patch.object(lora.unit_hierarchy_cache, 'maxsize', 0):
+            self.assertIsNone(hierarchy.get_hierarchy('org'))
+
+    @util.mock()
+    def test_reading_without_index(self, m):
+        def get_unit(unitid):
+            return {
+                **UNITS[unitid],
+                'attributter': {
+                    'organisationenhedegenskaber': [{
+                        'brugervendtnoegle': unitid,
+                        'enhedsnavn': unitid.title(),
+                        'virkning': {
+                            'from': '2000-01-01',
+                            'to': 'infinity',
+                        },
+                    }],
+                },
+                'relationer': {
+                    **UNITS[unitid]['relationer'],
+                    'enhedstype': [{}],
+                },
+            }
+
+        def get(request, context):
+            return {
+                'results': [[
+                    {
+                        'id': unitid,
+                        'registreringer': [get_unit(unitid)],
+                    }
+                    for unitid in request.qs.get('uuid', [])
+                    if unitid in UNITS
+                ]],
+            }
+
+        m.get('http://mox/organisation/organisationenhed', json=get)
+        m.get('http://mox/organisation/organisation',
+              json={'results': []})
+
+        with self.app.test_request_context():
+            r = orgunit.get_one_orgunit(
+                lora.Connector(), 'd', details=orgunit.UnitDetails.FULL,
+            )
+
+        self.assertEqual('C', r['parent']['name'])
+
+        # a cold cache means reading unit by unit rather than searching
+        # the entire organisation to build the index
+        self.assertEqual(
+            [],
+            [r.url for r in m.request_history if 'uuid' not in r.qs],
+        )
+        self.assertIsNone(lora.unit_hierarchy_cache.get('org'))
+
+    @util.mock()
+    def test_counting_children(self, m):
+        children = {
+            'root': ['a'],
+            'a': [],
+            'b': ['c'],
+            'c': ['d'],
+            'd': [],
+            'x': [],
+        }
+
+        m.get(
+            'http://mox/organisation/organisationenhed',
+            json=lambda request, context: {
+                'results': [children[request.qs['overordnet'][0]]],
+            },
+        )
+
+        c = lora.Connector(virkningfra='2015-01-01',
+                           virkningtil='2015-01-02')
+
+        expected = {
+            'root': 1,
+            'a': 0,
+            'b': 1,
+            'c': 1,
+            'd': 0,
+        }
+
+        with self.subTest('cold'):
+            self.assertEqual(expected, orgunit.get_child_counts(c, UNITS))
+
+            # a search per unit -- never one of the entire organisation
+            self.assertEqual(len(UNITS), m.call_count)
+            self.assertEqual(
+                sorted(UNITS),
+                sorted(r.qs['overordnet'][0] for r in m.request_history),
+            )
+            self.assertIsNone(lora.unit_hierarchy_cache.get('org'))
+
+        with self.subTest('indexed'):
+            lora.unit_hierarchy_cache['org'] = hierarchy.UnitHierarchy(
+                'org', UNITS.items(),
+            )
+
+            calls = m.call_count
+
+            self.assertEqual(expected, orgunit.get_child_counts(c, UNITS))
+            self.assertEqual(calls, m.call_count)
+
+        with self.subTest('partially indexed'):
+            calls = m.call_count
+
+            self.assertEqual(
+                {**expected, 'x': 0},
+                orgunit.get_child_counts(c, {
+                    **UNITS,
+                    'x': make_unit([('root', '2000-01-01', 'infinity')]),
+                }),
+            )
+            self.assertEqual(calls + 1, m.call_count)
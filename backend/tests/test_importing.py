@@ -8,11 +8,19 @@
 
 import json
 import os
+import tempfile
+import threading
+import time
 import uuid
+from unittest.mock import patch
 
+import requests
 import requests_mock
+import urllib3
 
-from mora.importing import processors, spreadsheets
+from mora import util as mora_util
+from mora.importing import aak_engagements
+from mora.importing import pipeline, preimport, processors, spreadsheets
 
 from . import util
 
@@ -68,6 +76,247 @@ class MockTests(util.TestCase):
 
         self.assertEqual(expected, actual)
 
+    @util.mock('importing.json')
+    def test_stream(self, m):
+        for path in (
+            os.path.join(util.FIXTURE_DIR, 'MAGENTA_01.json'),
+            os.path.join(util.IMPORTING_DIR, 'MAGENTA_01.csv'),
+        ):
+            for exact in (False, True):
+                with self.subTest(os.path.basename(path), exact=exact):
+                    self.assertEqual(
+                        list(spreadsheets.convert([path], exact=exact)),
+                        list(spreadsheets.convert([path], exact=exact,
+                                                  stream=True)),
+                    )
+
+    def test_generated_ids(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        path = os.path.join(tmpdir.name, 'units.json')
+
+        with open(path, 'w') as fp:
+            json.dump({
+                'organisationenhed': [
+                    {
+                        'brugervendtnoegle': bvn,
+                        'fra': '2017-01-01',
+                        'til': None,
+                    }
+                    for bvn in ('a', 'b', 'a')
+                ],
+            }, fp)
+
+        def get_ids(objs):
+            return [obj['objektid'] for obj in objs]
+
+        ids = get_ids(spreadsheets.load_data([path])['organisationenhed'])
+
+        self.assertEqual(3, len(set(ids)))
+
+        with self.subTest('reproducible'):
+            self.assertEqual(ids, get_ids(
+                spreadsheets.load_data([path])['organisationenhed'],
+            ))
+
+            self.assertEqual(ids, get_ids(
+                obj for title, obj in spreadsheets.iter_data([path])
+            ))
+
+        with self.subTest('unaffected by other rows'):
+            with open(path, 'w') as fp:
+                json.dump({
+                    'organisationenhed': [
+                        {
+                            'brugervendtnoegle': bvn,
+                            'fra': '2017-01-01',
+                            'til': None,
+                        }
+                        for bvn in ('c', 'a', 'b', 'a')
+                    ],
+                }, fp)
+
+            self.assertEqual(ids, get_ids(
+                spreadsheets.load_data([path])['organisationenhed'],
+            )[1:])
+
+    @util.mock('importing.json')
+    def test_preimport(self, m):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        source = os.path.join(util.FIXTURE_DIR, 'MAGENTA_01.json')
+        path = os.path.join(tmpdir.name, 'MAGENTA_01.jsonl')
+
+        with open(path, 'w') as fp:
+            preimport.run(output=fp, sheets=[source], exact=True,
+                          jobs=1, target=None)
+
+        expected = spreadsheets.load_data([source], exact=True)
+
+        self.assertTrue(preimport.is_preimport(path))
+        self.assertFalse(preimport.is_preimport(source))
+        self.assertFalse(preimport.is_preimport(
+            os.path.join(util.IMPORTING_DIR, 'MAGENTA_01.csv'),
+        ))
+
+        self.assertEqual(list(expected), preimport.get_sheet_names(path))
+
+        for title in ('klasse', 'organisationfunktion', 'kaflaflibob'):
+            with self.subTest(title):
+                self.assertEqual(expected.get(title, []),
+                                 list(preimport.iter_sheet(path, title)))
+
+        for stream in (False, True):
+            with self.subTest('convert', stream=stream):
+                self.assertEqual(
+                    list(spreadsheets.convert([source], exact=True)),
+                    list(spreadsheets.convert([path], exact=True,
+                                              stream=stream)),
+                )
+
+    @util.mock()
+    def test_aak_engagements(self, m):
+        orgid = '456362c4-0ee4-4e5e-a72c-751239745e62'
+        unitid = '9d07123e-47ac-4a9a-88c8-da82e3a4bc9e'
+        classes = {
+            'engagement_type': [{'user_key': 'Ansat', 'uuid': '1'}],
+            'address_type': [
+                {'user_key': 'Email', 'uuid': '2', 'scope': 'EMAIL'},
+                {'user_key': 'Telefon', 'uuid': '3', 'scope': 'PHONE'},
+            ],
+        }
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        path = os.path.join(tmpdir.name, 'engagements.csv')
+
+        with open(path, 'w') as fp:
+            fp.write(
+                '\ufeffObjektID;Tilhoerer;TilknyttetEnhed;Brugernavn;'
+                'BrugervendtNoegle;TilknyttedePersoner;Adresse;Postnummer;'
+                'Postdistrikt;Fra;Til;Email;Telefon\n'
+                '53181ed2-f1de-4c4a-a8fd-ab358c2c454a;{org};{unit};'
+                'Anders And;andersand;1906340000;;;;2017-01-01;2019-01-01;'
+                'anders@andeby.dk;NULL\n'
+                '53181ed2-f1de-4c4a-a8fd-ab358c2c454a;{org};{unit};'
+                'Anders And;andersand;1906340000;;;;2017-01-01;2019-01-01;'
+                'NULL;12345678\n'
+                '6ee24785-ee9a-4502-81c2-7697009c9053;{org};{unit};'
+                'Fedtmule;fedtmule;1205320000;;;;2017-01-01;2019-01-01;'
+                'NULL;NULL\n'
+                .format(org=orgid, unit=unitid)
+            )
+
+        m.get('http://mo/service/o/{}/f/engagement_type/'.format(orgid),
+              json={'data': {'items': classes['engagement_type']}})
+        m.get('http://mo/service/o/{}/f/address_type/'.format(orgid),
+              json={'data': {'items': classes['address_type']}})
+        m.get('http://mox/organisation/organisationenhed', json={
+            'results': [[{
+                'id': unitid,
+                'registreringer': [{
+                    'tilstande': {
+                        'organisationenhedgyldighed': [{
+                            'gyldighed': 'Aktiv',
+                            'virkning': {
+                                'from': '2016-01-01 00:00:00+01',
+                                'to': 'infinity',
+                            },
+                        }],
+                    },
+                }],
+            }]],
+        })
+        m.post('http://mo/service/e/create', json='uuid')
+
+        aak_engagements.run(sheets=[path], target='http://mo/',
+                            delimiter=None, include=None, jobs=4)
+
+        validity = {
+            'from': '2017-01-01T00:00:00+01:00',
+            'to': '2019-01-01T00:00:00+01:00',
+        }
+
+        self.assertEqual(
+            [
+                {
+                    'name': 'Anders And',
+                    'user_key': 'andersand',
+                    'uuid': '53181ed2-f1de-4c4a-a8fd-ab358c2c454a',
+                    'cpr_no': 1906340000,
+                    'org': {'uuid': orgid},
+                    'details': [
+                        {
+                            'type': 'engagement',
+                            'org_unit': {'uuid': unitid},
+                            'engagement_type': classes['engagement_type'][0],
+                            'validity': validity,
+                        },
+                        {
+                            'type': 'address',
+                            'address_type': classes['address_type'][0],
+                            'org': {'uuid': orgid},
+                            'value': 'anders@andeby.dk',
+                            'validity': validity,
+                        },
+                        {
+                            'type': 'address',
+                            'address_type': classes['address_type'][1],
+                            'org': {'uuid': orgid},
+                            'value': '12345678',
+                            'validity': validity,
+                        },
+                    ],
+                },
+                {
+                    'name': 'Fedtmule',
+                    'user_key': 'fedtmule',
+                    'uuid': '6ee24785-ee9a-4502-81c2-7697009c9053',
+                    'cpr_no': 1205320000,
+                    'org': {'uuid': orgid},
+                    'details': [
+                        {
+                            'type': 'engagement',
+                            'org_unit': {'uuid': unitid},
+                            'engagement_type': classes['engagement_type'][0],
+                            'validity': validity,
+                        },
+                    ],
+                },
+            ],
+            sorted(
+                (
+                    r.json() for r in m.request_history
+                    if r.method == 'POST'
+                ),
+                key=lambda user: user['name'],
+            ),
+        )
+
+    def test_uuid_index(self):
+        index = spreadsheets.UUIDIndex({
+            'a': '8efbd074-ad2a-4e6a-afec-1d0b1891f566',
+            'b': 'A6690A5F-1B16-484D-B762-B293BD49FCA1',
+            'c': 'kaflaflibob',
+            'd': None,
+        })
+
+        self.assertEqual(
+            {
+                'a': '8efbd074-ad2a-4e6a-afec-1d0b1891f566',
+                'b': 'A6690A5F-1B16-484D-B762-B293BD49FCA1',
+                'c': 'kaflaflibob',
+                'd': None,
+            },
+            dict(index),
+        )
+        self.assertIsInstance(index._UUIDIndex__data['a'], bytes)
+        self.assertIn('c', index)
+        self.assertNotIn('e', index)
+
     @util.mock('importing-wash.json')
     def test_addr_wash(self, m):
         w = processors.wash_address
@@ -110,3 +359,265 @@ class MockTests(util.TestCase):
 
         self.assertEqual(w('Grundtvigsvej 14, kld.', 8260, 'Viby J'),
                          None)
+
+
+class PipelineTests(util.TestCase):
+    def test_imap(self):
+        lock = threading.Lock()
+        consumed = []
+        running = []
+        finished = []
+
+        def items():
+            for i in range(40):
+                consumed.append(i)
+                yield i
+
+        def func(i):
+            with lock:
+                running.append(i)
+
+                # never more than the amount of jobs at once
+                self.assertLessEqual(len(running), 4)
+
+                # the stages of ten do not overlap
+                self.assertTrue(all(j // 10 == i // 10 for j in running))
+
+            time.sleep(0.001)
+
+            with lock:
+                running.remove(i)
+                finished.append(i)
+
+            if i == 13:
+                raise ValueError(i)
+
+            return 2 * i
+
+        results = []
+
+        for i, future in pipeline.imap(func, items(), jobs=4,
+                                       key=lambda i: i // 10):
+            self.assertTrue(future.done())
+
+            # at most twice the amount of jobs in flight, plus the
+            # one we're waiting to submit
+            self.assertLessEqual(len(consumed) - len(results), 9)
+
+            results.append(
+                (i, future.exception() and future.exception().args),
+            )
+
+            if i != 13:
+                self.assertEqual(2 * i, future.result())
+
+        self.assertEqual(
+            [(i, (13,) if i == 13 else None) for i in range(40)],
+            results,
+        )
+        self.assertEqual(list(range(40)), sorted(finished))
+
+    @util.mock()
+    def test_request(self, m):
+        url = 'http://mox/organisation/organisationenhed/42'
+
+        m.put(url, [
+            {'exc': requests.ConnectionError('nope')},
+            {'status_code': 503},
+            {'status_code': 200, 'json': {'uuid': '42'}},
+        ])
+
+        with patch('time.sleep') as sleep:
+            r = pipeline.request('PUT', url, {'note': 'hej'})
+
+        self.assertEqual({'uuid': '42'}, r.json())
+        self.assertEqual(3, m.call_count)
+        self.assertEqual({'note': 'hej'}, m.last_request.json())
+        self.assertEqual([((0.5,),), ((1.0,),)], sleep.call_args_list)
+
+        with self.subTest('giving up'):
+            m.put(url, status_code=503)
+
+            with patch('time.sleep'):
+                r = pipeline.request('PUT', url, retries=2)
+
+            self.assertEqual(503, r.status_code)
+            self.assertEqual(6, m.call_count)
+
+            m.put(url, exc=requests.ConnectionError('nope'))
+
+            with patch('time.sleep'), \
+                    self.assertRaises(requests.ConnectionError):
+                pipeline.request('PUT', url, retries=1)
+
+            self.assertEqual(8, m.call_count)
+
+        with self.subTest('non-idempotent'):
+            url = 'http://mox/organisation/organisationenhed'
+
+            m.reset_mock()
+            m.post(url, status_code=503)
+
+            with patch('time.sleep'):
+                r = pipeline.request('POST', url)
+
+            self.assertEqual(503, r.status_code)
+            self.assertEqual(1, m.call_count)
+
+            for exc in (requests.ConnectionError('nope'),
+                        requests.ReadTimeout('nope')):
+                m.reset_mock()
+                m.post(url, exc=exc)
+
+                with patch('time.sleep'), self.assertRaises(type(exc)):
+                    pipeline.request('POST', url)
+
+                self.assertEqual(1, m.call_count)
+
+            # but failing to connect is safe to retry
+            m.reset_mock()
+            m.post(url, [
+                {'exc': requests.ConnectTimeout('nope')},
+                {
+                    'exc': requests.ConnectionError(
+                        urllib3.exceptions.MaxRetryError(
+                            None, url,
+                            urllib3.exceptions.NewConnectionError(
+                                None, 'nope',
+                            ),
+                        ),
+                    ),
+                },
+                {'status_code': 201, 'json': {'uuid': '42'}},
+            ])
+
+            with patch('time.sleep'):
+                r = pipeline.request('POST', url)
+
+            self.assertEqual({'uuid': '42'}, r.json())
+            self.assertEqual(3, m.call_count)
+
+    @util.mock('importing.json')
+    def test_run(self, m):
+        m.put(requests_mock.ANY, [
+            {'status_code': 502},
+            {'status_code': 200, 'json': {}},
+        ])
+
+        ids = {
+            path.rsplit('/', 1)[-1].lower()
+            for method, path, obj in spreadsheets.convert(
+                [os.path.join(util.FIXTURE_DIR, 'MAGENTA_01.json')],
+                exact=True,
+            )
+        }
+
+        with patch('time.sleep'):
+            spreadsheets.run(
+                target='http://mox',
+                sheets=[os.path.join(util.FIXTURE_DIR, 'MAGENTA_01.json')],
+                dry_run=False, verbose=False, jobs=4, failfast=True,
+                include=None, check=False, exact=True,
+            )
+
+        # every object was imported after those it refers to
+        imported = set()
+
+        for r in m.request_history:
+            if r.method != 'PUT':
+                continue
+
+            objid = r.path.rsplit('/', 1)[-1]
+
+            for ref in pipeline._get_references(r.json()):
+                if ref in ids:
+                    self.assertIn(ref, imported)
+
+            imported.add(objid)
+
+        self.assertEqual(ids, imported)
+
+    @util.mock('importing.json')
+    def test_manifest(self, m):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        path = os.path.join(tmpdir.name, 'manifest.sqlite3')
+        sheets = [os.path.join(util.FIXTURE_DIR, 'MAGENTA_01.json')]
+        lines = list(spreadsheets.convert(sheets, exact=True))
+
+        failing = lines[-1][1]
+
+        m.put(requests_mock.ANY, json={})
+        m.put('http://mox' + failing, status_code=400, json={})
+
+        def run():
+            calls = m.call_count
+
+            spreadsheets.run(
+                target='http://mox', sheets=sheets,
+                dry_run=False, verbose=False, jobs=4, failfast=False,
+                include=None, check=False, exact=True, manifest=path,
+            )
+
+            return sorted(
+                r.path for r in m.request_history[calls:]
+                if r.method == 'PUT'
+            )
+
+        with self.subTest('initial'):
+            self.assertEqual(len(lines), len(run()))
+
+        with self.subTest('failures'):
+            self.assertEqual([failing.lower()], run())
+
+        with self.subTest('changes'):
+            method, changed, obj = lines[0]
+
+            manifest = mora_util.PersistentCache(path)
+            manifest['http://mox', changed] = 'outdated'
+
+            self.assertEqual(sorted([failing.lower(), changed.lower()]),
+                             run())
+
+    def test_waves(self):
+        def line(objid, *refs):
+            return 'PUT', '/organisation/organisationenhed/' + objid, {
+                'relationer': {
+                    'overordnet': [{'uuid': ref} for ref in refs],
+                    'tilhoerer': [{'urn': 'urn:dk:kommune:751'}],
+                },
+            }
+
+        with self.subTest('hierarchy'):
+            self.assertEqual(
+                [
+                    [line('root', 'org'), line('other')],
+                    [line('child', 'root'), line('sibling', 'root')],
+                    [line('grandchild', 'child', 'other')],
+                ],
+                pipeline.get_waves([
+                    line('grandchild', 'child', 'other'),
+                    line('root', 'org'),
+                    line('child', 'root'),
+                    line('other'),
+                    line('sibling', 'root'),
+                ]),
+            )
+
+        with self.subTest('cycles'):
+            self.assertEqual(
+                [
+                    [line('self', 'self'), line('root')],
+                    [line('a', 'b', 'root'), line('b', 'a')],
+                ],
+                pipeline.get_waves([
+                    line('self', 'self'),
+                    line('a', 'b', 'root'),
+                    line('b', 'a'),
+                    line('root'),
+                ]),
+            )
+
+        with self.subTest('empty'):
+            self.assertEqual([], pipeline.get_waves([]))
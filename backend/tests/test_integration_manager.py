@@ -2303,7 +2303,9 @@ class Tests(util.LoRATestCase):
             'uuid': 'ca76a441-6226-404f-88a9-31e02e420e52',
         }
 
-        # compare them!
+        # compare them! -- using a new connector, as the old one
+        # remembers what it fetched
+        c = lora.Connector(virkningfra='-infinity', virkningtil='infinity')
         actual_lora = c.organisationfunktion.get(manager_uuid)
 
         with self.subTest('LoRA'):
@@ -7,6 +7,7 @@
 #
 
 import datetime
+import json
 
 import freezegun
 
@@ -655,6 +656,32 @@ class Tests(util.LoRATestCase):
              'total': 2}
         )
 
+        with self.subTest('streaming'):
+            self.assertRequestResponse(
+                '/service/o/456362c4-0ee4-4e5e-a72c-751239745e62/e/'
+                '?stream=1',
+                {'items': [{'name': 'Anders And',
+                            'uuid': '53181ed2-f1de-4c4a-a8fd-ab358c2c454a'},
+                           {'name': 'Fedtmule',
+                            'uuid': '6ee24785-ee9a-4502-81c2-7697009c9053'}],
+                 'offset': 0,
+                 'total': 2}
+            )
+
+            r = self.request(
+                '/service/o/456362c4-0ee4-4e5e-a72c-751239745e62/e/'
+                '?stream=ndjson',
+            )
+
+            self.assertEqual('application/x-ndjson', r.mimetype)
+            self.assertEqual(
+                [{'name': 'Anders And',
+                  'uuid': '53181ed2-f1de-4c4a-a8fd-ab358c2c454a'},
+                 {'name': 'Fedtmule',
+                  'uuid': '6ee24785-ee9a-4502-81c2-7697009c9053'}],
+                list(map(json.loads, r.get_data(as_text=True).splitlines())),
+            )
+
         self.assertRequestResponse(
             '/service/e/53181ed2-f1de-4c4a-a8fd-ab358c2c454a/',
             {
@@ -917,6 +944,13 @@ class Tests(util.LoRATestCase):
                 func,
             )
 
+        with self.subTest('streaming'):
+            self.assertRequestResponse(
+                '/service/e/53181ed2-f1de-4c4a-a8fd-ab358c2c454a'
+                '/details/engagement?stream=1',
+                func,
+            )
+
         with self.subTest('past'):
             self.assertRequestResponse(
                 '/service/e/53181ed2-f1de-4c4a-a8fd-ab358c2c454a'
@@ -6,6 +6,12 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
+import collections
+import random
+import threading
+import urllib.parse
+import uuid
+
 import freezegun
 
 from mora import exceptions
@@ -371,6 +377,395 @@ class Tests(util.TestCase):
 
         self.assertIsNone(lora.organisationenhed.get('42'))
 
+    def test_identity_map(self, m):
+        def make_result(*objids):
+            return {
+                'results': [[
+                    {
+                        'id': objid,
+                        'registreringer': [{'note': objid}],
+                    }
+                    for objid in objids
+                ]],
+            }
+
+        m.get(
+            'http://mox/organisation/organisationenhed?uuid=1',
+            json=make_result('1'),
+        )
+
+        c = lora.Connector()
+
+        with self.subTest('repeated get'):
+            self.assertEqual({'note': '1'}, c.organisationenhed.get('1'))
+            self.assertIs(c.organisationenhed.get('1'),
+                          c.organisationenhed.get('1'))
+
+            self.assertEqual(1, m.call_count)
+
+        with self.subTest('other connectors'):
+            lora.Connector().organisationenhed.get('1')
+
+            self.assertEqual(2, m.call_count)
+
+        m.get(
+            'http://mox/organisation/organisationenhed?uuid=2&uuid=3',
+            json=make_result('2'),
+        )
+
+        with self.subTest('bulk fetching only the missing'):
+            self.assertEqual(
+                {
+                    '1': {'note': '1'},
+                    '2': {'note': '2'},
+                },
+                dict(c.organisationenhed.get_all(uuid=['1', '2', '3'])),
+            )
+
+            self.assertEqual(3, m.call_count)
+            self.assertEqual(['2', '3'], m.last_request.qs['uuid'])
+
+        with self.subTest('served from memory'):
+            self.assertEqual({'note': '2'}, c.organisationenhed.get('2'))
+            self.assertIsNone(c.organisationenhed.get('3'))
+
+            c.organisationenhed.prefetch(['1', '2', '3'])
+
+            self.assertEqual(3, m.call_count)
+
+        m.patch(
+            'http://mox/organisation/organisationenhed/1',
+            json={'uuid': '1'},
+        )
+
+        with self.subTest('writing invalidates'):
+            c.organisationenhed.update({}, '1')
+            c.organisationenhed.get('1')
+
+            self.assertEqual(5, m.call_count)
+
+    def test_get_all_concurrently(self, m):
+        objids = sorted(str(uuid.uuid4()) for i in range(200))
+        threads = []
+
+        def fetch(request, context):
+            threads.append(threading.current_thread())
+
+            return {
+                'results': [[
+                    {
+                        'id': objid,
+                        'registreringer': [{'objid': objid}],
+                    }
+                    for objid in urllib.parse.parse_qs(request.query)['uuid']
+                ]],
+            }
+
+        m.get('http://mox/organisation/organisationenhed', json=fetch)
+
+        self.assertEqual(
+            [(objid, {'objid': objid}) for objid in objids],
+            list(lora.Connector().organisationenhed.get_all(
+                uuid=objids,
+                limit=len(objids),
+            )),
+        )
+
+        self.assertEqual(3, m.call_count)
+        self.assertNotIn(threading.main_thread(), threads)
+
+        with self.subTest('sequentially'), \
+                util.override_settings(MAX_CONCURRENT_REQUESTS=1):
+            threads.clear()
+
+            self.assertEqual(
+                objids,
+                [objid for objid, obj in lora.Connector().organisationenhed.
+                 get_all(uuid=objids, limit=len(objids))],
+            )
+
+            self.assertEqual(6, m.call_count)
+            self.assertEqual([threading.main_thread()] * 3, threads)
+
+    def test_get_all_request_length(self, m):
+        objids = sorted(str(uuid.uuid4()) for i in range(300))
+        status = 414
+
+        def fetch(request, context):
+            if len('GET ' + request.url) > 9000:
+                context.status_code = status
+                return {'message': 'URI Too Long'}
+
+            return {
+                'results': [[
+                    {
+                        'id': objid,
+                        'registreringer': [{'objid': objid}],
+                    }
+                    for objid in urllib.parse.parse_qs(request.query)['uuid']
+                ]],
+            }
+
+        m.get('http://mox/organisation/organisationenhed', json=fetch)
+
+        def get_all():
+            return [
+                objid
+                for objid, obj in lora.Connector().organisationenhed.get_all(
+                    uuid=objids,
+                    limit=len(objids),
+                )
+            ]
+
+        with self.subTest('the default limit'):
+            self.assertEqual(objids, get_all())
+            self.assertEqual(4, m.call_count)
+
+        with self.subTest('a larger limit means fewer requests'), \
+                util.override_settings(MAX_REQUEST_LENGTH=9000):
+            m.reset_mock()
+
+            self.assertEqual(objids, get_all())
+            self.assertEqual(2, m.call_count)
+
+        with self.subTest('the server rejects a request'), \
+                util.override_settings(MAX_REQUEST_LENGTH=20000):
+            m.reset_mock()
+
+            self.assertEqual(objids, get_all())
+
+            # the first request fails, and then its halves succeed
+            self.assertEqual(3, m.call_count)
+            self.assertLess(lora._get_max_request_length(), 20000)
+
+        with self.subTest('the rejection is remembered'), \
+                util.override_settings(MAX_REQUEST_LENGTH=20000):
+            m.reset_mock()
+
+            self.assertEqual(objids, get_all())
+            self.assertEqual(3, m.call_count)
+
+        with self.subTest('...for a while'), \
+                util.override_settings(MAX_REQUEST_LENGTH=20000), \
+                freezegun.freeze_time() as frozen:
+            lora._max_request_lengths.clear()
+
+            get_all()
+
+            frozen.tick(lora._max_request_lengths.ttl - 1)
+            self.assertLess(lora._get_max_request_length(), 20000)
+
+            frozen.tick(2)
+            self.assertEqual(20000, lora._get_max_request_length())
+
+        with self.subTest('other errors'), \
+                util.override_settings(MAX_REQUEST_LENGTH=20000):
+            lora._max_request_lengths.clear()
+            m.reset_mock()
+
+            status = 431
+
+            with self.assertRaises(exceptions.HTTPException):
+                get_all()
+
+            # no splitting, nor remembering anything
+            self.assertEqual(1, m.call_count)
+            self.assertEqual(20000, lora._get_max_request_length())
+
+    def test_classification_cache(self, m):
+        def entry(value, start, end):
+            return {
+                'brugervendtnoegle': value,
+                'virkning': {
+                    'from': start,
+                    'to': end,
+                },
+            }
+
+        m.get(
+            'http://mox/klassifikation/klasse?uuid=1'
+            '&virkningfra=-infinity&virkningtil=infinity',
+            complete_qs=True,
+            json={
+                'results': [[{
+                    'id': '1',
+                    'registreringer': [{
+                        'attributter': {
+                            'klasseegenskaber': [
+                                entry('old', '2000-01-01 00:00:00+01',
+                                      '2010-01-01 00:00:00+01'),
+                                entry('new', '2010-01-01 00:00:00+01',
+                                      'infinity'),
+                            ],
+                        },
+                    }],
+                }]],
+            },
+        )
+
+        with self.subTest('slicing the history'):
+            old = lora.Connector(effective_date='2005-01-01').klasse.get('1')
+            new = lora.Connector(effective_date='2015-01-01').klasse.get('1')
+
+            self.assertEqual(
+                ['old'],
+                [e['brugervendtnoegle']
+                 for e in old['attributter']['klasseegenskaber']],
+            )
+            self.assertEqual(
+                ['new'],
+                [e['brugervendtnoegle']
+                 for e in new['attributter']['klasseegenskaber']],
+            )
+            self.assertEqual({}, lora.Connector(
+                effective_date='1990-01-01',
+            ).klasse.get('1'))
+
+        with self.subTest('sharing between connectors'):
+            c = lora.Connector()
+
+            self.assertEqual([('1', {
+                'attributter': {
+                    'klasseegenskaber': [
+                        entry('new', '2010-01-01 00:00:00+01', 'infinity'),
+                    ],
+                },
+            })], list(c.klasse.get_all(uuid=['1'])))
+
+            self.assertEqual(1, m.call_count)
+            self.assertEqual({
+                'size': 1,
+                'maxsize': settings.CLASSIFICATION_CACHE_SIZE,
+                'hits': 3,
+                'misses': 1,
+            }, lora.classification_cache.stats)
+
+        key = 'klassifikation/klasse', '1'
+
+        def patch(request, context):
+            # we only forget the class once written
+            self.assertIn(key, lora.classification_cache)
+
+            return {'uuid': '1'}
+
+        with self.subTest('failed writes keep it'):
+            m.patch('http://mox/klassifikation/klasse/1', status_code=400)
+
+            with self.assertRaises(exceptions.HTTPException):
+                lora.Connector().klasse.update({}, '1')
+
+            self.assertIn(key, lora.classification_cache)
+
+        with self.subTest('forgetting after writing'):
+            m.patch('http://mox/klassifikation/klasse/1', json=patch)
+
+            lora.Connector().klasse.update({}, '1')
+
+            self.assertNotIn(key, lora.classification_cache)
+
+            lora.Connector().klasse.get('1')
+
+            self.assertEqual(4, m.call_count)
+
+        m.delete('http://mox/klassifikation/klasse/1')
+
+        with self.subTest('writing invalidates'):
+            lora.klasse.delete('1')
+            lora.Connector().klasse.get('1')
+
+            self.assertEqual(6, m.call_count)
+
+    def test_get_effects_randomised(self, m):
+        def get_effects(c, reg, relevant, also):
+            # the naive implementation, filtering every entry for
+            # each chunk
+            everything = collections.defaultdict(tuple)
+
+            for group in relevant:
+                everything[group] += relevant[group]
+            for group in also:
+                everything[group] += also[group]
+
+            chunks = c.get_date_chunks({
+                mora_util.parsedatetime(entry['virkning'][k])
+                for group, keys in relevant.items()
+                if group in reg
+                for key in keys
+                if key in reg[group]
+                for entry in reg[group][key]
+                for k in ('from', 'to')
+            })
+
+            for start, end in chunks:
+                effect = {
+                    group: {
+                        key: [
+                            entry
+                            for entry in reg[group][key]
+                            if mora_util.parsedatetime(
+                                entry['virkning']['from']) < end and
+                            mora_util.parsedatetime(
+                                entry['virkning']['to']) > start
+                        ]
+                        for key in everything[group]
+                        if key in reg[group]
+                    }
+                    for group in everything
+                    if group in reg
+                }
+
+                if any(k for g in effect.values() for k in g.values()):
+                    yield start, end, effect
+
+        rng = random.Random(42)
+
+        groups = ('attributter', 'relationer', 'tilstande')
+        keys = ('a', 'b', 'c')
+        dates = ['-infinity', 'infinity'] + [
+            '20{:02d}-01-01T00:00:00+01:00'.format(year)
+            for year in range(5, 15)
+        ]
+
+        def get_entry(i):
+            start, end = sorted(rng.sample(dates, 2),
+                                key=mora_util.parsedatetime)
+
+            return {
+                'uuid': str(i),
+                'virkning': {
+                    'from': start,
+                    'to': end,
+                },
+            }
+
+        def get_keys():
+            return {
+                group: tuple(rng.sample(keys, rng.randint(1, len(keys))))
+                for group in rng.sample(groups, rng.randint(0, len(groups)))
+            }
+
+        for i in range(200):
+            reg = {
+                group: {
+                    key: [get_entry(j) for j in range(rng.randint(0, 4))]
+                    for key in rng.sample(keys, rng.randint(0, len(keys)))
+                }
+                for group in rng.sample(groups, rng.randint(0, len(groups)))
+            }
+            relevant = get_keys()
+            also = get_keys()
+
+            for validity in ('past', 'present', 'future'):
+                c = lora.Connector(validity=validity)
+
+                with self.subTest(i=i, validity=validity):
+                    self.assertEqual(
+                        list(get_effects(c, reg, relevant, also)),
+                        list(c.organisationenhed.get_effects(
+                            reg, relevant, also,
+                        )),
+                    )
+
     @freezegun.freeze_time('2001-01-01', tz_offset=1)
     def test_get_effects_2(self, m):
         URL = (
@@ -6,8 +6,12 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
+import json
 from unittest import mock
 
+from mora import lora
+from mora.service.address_handler import dar
+
 from tests import util
 
 
@@ -40,6 +44,25 @@ class Tests(util.TestCase):
             drop_keys=['stacktrace'],
         )
 
+    def test_cache_statistics(self):
+        with self.assertLogs(self.app.logger, 'DEBUG') as cm:
+            self.client.get('/service/kaflaflibob')
+
+        records = [
+            record for record in cm.records
+            if record.msg == 'cache statistics: %s'
+        ]
+
+        self.assertEqual(1, len(records))
+        self.assertEqual(
+            {
+                'classes': lora.classification_cache.stats,
+                'unit_hierarchies': lora.unit_hierarchy_cache.stats,
+                'dar_addresses': dar.address_cache.stats,
+            },
+            json.loads(records[0].args[0]),
+        )
+
     def test_restrictargs_everywhere(self):
         unfiltered = {
             viewname
@@ -0,0 +1,210 @@
+#
+# Copyright (c) 2017-2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+from unittest.mock import patch
+
+from mora import lora
+from mora.service import org
+
+from tests import util
+
+ORGID = '456362c4-0ee4-4e5e-a72c-751239745e62'
+
+# the amount of objects found for each search, keyed by the last
+# parameter distinguishing them; active ones are half as many
+COUNTS = {
+    'bruger': 10,
+    'Engagement': 8,
+    'Tilknytning': 6,
+    'Orlov': 4,
+    'Rolle': 2,
+    'Leder': 1,
+    'overordnet': 3,
+    'organisationenhed': 5,
+}
+
+
+class Tests(util.TestCase):
+    def mock_lora(self, m):
+        def search(request, context):
+            if 'uuid' in request.qs:
+                return {
+                    'results': [[{
+                        'id': ORGID,
+                        'registreringer': [{
+                            'attributter': {
+                                'organisationegenskaber': [{
+                                    'brugervendtnoegle': 'AU',
+                                    'organisationsnavn': 'Aarhus Universitet',
+                                }],
+                            },
+                        }],
+                    }]],
+                }
+
+            if 'funktionsnavn' in request.qs:
+                count = COUNTS[request.qs['funktionsnavn'][0].title()]
+            elif 'overordnet' in request.qs:
+                count = COUNTS['overordnet']
+            else:
+                count = COUNTS[request.path.rsplit('/', 1)[-1]]
+
+            if 'gyldighed' in request.qs and \
+                    'organisationenhed' not in request.path:
+                count //= 2
+
+            return {
+                'results': [[str(i) for i in range(count)]],
+            }
+
+        for path in ('organisation', 'organisationenhed', 'bruger',
+                     'organisationfunktion'):
+            m.get('http://mox/organisation/' + path, json=search)
+
+    @util.mock()
+    def test_statistics(self, m):
+        self.mock_lora(m)
+
+        expected = {
+            'name': 'Aarhus Universitet',
+            'user_key': 'AU',
+            'uuid': ORGID,
+            'child_count': 3,
+            'unit_count': 5,
+            'person_count': 10,
+            'engagement_count': 8,
+            'association_count': 6,
+            'leave_count': 4,
+            'role_count': 2,
+            'manager_count': 1,
+        }
+
+        with patch.object(lora.unit_hierarchy_cache, 'maxsize', 0):
+            self.assertRequestResponse('/service/o/{}/'.format(ORGID),
+                                       expected)
+
+        self.assertEqual(9, m.call_count)
+
+        with self.subTest('default settings'), \
+                patch('mora.hierarchy.build_hierarchy') as build:
+            # the index is there for the asking, but building it is
+            # far too slow for a request
+            self.assertGreater(lora.unit_hierarchy_cache.maxsize, 0)
+
+            self.assertRequestResponse('/service/o/{}/'.format(ORGID),
+                                       expected)
+
+            build.assert_not_called()
+            self.assertEqual(18, m.call_count)
+
+        with self.subTest('active'):
+            c = lora.Connector()
+
+            with patch.object(lora.unit_hierarchy_cache, 'maxsize', 0):
+                self.assertEqual(
+                    {
+                        **expected,
+                        'active_person_count': 5,
+                        'active_engagement_count': 4,
+                        'active_association_count': 3,
+                        'active_leave_count': 2,
+                        'active_role_count': 1,
+                        'active_manager_count': 0,
+                    },
+                    {
+                        **expected,
+                        **org.get_statistics(c, ORGID, active=True),
+                    },
+                )
+
+    @util.mock()
+    def test_snapshot(self, m):
+        self.mock_lora(m)
+
+        quick = {
+            'name': 'Aarhus Universitet',
+            'user_key': 'AU',
+            'uuid': ORGID,
+            'child_count': 3,
+            'unit_count': 5,
+            'person_count': 10,
+            'engagement_count': 8,
+            'association_count': 6,
+            'leave_count': 4,
+            'role_count': 2,
+            'manager_count': 1,
+        }
+
+        with util.override_settings(ORG_STATISTICS_SNAPSHOT_TTL=3600), \
+                patch.object(lora.unit_hierarchy_cache, 'maxsize', 0):
+            # initially, we just get the quick counts...
+            self.assertRequestResponse('/service/o/{}/'.format(ORGID),
+                                       quick)
+
+            for thread in list(org._refreshing.values()):
+                thread.join()
+
+            # ...and then the snapshot
+            full = {
+                **quick,
+                'active_person_count': 5,
+                'active_engagement_count': 4,
+                'active_association_count': 3,
+                'active_leave_count': 2,
+                'active_role_count': 1,
+                'active_manager_count': 0,
+            }
+
+            self.assertRequestResponse('/service/o/{}/'.format(ORGID), full)
+
+            calls = m.call_count
+
+            self.assertRequestResponse('/service/o/{}/'.format(ORGID), full)
+
+            # only the organisation itself
+            self.assertEqual(calls + 1, m.call_count)
+            self.assertEqual({}, org._refreshing)
+
+            with self.subTest('past'):
+                self.assertRequestResponse(
+                    '/service/o/{}/?at=2017-01-01'.format(ORGID),
+                    quick,
+                )
+
+            with self.subTest('per user'), \
+                    patch.dict(self.app.config, SAML_AUTH_ENABLE=True), \
+                    patch('flask_saml_sso.get_session_attributes',
+                          return_value={'username': ['bob']}):
+                # another user doesn't get the snapshot of the first...
+                self.assertRequestResponse('/service/o/{}/'.format(ORGID),
+                                           quick)
+
+                for thread in list(org._refreshing.values()):
+                    thread.join()
+
+                # ...but rather their own
+                self.assertRequestResponse('/service/o/{}/'.format(ORGID),
+                                           full)
+
+        with self.subTest('never building the index'), \
+                patch('mora.hierarchy.build_hierarchy') as build:
+            self.assertEqual(
+                {
+                    'child_count': 3,
+                    'unit_count': 5,
+                    'person_count': 10,
+                    'engagement_count': 8,
+                    'association_count': 6,
+                    'leave_count': 4,
+                    'role_count': 2,
+                    'manager_count': 1,
+                },
+                org.get_statistics(lora.Connector(), ORGID, build=False),
+            )
+
+            build.assert_not_called()
@@ -6,8 +6,12 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import unittest
+import concurrent.futures
 import datetime
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
 
 import dateutil.tz
 import flask
@@ -92,6 +96,45 @@ class TestUtils(TestCase):
         # test fallback
         self.assertEqual(util.parsedatetime('blyf', 'flaf'), 'flaf')
 
+    def test_parse_lora_timestamps(self):
+        tests = {
+            '2017-01-01 00:00:00+01':
+            '2017-01-01T00:00:00+01:00',
+
+            '2017-07-31 22:00:00+00':
+            '2017-08-01T00:00:00+02:00',
+
+            '2017-07-31T22:00:00Z':
+            '2017-08-01T00:00:00+02:00',
+
+            '2017-07-31T12:34:56.789-0530':
+            '2017-07-31T20:04:56.789000+02:00',
+
+            '2017-07-31T12:34':
+            '2017-07-31T12:34:00+02:00',
+        }
+
+        for value, expected in tests.items():
+            with self.subTest(value):
+                dt = util.parsedatetime(value)
+
+                self.assertEqual(expected, dt.isoformat())
+                self.assertIs(util.DEFAULT_TIMEZONE, dt.tzinfo)
+
+        # not a LoRA timestamp, but still ISO 8601
+        self.assertIsNone(util._parse_timestamp('2017-W01'))
+        self.assertEqual('2017-01-02T00:00:00+01:00',
+                         util.to_lora_time('2017-W01'))
+
+    def test_timestamp_cache(self):
+        util.from_iso_time.cache_clear()
+
+        first = util.parsedatetime('2017-01-01 00:00:00+01')
+        second = util.parsedatetime('2017-01-01 00:00:00+01')
+
+        self.assertIs(first, second)
+        self.assertEqual(1, util.from_iso_time.cache_info().hits)
+
     def test_splitlist(self):
         self.assertEqual(
             list(util.splitlist([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 3)),
@@ -801,6 +844,198 @@ class TestAppUtils(unittest.TestCase):
             self.assertEqual(client.get('/?fest=42').status,
                              '200 OK')
 
+    def test_stream_json(self):
+        app = flask.Flask(__name__)
+
+        @app.route('/<int:count>')
+        def root(count):
+            return util.stream_json({'i': i} for i in range(count))
+
+        client = app.test_client()
+
+        for count in (0, 1, 3):
+            with self.subTest(count=count):
+                r = client.get('/{}'.format(count))
+
+                self.assertTrue(r.is_streamed)
+                self.assertEqual('application/json', r.mimetype)
+                self.assertEqual([{'i': i} for i in range(count)], r.json)
+
+        @app.route('/nested/<int:count>')
+        def nested(count):
+            return util.stream_json({
+                'total': count,
+                'data': {
+                    'items': ({'i': i} for i in range(count)),
+                },
+                'other': [1, 2],
+            })
+
+        @app.route('/ndjson/<int:count>')
+        def ndjson(count):
+            return util.stream_ndjson({'i': i} for i in range(count))
+
+        for count in (0, 1, 3):
+            with self.subTest('nested', count=count):
+                r = client.get('/nested/{}'.format(count))
+
+                self.assertTrue(r.is_streamed)
+                self.assertEqual(
+                    {
+                        'total': count,
+                        'data': {
+                            'items': [{'i': i} for i in range(count)],
+                        },
+                        'other': [1, 2],
+                    },
+                    r.json,
+                )
+
+            with self.subTest('ndjson', count=count):
+                r = client.get('/ndjson/{}'.format(count))
+
+                self.assertTrue(r.is_streamed)
+                self.assertEqual('application/x-ndjson', r.mimetype)
+                self.assertEqual(
+                    ''.join('{{"i": {}}}\n'.format(i) for i in range(count)),
+                    r.get_data(as_text=True),
+                )
+
+    def test_get_stream_format(self):
+        app = flask.Flask(__name__)
+
+        for arg, expected in (
+            ('', None),
+            ('?stream=0', None),
+            ('?stream=1', 'json'),
+            ('?stream=yes', 'json'),
+            ('?stream=ndjson', 'ndjson'),
+            ('?stream=NDJSON', 'ndjson'),
+        ):
+            with self.subTest(arg), app.test_request_context('/' + arg):
+                self.assertEqual(expected, util.get_stream_format())
+
+    def test_persistent_cache(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        path = os.path.join(tmpdir.name, 'cache.sqlite3')
+
+        cache = util.PersistentCache(path)
+        cache['a', 1] = 'b'
+        cache['c', 2] = None
+
+        with self.assertRaises(KeyError):
+            cache['a', 2]
+
+        with self.subTest('persistence'):
+            other = util.PersistentCache(path)
+
+            self.assertEqual('b', other['a', 1])
+            self.assertIsNone(other['c', 2])
+            self.assertEqual({('a', 1), ('c', 2)}, set(other))
+
+        with self.subTest('concurrency'):
+            def write(i):
+                util.PersistentCache(path)['n', i] = i
+
+            with concurrent.futures.ThreadPoolExecutor(8) as executor:
+                list(executor.map(write, range(100)))
+
+            self.assertEqual(102, len(cache))
+            self.assertEqual(list(range(100)),
+                             [cache['n', i] for i in range(100)])
+
+        with self.subTest('size'):
+            cache.clear()
+
+            small = util.PersistentCache(path, maxsize=10)
+
+            with patch('time.time', side_effect=range(100)):
+                for i in range(25):
+                    small[i] = i
+
+            small.prune()
+
+            self.assertEqual(list(range(15, 25)), sorted(small))
+
+        with self.subTest('expiry'):
+            cache.clear()
+
+            expiring = util.PersistentCache(path, ttl=60)
+
+            with patch('time.time', return_value=1000):
+                expiring['x'] = 'y'
+
+            with patch('time.time', return_value=1059):
+                self.assertEqual('y', expiring['x'])
+
+            with patch('time.time', return_value=1060):
+                self.assertNotIn('x', expiring)
+                self.assertEqual(0, len(expiring))
+
+    def test_lru_cache(self):
+        cache = util.LRUCache(2, ttl=60)
+
+        with patch('time.monotonic', return_value=1000):
+            cache['a'] = 1
+
+        with patch('time.monotonic', return_value=1030):
+            cache['b'] = 2
+
+        with patch('time.monotonic', return_value=1059):
+            self.assertIn('a', cache)
+            self.assertNotIn('c', cache)
+            self.assertEqual(2, len(cache))
+
+            # checking for a key is neither a hit nor a miss
+            self.assertEqual(
+                {'size': 2, 'maxsize': 2, 'hits': 0, 'misses': 0},
+                cache.stats,
+            )
+
+        with patch('time.monotonic', return_value=1060):
+            # expired entries don't count, even prior to evicting them
+            self.assertNotIn('a', cache)
+            self.assertEqual(1, len(cache))
+            self.assertEqual(
+                {'size': 1, 'maxsize': 2, 'hits': 0, 'misses': 0},
+                cache.stats,
+            )
+
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(2, cache.get('b'))
+
+            self.assertEqual(
+                {'size': 1, 'maxsize': 2, 'hits': 1, 'misses': 1},
+                cache.stats,
+            )
+
+    def test_cached(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        calls = []
+
+        @util.cached(maxsize=100)
+        def double(x):
+            calls.append(x)
+            return 2 * x
+
+        self.assertEqual('-'.join(__name__.split('.') +
+                                  ['double', str(os.getuid())]),
+                         os.path.basename(double.cache_file).split('.')[0])
+
+        double.cache = util.PersistentCache(
+            os.path.join(tmpdir.name, 'double.sqlite3'),
+        )
+
+        self.assertEqual([2, 4, 2], [double(1), double(2), double(1)])
+        self.assertEqual([1, 2], calls)
+        self.assertEqual(6, double.uncached(3))
+        self.assertEqual([1, 2, 3], calls)
+        self.assertNotIn((3,), double.cache)
+
     def test_mapping_fieldtype(self):
         self.assertEqual("FieldTuple(('relationer', 'tilknyttedeitsystemer'), "
                          "FieldTypes.ADAPTED_ZERO_TO_MANY, None)",
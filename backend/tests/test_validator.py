@@ -35,10 +35,11 @@ class TestIsDateRangeValid(util.TestCase):
             '&virkningtil=3000-01-01T00%3A00%3A00%2B01%3A00'
         )
 
-        c = lora.Connector(virkningfra='2000-01-01',
-                           virkningtil='3000-01-01').organisationenhed
-
         def check(expect, validities):
+            # connectors remember what they fetched, so use a new one
+            c = lora.Connector(virkningfra='2000-01-01',
+                               virkningtil='3000-01-01').organisationenhed
+
             with requests_mock.mock() as m:
                 m.get(
                     URL,
@@ -31,6 +31,8 @@ from oio_rest.utils import test_support
 
 from mora import app, lora, settings
 from mora.importing import spreadsheets
+from mora.service import org
+from mora.service.address_handler import dar
 
 
 TESTS_DIR = os.path.dirname(__file__)
@@ -338,6 +340,38 @@ class mock(requests_mock.Mocker):
             self.__overrider.__exit__(None, None, None)
 
 
+class DAWAStandIn(object):
+    '''Local stand-in for looking up addresses by their ID in DAWA,
+    serving the given addresses through a :py:class:`mock`.
+
+    :param addresses: Address objects keyed by endpoint -- e.g.
+        ``historik/adresser`` -- and then UUID.
+
+    '''
+
+    def __init__(self, mock, addresses):
+        self.addresses = addresses
+        self.requests = []
+
+        mock.get(
+            re.compile('^https://dawa.aws.dk/'
+                       '(historik/)?(adresser|adgangsadresser)\\?'),
+            json=self.__lookup,
+        )
+
+    def __lookup(self, request, context):
+        endpoint = request.path.strip('/')
+        addrid = request.qs['id'][0]
+
+        self.requests.append(
+            (endpoint, addrid, threading.current_thread().name),
+        )
+
+        addrobj = self.addresses.get(endpoint, {}).get(addrid)
+
+        return [addrobj] if addrobj else []
+
+
 class TestCaseMixin(object):
 
     '''Base class for MO testcases w/o LoRA access.
@@ -345,6 +379,28 @@ class TestCaseMixin(object):
 
     maxDiff = None
 
+    def setUp(self):
+        super().setUp()
+
+        # don't let cached classes or units leak from one test to
+        # another
+        lora.classification_cache.clear()
+        lora.unit_hierarchy_cache.clear()
+        lora._max_request_lengths.clear()
+        dar.address_cache.clear()
+        dar.endpoint_cache.clear()
+
+        # nor statistics of organisations, including those still being
+        # computed in the background
+        with org._snapshots_lock:
+            threads = list(org._refreshing.values())
+
+        for thread in threads:
+            thread.join()
+
+        org._snapshots.clear()
+        org._refreshing.clear()
+
     def create_app(self, overrides=None):
         os.makedirs(BUILD_DIR, exist_ok=True)
 